@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+Durable journal of the pending ``QueuedStorage`` operations (transfers to
+the remote storage and deletes), so they survive process restarts. Every
+operation is recorded before it is queued and removed once it is done;
+whatever is left can be replayed with ``manage.py replay_storage_journal``.
+
+Entries remember the process which recorded them: the async tasks run in
+that process, so while it is alive its entries are still queued (or being
+retried) and are not replayed.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import json
+import time
+import errno
+import sqlite3
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+QUEUED_STORAGE_JOURNAL = getattr(settings, 'QUEUED_STORAGE_JOURNAL', '/var/tmp/queued_storage/journal.sqlite3')
+
+TRANSFER = 'transfer'
+DELETE = 'delete'
+
+JournalEntry = namedtuple('JournalEntry', 'id op storage role name settings created pid')
+
+
+def is_running(pid):
+    """
+    Returns whether the process with the given pid is alive.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class StorageJournal(object):
+    """
+    A sqlite journal of pending storage operations, safe to share among
+    threads and processes. The database is opened on first use.
+
+    Writes are autocommitted in WAL mode with ``synchronous=NORMAL``, so a
+    commit is an append to the write-ahead log without waiting for it to
+    be flushed to disk: entries survive the process dying (what the journal
+    is for), only an operating system crash can lose the latest ones.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._setup_lock = threading.Lock()
+        self._ready = False
+
+    def _setup(self, connection):
+        with self._setup_lock:
+            if self._ready:
+                return
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'op TEXT NOT NULL, '
+                'storage TEXT NOT NULL, '
+                'role TEXT, '
+                'name TEXT NOT NULL, '
+                'settings TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'pid INTEGER)'
+            )
+            self._ready = True
+
+    @property
+    def connection(self):
+        # sqlite connections can't be shared among threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    pass
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                self._setup(connection)
+        return connection
+
+    def add(self, op, storage, role, name, local_settings):
+        """
+        Records a pending operation, returns its id.
+        """
+        cursor = self.connection.execute(
+            'INSERT INTO journal (op, storage, role, name, settings, created, pid) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (op, storage, role, name, json.dumps(local_settings), time.time(), os.getpid()),
+        )
+        return cursor.lastrowid
+
+    def done(self, entry_id):
+        """
+        Removes a finished operation.
+        """
+        if entry_id is not None:
+            self.connection.execute('DELETE FROM journal WHERE id = ?', (entry_id,))
+
+    def is_pending(self, entry_id):
+        return self.connection.execute('SELECT 1 FROM journal WHERE id = ?', (entry_id,)).fetchone() is not None
+
+    def pending(self, op=None, older_than=0, in_flight=True):
+        """
+        Returns the pending operations (of the given op) recorded at least
+        ``older_than`` seconds ago, oldest first. Unless ``in_flight``, those
+        recorded by processes still running (whose tasks are still queued
+        or being retried there) are left out.
+        """
+        query = 'SELECT id, op, storage, role, name, settings, created, pid FROM journal WHERE created <= ?'
+        params = [time.time() - older_than]
+        if op is not None:
+            query += ' AND op = ?'
+            params.append(op)
+        query += ' ORDER BY id'
+        entries = [
+            JournalEntry(id, op, storage, role, name, json.loads(local_settings), created, pid)
+            for id, op, storage, role, name, local_settings, created, pid in self.connection.execute(query, params)
+        ]
+        if not in_flight:
+            running = {}
+            pending = []
+            for entry in entries:
+                if entry.pid is not None and entry.pid != os.getpid():
+                    if entry.pid not in running:
+                        running[entry.pid] = is_running(entry.pid)
+                    if running[entry.pid]:
+                        continue
+                pending.append(entry)
+            entries = pending
+        return entries
+
+    def backlog(self):
+        """
+        Returns the number of pending operations by op.
+        """
+        backlog = {TRANSFER: 0, DELETE: 0}
+        backlog.update(self.connection.execute('SELECT op, COUNT(*) FROM journal GROUP BY op'))
+        return backlog
+
+
+_journal = []
+
+
+def get_journal():
+    """
+    Returns the process journal (None if QUEUED_STORAGE_JOURNAL is None).
+    """
+    if not _journal:
+        _journal.append(StorageJournal(QUEUED_STORAGE_JOURNAL) if QUEUED_STORAGE_JOURNAL else None)
+    return _journal[0]
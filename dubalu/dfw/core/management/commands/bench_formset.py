@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which measures building ``FormFieldDict`` for every
+form of a big nested (invoice like) nestedforms formset, with the former
+per form ``SortedDictIndex`` of the whole POST data and with the shared
+prefix index.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import time
+from optparse import make_option
+
+from django import forms
+from django.core.management.base import NoArgsCommand
+from django.forms.formsets import formset_factory
+from django.http import QueryDict
+from django.utils.http import urlencode
+
+from nestedforms.forms import NestedForm, FormSetField, BaseNestedFormSet, AutoDataFormMixin, AutoManagementFormMixin
+
+from dfw.utils import forms as form_utils
+from dfw.utils.datastructures import SortedDictIndex
+
+FIELDS = ('sku', 'description', 'quantity', 'unit', 'price', 'discount', 'tax', 'total')
+
+
+class BaseFormSet(AutoManagementFormMixin, BaseNestedFormSet):
+    pass
+
+
+class ImpuestoForm(AutoDataFormMixin, NestedForm):
+    tasa = forms.CharField(required=False)
+    importe = forms.CharField(required=False)
+
+
+ConceptoForm = type(str('ConceptoForm'), (AutoDataFormMixin, NestedForm), dict(
+    [(name, forms.CharField(required=False)) for name in FIELDS] +
+    [('impuestos', FormSetField(ImpuestoForm, formset=BaseFormSet, extra=0, required=False))]
+))
+
+
+ConceptoFormSet = formset_factory(ConceptoForm, formset=BaseFormSet, extra=0)
+
+
+class LegacyIndex(SortedDictIndex):
+    def prefixed_keys(self, prefix):
+        return (key for key, value in self.range(prefix))
+
+
+def legacy_get_data_index(data):
+    return LegacyIndex(data)
+
+
+class Command(NoArgsCommand):
+    help = "Benchmark FormFieldDict on a big formset"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rows', type='int', dest='rows', default=500,
+            help='Number of forms in the formset.'),
+        make_option('--taxes', type='int', dest='taxes', default=3,
+            help='Number of nested tax rows per form (POST keys the forms must skip).'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Number of times each variant is run.'),
+    )
+
+    def get_data(self, rows, taxes):
+        data = {
+            'conceptos-TOTAL_FORMS': rows,
+            'conceptos-INITIAL_FORMS': 0,
+            'conceptos-MAX_NUM_FORMS': 1000,
+        }
+        for i in range(rows):
+            for name in FIELDS:
+                data['conceptos-%d-%s' % (i, name)] = '%s %d' % (name, i)
+            data['conceptos-%d-impuestos-TOTAL_FORMS' % i] = taxes
+            data['conceptos-%d-impuestos-INITIAL_FORMS' % i] = 0
+            for j in range(taxes):
+                data['conceptos-%d-impuestos-%d-tasa' % (i, j)] = '0.16'
+                data['conceptos-%d-impuestos-%d-importe' % (i, j)] = '%d' % j
+        return urlencode(data)
+
+    def run(self, data, repeat):
+        elapsed = 0
+        for i in range(repeat):
+            # Bound to a new (immutable) QueryDict, as each request does;
+            # the formsets and forms work on a mutable copy of it
+            formset = ConceptoFormSet(QueryDict(data), prefix='conceptos')
+            forms = []
+            for form in formset:
+                forms.append(form)
+                forms.extend(form.fields['impuestos'].widget)
+            start = time.time()
+            field_dicts = [form_utils.FormFieldDict(form) for form in forms]
+            elapsed += time.time() - start
+        return elapsed / repeat, field_dicts
+
+    def handle_noargs(self, **options):
+        data = self.get_data(options['rows'], options['taxes'])
+        self.stdout.write('%d forms, %d POST keys' % (options['rows'], len(QueryDict(data))))
+        saved = form_utils.get_data_index
+        results = []
+        try:
+            for name, get_data_index in (
+                ('SortedDictIndex per form', legacy_get_data_index),
+                ('shared prefix index', saved),
+            ):
+                form_utils.get_data_index = get_data_index
+                elapsed, field_dicts = self.run(data, options['repeat'])
+                results.append([field_dict.fields for field_dict in field_dicts])
+                self.stdout.write('%30s %10.2fms' % (name, elapsed * 1e3))
+        finally:
+            form_utils.get_data_index = saved
+        assert results[0] == results[1]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which hydrates cached (pickled, dehydrated) fragments
+one at a time, the way ``dfw.entities.middleware.get_entity`` does, without
+and with the per-request identity map and the second-level cache, and then
+measures the per-object cost of bulk hydration with the former (unmemoized)
+``hydrated_class_factory`` and constructor based ``transmogrify``.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import time
+import pickle
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import NoArgsCommand
+from django.core.cache import get_cache
+from django.db import connection
+from django.db.backends import util
+from django.test.utils import CaptureQueriesContext
+
+import dehydration
+
+
+def legacy_hydrated_class_factory(model, attrs):
+    class Meta:
+        proxy = True
+        app_label = model._meta.app_label
+
+    name = "%s_Hydrated_%s" % (model.__name__, '_'.join(sorted(list(attrs))))
+    name = util.truncate_name(name, 80, 32)
+
+    overrides = dict([(attr, dehydration.HydratedAttribute(attr, model)) for attr in attrs])
+    overrides["Meta"] = Meta
+    overrides["__module__"] = model.__module__
+    overrides["_deferred"] = True
+    return type(str(name), (model,), overrides)
+
+
+def legacy_transmogrify(cls, obj):
+    new = cls()
+    for k, v in obj.__dict__.items():
+        new.__dict__[k] = v
+    new.pk = obj.pk
+    return new
+
+
+class Command(NoArgsCommand):
+    help = "Benchmark hydrating cached fragments"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--fragments', type='int', dest='fragments', default=10000,
+            help='Number of fragments to hydrate.'),
+        make_option('--objects', type='int', dest='objects', default=500,
+            help='Number of objects in the bulk hydrated page.'),
+    )
+
+    def run(self, fragments):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            for fragment in fragments:
+                fragment = dehydration.hydrate(pickle.loads(fragment))
+                fragment['object'].model
+            elapsed = time.time() - start
+        return elapsed * 1e6 / len(fragments), len(queries)
+
+    def run_objects(self, page, objects, repeat=10):
+        start = time.time()
+        for i in range(repeat):
+            for obj in dehydration.hydrate(pickle.loads(page)):
+                obj.model
+        hydrate_time = time.time() - start
+        start = time.time()
+        for i in range(repeat):
+            for obj in objects:
+                dehydration.transmogrify(ContentType, obj)
+        transmogrify_time = time.time() - start
+        count = len(objects) * repeat
+        return hydrate_time * 1e6 / count, transmogrify_time * 1e6 / count
+
+    def handle_noargs(self, **options):
+        ctypes = list(ContentType.objects.all())
+        self.handle_fragments(ctypes, options)
+        self.handle_objects(ctypes, options)
+
+    def handle_objects(self, ctypes, options):
+        objects = [ctypes[i % len(ctypes)] for i in range(options['objects'])]
+        page = pickle.dumps(dehydration.dehydrate(objects), pickle.HIGHEST_PROTOCOL)
+        saved = dehydration.get_identity_map(), dehydration.hydrated_class_factory, dehydration.transmogrify
+        self.stdout.write('%d objects page' % len(objects))
+        self.stdout.write('%30s %14s %14s' % ('', 'hydrate', 'transmogrify'))
+        dehydration.set_identity_map(None)
+        try:
+            for name, factory, transmogrify in (
+                ('former', legacy_hydrated_class_factory, legacy_transmogrify),
+                ('memoized', saved[1], saved[2]),
+            ):
+                dehydration.hydrated_class_factory = factory
+                dehydration.transmogrify = transmogrify
+                self.stdout.write('%30s %12.2fus %12.2fus' % ((name,) + self.run_objects(page, objects)))
+        finally:
+            dehydration.set_identity_map(saved[0])
+            dehydration.hydrated_class_factory = saved[1]
+            dehydration.transmogrify = saved[2]
+
+    def handle_fragments(self, ctypes, options):
+        fragments = [
+            pickle.dumps(dehydration.dehydrate({'object': ctypes[i % len(ctypes)], 'index': i}), pickle.HIGHEST_PROTOCOL)
+            for i in range(options['fragments'])
+        ]
+        saved = dehydration.get_identity_map(), dehydration.DEHYDRATION_CACHE_TIMEOUT
+        identity_map = dehydration.IdentityMap()
+        self.stdout.write('%d fragments, %d distinct objects' % (len(fragments), len(ctypes)))
+        self.stdout.write('%30s %14s %10s' % ('', 'per fragment', 'queries'))
+        try:
+            for name, identity_map, timeout in (
+                ('no caching', None, 0),
+                ('identity map', identity_map, 0),
+                ('second-level cache', None, 300),
+                ('identity map + cache', identity_map, 300),
+            ):
+                dehydration.set_identity_map(identity_map)
+                dehydration.DEHYDRATION_CACHE_TIMEOUT = timeout
+                if identity_map is not None:
+                    identity_map.start()
+                get_cache(dehydration.DEHYDRATION_CACHE).delete_many([dehydration._cache_key(ContentType, c.pk) for c in ctypes])
+                try:
+                    self.stdout.write('%30s %12.2fus %10d' % ((name,) + self.run(fragments)))
+                finally:
+                    if identity_map is not None:
+                        identity_map.stop()
+        finally:
+            dehydration.set_identity_map(saved[0])
+            dehydration.DEHYDRATION_CACHE_TIMEOUT = saved[1]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which measures ``dfw.utils.json.loads`` on a big
+payload with the former type-guessing ``object_hook`` (every type tried in
+turn), the type-dispatched one and an explicit schema.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import time
+import uuid
+import datetime
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from dfw.utils import json
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split()
+
+SCHEMA = {
+    'id': uuid.UUID,
+    'created': datetime.datetime,
+    'day': datetime.date,
+    'at': datetime.time,
+}
+
+
+class Command(NoArgsCommand):
+    help = "Benchmark the JSON decoder hooks on a big payload"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--size', type='int', dest='size', default=50,
+            help='Approximate payload size in MB.'),
+    )
+
+    def get_payload(self, size):
+        now = datetime.datetime.now()
+        rows = []
+        length = 0
+        i = 0
+        while length < size * 1000000:
+            row = {
+                'id': uuid.uuid1(),
+                'created': now - datetime.timedelta(seconds=i),
+                'day': now.date(),
+                'at': now.time(),
+                'count': i,
+                'name': ' '.join(WORDS[i % 7:i % 7 + 3]),
+                'description': ' '.join(WORDS) * (1 + i % 3),
+            }
+            length += len(json.dumps(row))
+            rows.append(row)
+            i += 1
+        return json.dumps(rows)
+
+    def handle_noargs(self, **options):
+        payload = self.get_payload(options['size'])
+        self.stdout.write('%.1fMB payload' % (len(payload) / 1e6))
+        results = []
+        for name, kwargs in (
+            ('guessing (legacy)', {'object_hook': json.legacy_decoder}),
+            ('type-dispatched', {}),
+            ('schema', {'schema': SCHEMA}),
+        ):
+            start = time.time()
+            results.append(json.loads(payload, **kwargs))
+            self.stdout.write('%20s %8.2fs' % (name, time.time() - start))
+        if not results[0] == results[1] == results[2]:
+            raise CommandError("The decoders returned different results")
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which measures the per-request overhead of
+``DynamicSettingsMiddleware`` for 1, 10 and 100 projects, with frozen
+project snapshots and with the settings being switched on every request.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import re
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from dfw import middleware
+
+
+class Command(NoArgsCommand):
+    help = "Benchmark the DynamicSettingsMiddleware for a growing number of projects"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--requests', type='int', dest='requests', default=10000,
+            help='Number of requests for every run.'),
+        make_option('--projects', dest='projects', default='1,10,100',
+            help='Comma separated number of projects for every run.'),
+    )
+
+    def get_projects(self, count):
+        regex, (project_name, project_suffix, project_settings) = middleware.get_project_settings()[settings.PROJECT]
+        projects = {}
+        for i in range(count):
+            suffix = 'bench%d' % i
+            projects['%s.%s' % (project_name, suffix)] = (
+                re.compile(r'^project%d\.example\.com$' % i),
+                (project_name, suffix, dict(project_settings)),
+            )
+        return projects
+
+    def run(self, mw, projects, requests, header):
+        factory = RequestFactory()
+        names = sorted(projects)
+        response = HttpResponse()
+        start = time.time()
+        for i in range(requests):
+            index = i % len(names)
+            host = 'project%d.example.com' % index
+            request = factory.get('/')
+            request.get_host = lambda: host
+            if header:
+                request.META['HTTP_X_PROJECT'] = names[index]
+            mw.process_request(request)
+            mw.process_response(request, response)
+        return (time.time() - start) * 1e6 / requests
+
+    def handle_noargs(self, **options):
+        requests = options['requests']
+        project_settings_cache = middleware.get_project_settings._cache
+        project_snapshots_cache = middleware.get_project_snapshots._cache
+        saved = dict(project_settings_cache), dict(project_snapshots_cache)
+        self.stdout.write('%10s %16s %16s %16s %16s' % ('projects', 'frozen', 'frozen (host)', 'unfrozen', 'unfrozen (host)'))
+        try:
+            for count in [int(c) for c in options['projects'].split(',')]:
+                projects = self.get_projects(count)
+                project_settings_cache.clear()
+                project_settings_cache[()] = projects
+                project_snapshots_cache.clear()
+                frozen = middleware.DynamicSettingsMiddleware(snapshots=True)
+                unfrozen = middleware.DynamicSettingsMiddleware(snapshots=False)
+                results = (
+                    self.run(frozen, projects, requests, True),
+                    self.run(frozen, projects, requests, False),
+                    self.run(unfrozen, projects, requests, True),
+                    self.run(unfrozen, projects, requests, False),
+                )
+                self.stdout.write('%10d %14.2fus %14.2fus %14.2fus %14.2fus' % ((count,) + results))
+        finally:
+            project_settings_cache.clear()
+            project_settings_cache.update(saved[0])
+            project_snapshots_cache.clear()
+            project_snapshots_cache.update(saved[1])
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which measures creating, stating (``exists()``) and
+listing files with a flat ``FileSystemStorage`` and with the hash and
+``expand_path`` layouts of ``ShardedFileSystemStorage``.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import time
+import errno
+import random
+import shutil
+import tempfile
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from ...storage import FileSystemStorage, ShardedFileSystemStorage, SHARDING_HASH, SHARDING_EXPAND_PATH
+
+LAYOUTS = (
+    # name, names pattern, storage class, storage kwargs
+    ('flat', 'media/%07d.jpg', FileSystemStorage, {}),
+    ('hash', 'media/%07d.jpg', ShardedFileSystemStorage, {'sharding': SHARDING_HASH}),
+    ('flat', 'users/%07d/avatar.jpg', FileSystemStorage, {}),
+    ('expand_path', 'users/%07d/avatar.jpg', ShardedFileSystemStorage, {'sharding': SHARDING_EXPAND_PATH}),
+)
+
+
+class Command(NoArgsCommand):
+    help = "Benchmark flat and sharded FileSystemStorage layouts"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--files', type='int', dest='files', default=1000000,
+            help='Number of files created in each layout.'),
+        make_option('--samples', type='int', dest='samples', default=10000,
+            help='Number of exists() calls.'),
+        make_option('--location', dest='location', default=None,
+            help='Directory where the trees are created (in the filesystem to measure).'),
+    )
+
+    def create(self, storage, names):
+        start = time.time()
+        for name in names:
+            path = storage.path(name)
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                os.makedirs(os.path.dirname(path))
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+            os.close(fd)
+        return time.time() - start
+
+    def stat(self, storage, names, samples):
+        names = [random.choice(names) for i in range(samples)]
+        start = time.time()
+        for name in names:
+            assert storage.exists(name)
+        return time.time() - start
+
+    def list(self, storage, names):
+        start = time.time()
+        directories, files = storage.listdir(names[0].split('/')[0])
+        elapsed = time.time() - start
+        assert len(directories) + len(files) == len(names)
+        return elapsed
+
+    def handle_noargs(self, **options):
+        files = options['files']
+        self.stdout.write('%d files per layout' % files)
+        self.stdout.write('%30s %14s %14s %14s' % ('', 'create', 'exists', 'listdir'))
+        for name, pattern, storage_class, kwargs in LAYOUTS:
+            location = tempfile.mkdtemp(dir=options['location'])
+            try:
+                storage = storage_class(location=location, **kwargs)
+                names = [pattern % i for i in range(files)]
+                create_time = self.create(storage, names)
+                stat_time = self.stat(storage, names, options['samples'])
+                list_time = self.list(storage, names)
+                self.stdout.write('%30s %12.2fus %12.2fus %13.2fs' % (
+                    '%s (%s)' % (name, pattern.split('/')[0]),
+                    create_time * 1e6 / files,
+                    stat_time * 1e6 / options['samples'],
+                    list_time,
+                ))
+            finally:
+                shutil.rmtree(location)
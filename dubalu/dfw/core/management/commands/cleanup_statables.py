@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which runs ``StatableManager.cleanup()`` (the status
+transitions) for every ``AbstractStatableModel`` model, optionally for many
+models at once, and reports the per model counts and durations.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+from optparse import make_option
+from multiprocessing.dummy import Pool
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db.models import get_models
+from django.utils import timezone
+
+from ...plugins.models.statable import AbstractStatableModel, StatableManager
+
+
+class Command(NoArgsCommand):
+    help = "Run the status transitions of all the statable models"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+            help='Maximum number of rows changed per transaction.'),
+        make_option('--max-lock-time', type='float', dest='max_lock_time', default=0.5,
+            help='Chunks taking longer than this many seconds are made smaller.'),
+        make_option('--parallel', type='int', dest='parallel', default=1,
+            help='Number of models cleaned up at once.'),
+    )
+
+    def get_managers(self):
+        for model in get_models():
+            if issubclass(model, AbstractStatableModel) and not model._meta.proxy:
+                manager = model._default_manager
+                if isinstance(manager, StatableManager):
+                    yield model, manager
+
+    def cleanup(self, args):
+        model, manager = args
+        try:
+            return model, manager.cleanup(now=self.now, chunk_size=self.chunk_size, max_lock_time=self.max_lock_time)
+        finally:
+            if self.parallel > 1:
+                connection.close()  # Each thread gets its own connection
+
+    def handle_noargs(self, **options):
+        self.now = timezone.now()
+        self.chunk_size = options['chunk_size']
+        self.max_lock_time = options['max_lock_time']
+        self.parallel = options['parallel']
+        managers = list(self.get_managers())
+
+        if self.parallel > 1:
+            pool = Pool(self.parallel)
+            try:
+                results = pool.imap_unordered(self.cleanup, managers)
+                self.report(results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.report(self.cleanup(args) for args in managers)
+
+    def report(self, results):
+        for model, stats in results:
+            self.stdout.write("%s: %d deleted, %d unpublished, %d published in %d chunks (%.2fs)" % (
+                model._meta.object_name,
+                stats['deleted'],
+                stats['unpublished'],
+                stats['published'],
+                stats['chunks'],
+                stats['duration'],
+            ))
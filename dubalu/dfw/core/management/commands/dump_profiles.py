@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which merges the collapsed stacks flushed by the
+``SamplingProfiler`` of every process (``PROFILER_DIRECTORY/<pid>/``) into
+a collapsed stacks file per URL name, ready for flamegraph tools, e.g.::
+
+    ./manage.py dump_profiles --output=profiles
+    flamegraph.pl profiles/invoice_detail.folded > invoice_detail.svg
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import glob
+import shutil
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from dfw.middleware import PROFILER_DIRECTORY
+from dfw.utils.profiler import collapsed_filename, read_collapsed, write_collapsed
+
+
+class Command(NoArgsCommand):
+    help = "Merge the sampled request profiles of all processes into flamegraph collapsed stacks"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--directory', dest='directory', default=PROFILER_DIRECTORY,
+            help='Directory where the processes flush their profiles.'),
+        make_option('--output', dest='output', default=None,
+            help='Directory where the merged profiles are written (default: the profiles directory).'),
+        make_option('--name', dest='url_name', default=None,
+            help='Only write the profile of this URL name, to stdout.'),
+        make_option('--clear', action='store_true', dest='clear', default=False,
+            help='Remove the flushed profiles once merged.'),
+    )
+
+    def handle_noargs(self, **options):
+        directory = options['directory']
+        if not directory or not os.path.isdir(directory):
+            raise CommandError("No profiles directory: %r" % directory)
+
+        stacks = {}
+        process_directories = [path for path in glob.glob(os.path.join(directory, '*')) if os.path.basename(path).isdigit()]
+        for process_directory in process_directories:
+            for path in glob.glob(os.path.join(process_directory, '*.folded')):
+                with open(path) as f:
+                    read_collapsed(f, stacks.setdefault(os.path.basename(path), {}))
+
+        if options['url_name'] is not None:
+            write_collapsed(self.stdout, stacks.get(collapsed_filename(options['url_name']), {}))
+        else:
+            output = options['output'] or directory
+            if not os.path.isdir(output):
+                os.makedirs(output)
+            for filename, name_stacks in sorted(stacks.items()):
+                with open(os.path.join(output, filename), 'w') as f:
+                    write_collapsed(f, name_stacks)
+                self.stderr.write("%s: %d samples" % (filename, sum(name_stacks.values())))
+
+        if options['clear']:
+            for process_directory in process_directories:
+                shutil.rmtree(process_directory)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which replays the pending ``QueuedStorage`` transfers
+and deletes left in the storage journal (e.g. by a process restart), or
+reports the backlog. Operations recorded by processes which are still
+running are left alone, as their tasks are still queued (or being retried)
+there.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.utils.module_loading import import_by_path
+
+from ...journal import get_journal
+
+
+class Command(NoArgsCommand):
+    help = "Replay the pending QueuedStorage operations in the storage journal"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--status', action='store_true', dest='status', default=False,
+            help='Only report the backlog size.'),
+        make_option('--older-than', type='int', dest='older_than', default=60,
+            help='Only replay operations recorded at least this many seconds ago.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=50,
+            help='Number of files transferred per remote connection.'),
+    )
+
+    def handle_noargs(self, **options):
+        journal = get_journal()
+        if journal is None:
+            raise CommandError("The storage journal is disabled (QUEUED_STORAGE_JOURNAL)")
+
+        backlog = journal.backlog()
+        self.stdout.write("Backlog: %(transfer)d transfers, %(delete)d deletes" % backlog)
+        if options['status']:
+            return
+
+        entries = {}
+        for entry in journal.pending(older_than=options['older_than'], in_flight=False):
+            entries.setdefault(entry.storage, []).append(entry)
+        for storage_path, storage_entries in sorted(entries.items()):
+            self.stdout.write("Replaying %d operations of %s" % (len(storage_entries), storage_path))
+            storage = import_by_path(storage_path)()
+            storage.replay(storage_entries, batch_size=options['batch_size'])
+
+        self.stdout.write("Backlog: %(transfer)d transfers, %(delete)d deletes" % journal.backlog())
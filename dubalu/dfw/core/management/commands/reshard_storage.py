@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+A management command which moves the files of an existing (flat) tree into
+the layout of a ``ShardedFileSystemStorage``, in place and in parallel.
+Files already in their sharded path are left alone, so it can be resumed,
+and files whose sharded path is taken are skipped (never replaced).
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import errno
+from optparse import make_option
+from multiprocessing.dummy import Pool
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.utils.module_loading import import_by_path
+
+from ...storage import ShardedFileSystemStorage
+
+
+class Command(NoArgsCommand):
+    help = "Move the files of a storage into its sharded layout"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--storage', dest='storage', default=settings.DEFAULT_FILE_STORAGE,
+            help='Dotted path of the ShardedFileSystemStorage to reshard.'),
+        make_option('--threads', type='int', dest='threads', default=8,
+            help='Number of files moved concurrently.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report the files to be moved.'),
+    )
+
+    def get_names(self, storage):
+        """
+        Yields the names of the files not in their sharded path.
+        """
+        for root, dirnames, filenames in os.walk(storage.location):
+            relative = os.path.relpath(root, storage.location)
+            for filename in filenames:
+                path = os.path.normpath(os.path.join(relative, filename))
+                if storage.unshard_name(path) is None:
+                    yield path
+
+    def move(self, name):
+        """
+        Moves a file to its sharded path. Returns the name and the sharded
+        path, or None as the path if it's already taken.
+        """
+        src = os.path.join(self.storage.location, name)
+        dst = os.path.join(self.storage.location, self.storage.shard_name(name))
+        if os.path.exists(dst):
+            return name, None
+        if self.dry_run:
+            return name, dst
+        try:
+            os.makedirs(os.path.dirname(dst))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Unlike rename(), link() fails if dst exists (e.g. created meanwhile)
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return name, None
+        os.unlink(src)
+        # Prune the directories left empty
+        dirname = os.path.dirname(src)
+        while dirname != self.storage.location:
+            try:
+                os.rmdir(dirname)
+            except OSError:
+                break
+            dirname = os.path.dirname(dirname)
+        return name, dst
+
+    def handle_noargs(self, **options):
+        self.storage = import_by_path(options['storage'])()
+        if not isinstance(self.storage, ShardedFileSystemStorage):
+            raise CommandError("%s is not a ShardedFileSystemStorage" % options['storage'])
+        self.dry_run = options['dry_run']
+        verbosity = int(options['verbosity'])
+
+        pool = Pool(options['threads'])
+        moved = skipped = 0
+        try:
+            for name, dst in pool.imap_unordered(self.move, self.get_names(self.storage), chunksize=100):
+                if dst is None:
+                    skipped += 1
+                    self.stderr.write("Skipped %s: its sharded path already exists" % name)
+                    continue
+                moved += 1
+                if verbosity > 1 or self.dry_run:
+                    self.stdout.write("%s -> %s" % (name, dst))
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write("%s %d files" % ("Would move" if self.dry_run else "Moved", moved))
+        if skipped:
+            self.stdout.write("Skipped %d files" % skipped)
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
+import time
 import warnings
 
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 
@@ -35,13 +36,69 @@ AVAILABLE_STATUSES = (STATUS_PUBLISHED, STATUS_UNPUBLISHED, STATUS_HIDDEN, STATU
 
 
 class StatableManager(models.Manager):
-    def cleanup(self):
+    def cleanup(self, now=None, chunk_size=1000, max_lock_time=0.5):
+        """
+        Runs the status transitions (scrap deletion, publishing and
+        unpublishing) in a single pass over the candidate rows, in primary
+        key order and in chunks, each in its own transaction. All
+        transitions use the same ``now``. A chunk whose statements take
+        longer than ``max_lock_time`` seconds halves the chunk size (it grows
+        back, up to ``chunk_size``, while chunks are fast).
+
+        Returns the counts and duration of the pass.
+
+        """
         getattr(super(StatableManager, self), 'cleanup', lambda: None)()  # Propagate cleanup()
         # FIXME: need to call indexing haystack methods for these!
-        self.filter(status=STATUS_SCRAP, created_at__lt=timezone.now() - timezone.timedelta(days=2)).delete()
-        self.filter(status=STATUS_PUBLISHED, active_to__gt=timezone.now()).update(status=STATUS_UNPUBLISHED)
-        self.filter(status=STATUS_PUBLISHED, active_from__lt=timezone.now()).update(status=STATUS_UNPUBLISHED)
-        self.filter(status=STATUS_UNPUBLISHED, active_from__gte=timezone.now(), active_to__lt=timezone.now()).update(status=STATUS_PUBLISHED)
+        start = time.time()
+        if now is None:
+            now = timezone.now()
+        scrap_before = now - timezone.timedelta(days=2)
+        candidates = self.filter(
+            models.Q(status=STATUS_SCRAP, created_at__lt=scrap_before) |
+            models.Q(status=STATUS_PUBLISHED, active_to__gt=now) |
+            models.Q(status=STATUS_PUBLISHED, active_from__lt=now) |
+            models.Q(status=STATUS_UNPUBLISHED, active_from__gte=now, active_to__lt=now)
+        ).order_by('pk').values_list('pk', 'status')
+
+        stats = {'deleted': 0, 'unpublished': 0, 'published': 0, 'chunks': 0}
+        size = chunk_size
+        last_pk = None
+        while True:
+            chunk = candidates if last_pk is None else candidates.filter(pk__gt=last_pk)
+            chunk = list(chunk[:size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            scrap, unpublish, publish = [], [], []
+            for pk, status in chunk:
+                if status == STATUS_SCRAP:
+                    scrap.append(pk)
+                elif status == STATUS_PUBLISHED:
+                    unpublish.append(pk)
+                else:
+                    publish.append(pk)
+
+            chunk_start = time.time()
+            with transaction.atomic():
+                if scrap:
+                    # Only the rows still scrap (locked until deleted) are counted
+                    scrap = list(self.filter(pk__in=scrap, status=STATUS_SCRAP).select_for_update().values_list('pk', flat=True))
+                    if scrap:
+                        self.filter(pk__in=scrap).delete()
+                        stats['deleted'] += len(scrap)
+                if unpublish:
+                    stats['unpublished'] += self.filter(pk__in=unpublish, status=STATUS_PUBLISHED).update(status=STATUS_UNPUBLISHED)
+                if publish:
+                    stats['published'] += self.filter(pk__in=publish, status=STATUS_UNPUBLISHED).update(status=STATUS_PUBLISHED)
+            stats['chunks'] += 1
+            if time.time() - chunk_start > max_lock_time:
+                size = max(1, size // 2)
+            elif size < chunk_size:
+                size = min(chunk_size, size * 2)
+
+        stats['duration'] = time.time() - start
+        return stats
 
     def published(self):
         now = timezone.now()
@@ -11,6 +11,9 @@ Dubalu Framework
 from __future__ import absolute_import
 
 import os
+import time
+import errno
+import hashlib
 import warnings
 import threading
 from collections import deque
@@ -21,7 +24,16 @@ from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import default_storage, Storage, FileSystemStorage as DjangoFileSystemStorage
 from django.core.signals import request_finished, request_started
 
-from async import async
+from async import async, PRIORITY_HIGH, PRIORITY_LOW
+from lru import StripedLRUCache
+
+from .journal import get_journal, TRANSFER, DELETE
+
+import logging
+logger = logging.getLogger(__name__)
+
+QUEUED_STORAGE_METADATA_CACHE_SIZE = getattr(settings, 'QUEUED_STORAGE_METADATA_CACHE_SIZE', 10000)
+QUEUED_STORAGE_METADATA_TIMEOUT = getattr(settings, 'QUEUED_STORAGE_METADATA_TIMEOUT', 60)
 
 
 def _expand_path_nodes(path, niddle):
@@ -93,7 +105,7 @@ class FileSystemStorage(DjangoFileSystemStorage):
         if self._base_location is None:
             return getattr(settings, self.STORAGE_ROOT_NAME)
         else:
-            self._base_location
+            return self._base_location
 
     @property
     def location(self):
@@ -125,6 +137,151 @@ class StaticFilesStorage(FileSystemStorage):
         return super(StaticFilesStorage, self).path(name)
 
 
+SHARDING_HASH = 'hash'
+SHARDING_EXPAND_PATH = 'expand_path'
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    """
+    Filesystem storage bounding the number of entries per directory.
+
+    Names stay the same (e.g. in the database), only the files are stored
+    in a sharded path:
+
+    - ``SHARDING_HASH``: ``SHARD_LEVELS`` directories (prefixed with
+      ``SHARD_PREFIX``) of ``SHARD_WIDTH`` hex digits of the md5 of the
+      basename are inserted before it: ``a/b/name.jpg`` is stored in
+      ``a/b/_3f/_a9/name.jpg``.
+    - ``SHARDING_EXPAND_PATH``: the directory node at ``NIDDLE`` is expanded
+      with ``expand_path()``: ``users/kronuz/name.jpg`` is stored in
+      ``users/6kr/uz/kronuz/name.jpg``.
+
+    Use ``manage.py reshard_storage`` to move the files of an existing tree.
+    Meanwhile (with ``FLAT_FALLBACK``) files not found in their sharded path
+    are looked up in the flat one by ``path()``, ``exists()`` and ``url()``.
+
+    """
+    SHARDING = SHARDING_HASH
+    SHARD_LEVELS = 2
+    SHARD_WIDTH = 2
+    SHARD_PREFIX = '_'
+    NIDDLE = 1
+    FLAT_FALLBACK = True
+
+    def __init__(self, location=None, base_url=None, sharding=None, levels=None, width=None, niddle=None, flat_fallback=None):
+        super(ShardedFileSystemStorage, self).__init__(location, base_url)
+        self.sharding = self.SHARDING if sharding is None else sharding
+        self.levels = self.SHARD_LEVELS if levels is None else levels
+        self.width = self.SHARD_WIDTH if width is None else width
+        self.niddle = self.NIDDLE if niddle is None else niddle
+        self.flat_fallback = self.FLAT_FALLBACK if flat_fallback is None else flat_fallback
+        if self.sharding not in (SHARDING_HASH, SHARDING_EXPAND_PATH):
+            raise ImproperlyConfigured("Invalid sharding scheme: %r" % self.sharding)
+
+    def shard_name(self, name):
+        """
+        Returns the sharded name (relative path) for a name.
+
+        """
+        name = os.path.normpath(name)
+        if self.sharding == SHARDING_EXPAND_PATH:
+            return expand_path(name, self.niddle)
+        dirname, basename = os.path.split(name)
+        digest = hashlib.md5(basename.encode('utf-8')).hexdigest()
+        shards = [self.SHARD_PREFIX + digest[i * self.width:(i + 1) * self.width] for i in range(self.levels)]
+        return os.path.join(dirname, *(shards + [basename]))
+
+    def unshard_name(self, path):
+        """
+        Returns the name stored in a sharded path, or None if it is not one.
+
+        """
+        nodes = os.path.normpath(path).split(os.path.sep)
+        if self.sharding == SHARDING_EXPAND_PATH:
+            if self.shard_name(path) == os.path.join(*nodes):
+                return os.path.join(*nodes)  # Too shallow to be expanded
+            candidates = [nodes[:self.niddle] + nodes[self.niddle + shards:] for shards in (1, 2, 3)]
+        else:
+            candidates = [nodes[:-self.levels - 1] + nodes[-1:]]
+        for candidate in candidates:
+            if len(candidate) < len(nodes):
+                name = os.path.join(*candidate)
+                if self.shard_name(name) == os.path.join(*nodes):
+                    return name
+        return None
+
+    def _stored_name(self, name):
+        """
+        Returns the relative path where the file of a name is stored.
+
+        """
+        sharded_name = self.shard_name(name)
+        if self.flat_fallback and sharded_name != os.path.normpath(name):
+            if not os.path.exists(DjangoFileSystemStorage.path(self, sharded_name)) and \
+                    os.path.exists(DjangoFileSystemStorage.path(self, name)):
+                return os.path.normpath(name)  # Not resharded yet
+        return sharded_name
+
+    def path(self, name):
+        return super(ShardedFileSystemStorage, self).path(self._stored_name(name))
+
+    def url(self, name):
+        return super(ShardedFileSystemStorage, self).url(self._stored_name(name).replace(os.path.sep, '/'))
+
+    def _shard_depth(self, dirname):
+        """
+        Returns the number of shard directories starting with ``dirname``
+        (0 if it's not a shard directory).
+
+        """
+        if self.sharding == SHARDING_EXPAND_PATH:
+            return {'1': 1, '3': 1, '6': 2, 'A': 3}.get(dirname[:1], 0)
+        if len(dirname) == len(self.SHARD_PREFIX) + self.width and dirname.startswith(self.SHARD_PREFIX):
+            return self.levels
+        return 0
+
+    def _listdir(self, path):
+        # Physical listing (``listdir()`` of the parent goes through ``path()``)
+        directories, files = [], []
+        path = DjangoFileSystemStorage.path(self, path)
+        for entry in os.listdir(path):
+            if os.path.isdir(os.path.join(path, entry)):
+                directories.append(entry)
+            else:
+                files.append(entry)
+        return directories, files
+
+    def listdir(self, path):
+        """
+        Lists the (unsharded) contents of a directory.
+
+        """
+        path = os.path.normpath(path or '.')
+        if path == '.':
+            path = ''
+        depth = len(path.split(os.path.sep)) if path else 0
+        if self.sharding == SHARDING_EXPAND_PATH and depth != self.niddle:
+            # Only the directories at the niddle are expanded
+            if depth > self.niddle:
+                path = os.path.dirname(self.shard_name(os.path.join(path, '_')))
+            return self._listdir(path)
+        directories, files = self._listdir(path)
+        pending = [(os.path.join(path, dirname), self._shard_depth(dirname)) for dirname in directories]
+        del directories[:]
+        for subpath, shard_depth in pending:
+            if not shard_depth:
+                directories.append(os.path.basename(subpath))  # Not sharded (yet)
+                continue
+            subdirectories, subfiles = self._listdir(subpath)
+            if shard_depth > 1:
+                pending.extend((os.path.join(subpath, dirname), shard_depth - 1) for dirname in subdirectories)
+            elif self.sharding == SHARDING_EXPAND_PATH:
+                directories.extend(subdirectories)
+            else:
+                files.extend(subfiles)
+        return directories, files
+
+
 deferred = threading.local()
 
 
@@ -139,18 +296,53 @@ def deferred_process(**kwargs):
         del deferred.deletes
         while True:
             try:
-                self, local_settings, storage, name = queue.pop()
+                self, local_settings, storage, name, entry = queue.pop()
             except IndexError:
                 break
-            self.async_delete(local_settings, storage, name)
+            self.async_delete(local_settings, storage, name, entry=entry)
 request_finished.connect(deferred_process)
 
 
+class FileMetadata(object):
+    """
+    What a QueuedStorage knows about a file: whether it is in the local
+    storage, whether it exists at all (None if unknown), its size and
+    modified time (None until needed).
+
+    """
+    __slots__ = ('local', 'exists', 'size', 'modified_time', 'expires')
+
+    def __init__(self, local, exists=None, size=None, modified_time=None):
+        self.local = local
+        self.exists = True if local else exists
+        self.size = size
+        self.modified_time = modified_time
+        self.expires = time.time() + QUEUED_STORAGE_METADATA_TIMEOUT
+
+    def __repr__(self):
+        return '<FileMetadata local=%s exists=%s size=%s>' % (self.local, self.exists, self.size)
+
+
 class QueuedStorage(Storage):
     """
     This is the Queued Storage class, child classes could add
     LOCAL_STORAGE and REMOTE_STORAGE for default storages.
 
+    Pending transfers and deletes are recorded in the storage journal
+    (see ``dfw.core.journal``) until they are done, so they can be replayed
+    after a restart (``manage.py replay_storage_journal``). Replaying
+    instantiates the storage class without arguments.
+
+    What is known of the files which are not in the local storage (that
+    they exist, their size and modified time) is cached in the process for
+    QUEUED_STORAGE_METADATA_TIMEOUT seconds; local files are looked up every
+    time, as any process can transfer them to the remote storage meanwhile,
+    and so are missing files, as any process can save them (``exists()`` is
+    what ``get_available_name()`` relies on). ``stat_many()`` and ``urls()``
+    resolve many files at once.
+
+    Transfers never replace a different remote file with the same name.
+
     """
     LOCAL_STORAGE = FileSystemStorage('/tmp/queued_storage')
     REMOTE_STORAGE = default_storage
@@ -158,13 +350,113 @@ class QueuedStorage(Storage):
     def __init__(self, local=None, remote=None):
         self.local = self.LOCAL_STORAGE if local is None else local
         self.remote = self.REMOTE_STORAGE if remote is None else remote
+        self.journal = get_journal()
+        self._metadata = StripedLRUCache(QUEUED_STORAGE_METADATA_CACHE_SIZE)
+
+    def _journal_add(self, op, storage, name, local_settings):
+        if self.journal is None:
+            return None
+        role = 'local' if storage is self.local else 'remote' if storage is self.remote else None
+        cls = self.__class__
+        return self.journal.add(op, '%s.%s' % (cls.__module__, cls.__name__), role, name, local_settings)
+
+    def _journal_done(self, entry):
+        if self.journal is not None and entry is not None:
+            self.journal.done(entry)
+
+    def _metadata_key(self, name):
+        # The roots are volatile settings (e.g. per project)
+        return (
+            getattr(settings, getattr(self.local, 'STORAGE_ROOT_NAME', 'MEDIA_ROOT')),
+            getattr(settings, getattr(self.remote, 'STORAGE_ROOT_NAME', 'MEDIA_ROOT')),
+            name,
+        )
+
+    def _set_metadata(self, name, metadata):
+        if metadata.local:
+            # Local files can leave at any time (transferred by any process)
+            self._invalidate_metadata(name)
+        else:
+            self._metadata[self._metadata_key(name)] = metadata
+        return metadata
+
+    def _invalidate_metadata(self, name):
+        try:
+            del self._metadata[self._metadata_key(name)]
+        except KeyError:
+            pass
+
+    def get_metadata(self, name):
+        metadata = self._metadata.get(self._metadata_key(name))
+        if metadata is None or metadata.expires < time.time():
+            metadata = self._set_metadata(name, FileMetadata(self.local.exists(name)))
+        return metadata
+
+    def stat_many(self, names):
+        """
+        Returns a dictionary with the FileMetadata of every name, listing
+        every directory not in the cache once in the local storage and at
+        most once in the remote storage.
+
+        """
+        now = time.time()
+        result = {}
+        directories = {}
+        for name in names:
+            metadata = self._metadata.get(self._metadata_key(name))
+            if metadata is None or metadata.expires < now:
+                directories.setdefault(os.path.dirname(name), []).append(name)
+            else:
+                result[name] = metadata
+        for dirname, dir_names in directories.items():
+            try:
+                local_files = set(self.local.listdir(dirname)[1])
+            except (OSError, IOError):
+                local_files = set()
+            remote_files = None
+            for name in dir_names:
+                basename = os.path.basename(name)
+                if basename in local_files:
+                    metadata = FileMetadata(True)
+                else:
+                    if remote_files is None:
+                        try:
+                            remote_files = set(self.remote.listdir(dirname)[1])
+                        except Exception:
+                            remote_files = False
+                    metadata = FileMetadata(False, None if remote_files is False else basename in remote_files)
+                result[name] = self._set_metadata(name, metadata)
+        return result
+
+    def urls(self, names):
+        """
+        Returns the urls of all names (see stat_many).
+
+        """
+        metadata = self.stat_many(names)
+        return [(self.local if metadata[name].local else self.remote).url(name) for name in names]
 
     def _get_storage(self, name):
-        if self.local.exists(name):
+        if self.get_metadata(name).local:
             return self.local
         else:
             return self.remote
 
+    def _call(self, metadata, method, name, *args, **kwargs):
+        """
+        Calls ``method`` of the storage where the file is, falling back to
+        the remote storage if the local copy is gone (transferred by another
+        process since ``metadata`` was looked up).
+
+        """
+        if metadata.local:
+            try:
+                return getattr(self.local, method)(name, *args, **kwargs)
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return getattr(self.remote, method)(name, *args, **kwargs)
+
     def _get_deferred_queue(self):
         try:
             return deferred.deletes
@@ -176,31 +468,62 @@ class QueuedStorage(Storage):
         Defers the delete until the end of the request.
 
         """
+        entry = self._journal_add(DELETE, storage, name, local_settings)
         if queue is None:
             queue = self._get_deferred_queue()
         if queue is None:
-            self.async_delete(local_settings, storage, name)
+            self.async_delete(local_settings, storage, name, entry=entry)
         else:
-            queue.append((self, local_settings, storage, name))
+            queue.append((self, local_settings, storage, name, entry))
 
-    @async()
-    def async_transfer(self, local_settings, name, queue):
+    def transfer_many(self, local_settings, names, entries=None, queue=None):
         """
-        Saves to the remote storage (also, removing the local copy)
+        Saves to the remote storage (also, removing the local copies), all
+        the files through the same remote storage (and connection).
+
+        A file whose name is already taken by a different remote file (which
+        would have to be replaced) stays in the local storage and its entry
+        stays in the journal, to be sorted out.
 
         """
+        if entries is None:
+            entries = [None] * len(names)
         settings.clear(local_settings)
         try:
-            with self.local.open(name) as content:
-                if self.remote.exists(name):
-                    self.remote.delete(name)
-                self.remote.save(name, content)
-            self.deferred_delete(local_settings, self.local, name, queue)
+            for name, entry in zip(names, entries):
+                if not self.local.exists(name):
+                    # Already transferred (e.g. retrying a batch)
+                    self._journal_done(entry)
+                    continue
+                with self.local.open(name) as content:
+                    if self.remote.exists(name):
+                        if self.remote.size(name) != content.size:
+                            logger.error("Not transferring %s: a different file has the same name in the remote storage", name)
+                            continue
+                        # Already transferred (e.g. the process died before it was done)
+                    else:
+                        saved_name = self.remote.save(name, content)
+                        if saved_name != name:
+                            # Somebody else saved the name meanwhile
+                            self.remote.delete(saved_name)
+                            logger.error("Not transferring %s: a different file has the same name in the remote storage", name)
+                            continue
+                metadata = self.get_metadata(name)
+                self._set_metadata(name, FileMetadata(False, True, metadata.size))
+                self._journal_done(entry)
+                self.deferred_delete(local_settings, self.local, name, queue)
         finally:
             settings.clear()
 
-    @async()
-    def async_delete(self, local_settings, storage, name, log_exceptions=True):
+    @async(priority=PRIORITY_LOW, retries=3)
+    def async_transfer(self, local_settings, name, queue, entry=None):
+        """
+        Saves to the remote storage (also, removing the local copy)
+
+        """
+        self.transfer_many(local_settings, [name], [entry], queue)
+
+    def delete_now(self, local_settings, storage, name, log_exceptions=True, entry=None):
         settings.clear(local_settings)
         try:
             try:
@@ -208,11 +531,43 @@ class QueuedStorage(Storage):
             except Exception:
                 if log_exceptions:
                     raise
+            finally:
+                if storage is not self.local:
+                    self._invalidate_metadata(name)
+            self._journal_done(entry)
         finally:
             settings.clear()
 
+    @async(priority=PRIORITY_HIGH, retries=3)
+    def async_delete(self, local_settings, storage, name, log_exceptions=True, entry=None):
+        self.delete_now(local_settings, storage, name, log_exceptions, entry)
+
+    def replay(self, entries, batch_size=50):
+        """
+        Runs the given (pending) journal entries of this storage, transfers
+        in batches of ``batch_size`` files per remote connection.
+
+        """
+        transfers = {}
+        for entry in entries:
+            if entry.op == TRANSFER:
+                key = tuple(sorted(entry.settings.items()))
+                transfers.setdefault(key, []).append(entry)
+            elif entry.op == DELETE:
+                storage = self.local if entry.role == 'local' else self.remote
+                self.delete_now(entry.settings, storage, entry.name, entry=entry.id)
+        for key, group in transfers.items():
+            local_settings = dict(key)
+            for i in range(0, len(group), batch_size):
+                batch = group[i:i + batch_size]
+                queue = deque()
+                self.transfer_many(local_settings, [e.name for e in batch], [e.id for e in batch], queue)
+                # Remove the local copies right away (there is no request)
+                for _, delete_settings, storage, name, entry in queue:
+                    self.delete_now(delete_settings, storage, name, entry=entry)
+
     def _open(self, name, mode='rb'):
-        return self._get_storage(name).open(name, mode=mode)
+        return self._call(self.get_metadata(name), 'open', name, mode=mode)
 
     def _get_settings(self):
         """
@@ -232,7 +587,10 @@ class QueuedStorage(Storage):
 
     def _save(self, name, content):
         ret = self.local.save(name, content)
-        self.async_transfer(self._get_settings(), name, self._get_deferred_queue())
+        self._set_metadata(ret, FileMetadata(True))
+        local_settings = self._get_settings()
+        entry = self._journal_add(TRANSFER, None, ret, local_settings)
+        self.async_transfer(local_settings, ret, self._get_deferred_queue(), entry)
         return ret
 
     def path(self, name):
@@ -245,6 +603,7 @@ class QueuedStorage(Storage):
                 warnings.warn("Expensive path is being used!", stacklevel=2)
                 with self.remote.open(name) as content:
                     self.local.save(name, content)
+                self._set_metadata(name, FileMetadata(True))
                 path = self.local.path(name)
                 local_settings = self._get_settings()
                 self.deferred_delete(local_settings, self.local, name)
@@ -256,16 +615,26 @@ class QueuedStorage(Storage):
             log_exceptions = False
         except IOError:
             log_exceptions = True
-        self.async_delete(self._get_settings(), self.remote, name, log_exceptions)
+        self._set_metadata(name, FileMetadata(False, False))
+        local_settings = self._get_settings()
+        entry = self._journal_add(DELETE, self.remote, name, local_settings)
+        self.async_delete(local_settings, self.remote, name, log_exceptions, entry)
 
     def exists(self, name):
-        if self.local.exists(name):
+        metadata = self.get_metadata(name)
+        if metadata.exists:
+            return True
+        # Only existing files are cached, any process can save it meanwhile
+        if not metadata.local and self.local.exists(name):
+            self._invalidate_metadata(name)
             return True
         try:
-            return self.remote.exists(name)
+            exists = self.remote.exists(name)
         except Exception:
-            pass
-        return False
+            return False
+        if exists:
+            metadata.exists = True
+        return exists
 
     def listdir(self, path):
         directories, files = set(), set()
@@ -285,19 +654,25 @@ class QueuedStorage(Storage):
         return (list(directories), list(files))
 
     def size(self, name):
-        return self._get_storage(name).size(name)
+        metadata = self.get_metadata(name)
+        if metadata.size is None:
+            metadata.size = self._call(metadata, 'size', name)
+        return metadata.size
 
     def url(self, name):
         return self._get_storage(name).url(name)
 
     def accessed_time(self, name):
-        return self._get_storage(name).accessed_time(name)
+        return self._call(self.get_metadata(name), 'accessed_time', name)
 
     def created_time(self, name):
-        return self._get_storage(name).created_time(name)
+        return self._call(self.get_metadata(name), 'created_time', name)
 
     def modified_time(self, name):
-        return self._get_storage(name).modified_time(name)
+        metadata = self.get_metadata(name)
+        if metadata.modified_time is None:
+            metadata.modified_time = self._call(metadata, 'modified_time', name)
+        return metadata.modified_time
 
 
 class LocalFileSystemStorage(FileSystemStorage):
@@ -13,6 +13,7 @@ from __future__ import absolute_import, unicode_literals, print_function
 import string
 import random
 import hashlib
+import weakref
 import phonenumbers
 
 from django.conf import settings
@@ -22,9 +23,11 @@ from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe
 from django.utils import six
 
+from jinja2 import nodes, Undefined
+from templatetag_sugar.register import extension_factory, ASSIGNMENT_SYNTAX
 from typecast import Money, try_number
 
-from dfw.utils.cache import cache_seq
+from dfw.utils.cache import cache_seq, cache_seq_prefetch, get_fragment
 from dfw.utils.json import json
 
 CODE_CHARS = string.ascii_lowercase + string.digits
@@ -32,7 +35,162 @@ CODE_CHARS = string.ascii_lowercase + string.digits
 register = template.Library()
 
 
-cache_seq = register.assignment_tag()(cache_seq)
+class CacheSeqNode(template.Node):
+    def __init__(self, fragm_name, vary_on, target_var, siblings):
+        self.fragm_name = fragm_name
+        self.vary_on = vary_on
+        self.target_var = target_var
+        # All the cache_seq nodes of the template being compiled (shared)
+        self.siblings = siblings
+        siblings.append(self)
+
+    def resolve_frag(self, context):
+        fragm_name = self.fragm_name.resolve(context, True)
+        vary_on = [var.resolve(context, True) for var in self.vary_on]
+        if fragm_name is None or None in vary_on:
+            return None
+        return fragm_name, vary_on
+
+    def render(self, context):
+        key = ('cache_seq', id(self.siblings))
+        if key not in context.render_context:
+            # First pass: get the sequence of every fragment in the template
+            # that can already be resolved (and those declared by the view)
+            # with a single round trip.
+            context.render_context[key] = True
+            frags = [node.resolve_frag(context) for node in self.siblings]
+            cache_seq_prefetch([frag for frag in frags if frag is not None])
+        fragm_name = self.fragm_name.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        context[self.target_var] = cache_seq(fragm_name, *vary_on)
+        return ''
+
+
+def _lookup(node):
+    """
+    Returns a ``(name, path)`` lookup for a Jinja2 constant, variable or
+    attribute/item of a variable expression node (None for anything else).
+    Constants have no name, the path being their value.
+    """
+    path = []
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        if isinstance(node, nodes.Getattr):
+            path.append((True, node.attr))
+        elif isinstance(node.arg, nodes.Const):
+            path.append((False, node.arg.value))
+        else:
+            return None
+        node = node.node
+    if isinstance(node, nodes.Name):
+        return node.name, path[::-1]
+    if isinstance(node, nodes.Const) and not path:
+        return None, node.value
+    return None
+
+
+def _tag_args(ret):
+    """
+    Returns the argument nodes of the call in a parsed templatetag_sugar tag
+    (None if it doesn't have the expected shape).
+    """
+    try:
+        call = ret[-1].node
+        args = call.args[1]
+    except (IndexError, AttributeError, TypeError):
+        return None
+    if isinstance(call, nodes.Call) and isinstance(args, nodes.List):
+        return args.items
+    return None
+
+
+class CacheSeqExtension(extension_factory(cache_seq, 'cache_seq', ASSIGNMENT_SYNTAX)):
+    """
+        {% cache_seq fragm_name [vary_on ...] as var_name %}
+
+    The first ``cache_seq`` of a template fetches the sequences of all the
+    fragments in it whose arguments are constants or lookups in the context
+    (and those declared by the view) with a single round trip. Tags it
+    can't make sense of get their sequence on their own.
+    """
+    def __init__(self, environment):
+        super(CacheSeqExtension, self).__init__(environment)
+        # The fragments of the templates being parsed, by parser
+        self._frags = weakref.WeakKeyDictionary()
+
+    def parse(self, parser):
+        ret = super(CacheSeqExtension, self).parse(parser)
+        args = _tag_args(ret)
+        if args is None:
+            return ret
+        frags = self._frags.get(parser)
+        if frags is None:
+            # Shared by all the cache_seq tags of the template being parsed,
+            # it's complete by the time the template is compiled (when the
+            # constant is rendered in the template code).
+            frags = self._frags[parser] = []
+            ret.insert(0, nodes.ExprStmt(self.call_method('_prefetch', [nodes.ContextReference(), nodes.Const(frags)])))
+        lookups = [_lookup(arg) for arg in args]
+        if lookups and None not in lookups:
+            frags.append(lookups)
+        return ret
+
+    def _resolve(self, context, name, path):
+        if name is None:
+            return path
+        value = context.resolve(name)
+        try:
+            for is_attr, key in path:
+                if isinstance(value, Undefined):
+                    break
+                value = self.environment.getattr(value, key) if is_attr else self.environment.getitem(value, key)
+        except Exception:
+            return None
+        return None if isinstance(value, Undefined) else value
+
+    def _prefetch(self, context, frags):
+        resolved = []
+        for lookups in frags:
+            values = [self._resolve(context, name, path) for name, path in lookups]
+            if None not in values:
+                resolved.append((values[0], values[1:]))
+        cache_seq_prefetch(resolved)
+        return ''
+
+register.tag(CacheSeqExtension)
+
+
+@register.tag(name='cache_seq')
+def do_cache_seq(parser, token):
+    """
+        {% cache_seq fragm_name [vary_on ...] as var_name %}
+
+    The sequences of all the fragments in a template are fetched at once
+    (see ``CacheSeqExtension`` for Jinja2).
+    """
+    bits = token.split_contents()
+    if len(bits) < 4 or bits[-2] != 'as':
+        raise template.TemplateSyntaxError("'%s' takes at least one argument followed by 'as var_name'" % bits[0])
+    if not hasattr(parser, '_cache_seq_nodes'):
+        parser._cache_seq_nodes = []
+    return CacheSeqNode(
+        parser.compile_filter(bits[1]),
+        [parser.compile_filter(bit) for bit in bits[2:-2]],
+        bits[-1],
+        parser._cache_seq_nodes,
+    )
+
+
+@register.block_tag
+def fragmentcache(body, timeout, fragm_name, *vary_on, **options):
+    """
+        {% fragmentcache timeout fragm_name [vary_on ...] [stale_timeout=N] [beta=N] [compress=N] %}
+          ....
+        {% endfragmentcache %}
+
+    Like ``{% cache %}``, but invalidated by ``cache_seq_incr(fragm_name, *vary_on)``
+    and protected against stampedes (see ``dfw.utils.cache.get_fragment``).
+    """
+    return get_fragment(fragm_name, vary_on, body, timeout=int(timeout), **options)
 
 
 @register.block_tag
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import pickle
+import shutil
+import tempfile
+from collections import deque
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import management
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage as DjangoFileSystemStorage
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+import dehydration
+from jinja2 import Environment
+
+from dfw.utils.cache import cache_seq, cache_seq_incr
+
+from . import journal as journal_module
+from .journal import StorageJournal, TRANSFER
+from .templatetags.simple_tags import CacheSeqExtension
+from .storage import FileSystemStorage, QueuedStorage, ShardedFileSystemStorage, SHARDING_EXPAND_PATH
+
+
+class DehydrationIdentityMapTests(TestCase):
+    """
+    Test the objects shared by ``dehydration.hydrate`` through the
+    identity map.
+
+    """
+    def setUp(self):
+        self.old_identity_map = dehydration.get_identity_map()
+        self.identity_map = dehydration.IdentityMap()
+        self.identity_map.start()
+        dehydration.set_identity_map(self.identity_map)
+        self.content_type = ContentType.objects.create(name='fragment', app_label='tests', model='fragment')
+
+    def tearDown(self):
+        self.identity_map.stop()
+        dehydration.set_identity_map(self.old_identity_map)
+
+    def dehydrated_fragment(self, **extra):
+        obj = ContentType.objects.get(pk=self.content_type.pk)
+        obj.__dict__.update(extra)
+        return pickle.loads(pickle.dumps(dehydration.dehydrate(obj)))
+
+    def test_extra_data_per_fragment(self):
+        """
+        Fragments hydrating the same row keep their own extra data, without
+        it leaking in the shared instance.
+
+        """
+        fragments = [self.dehydrated_fragment(position=1), self.dehydrated_fragment(position=2), self.dehydrated_fragment()]
+        first = fragments[0].hydrate()
+        with self.assertNumQueries(0):
+            second = fragments[1].hydrate()
+            plain = fragments[2].hydrate()
+        self.assertEqual(first.position, 1)
+        self.assertEqual(second.position, 2)
+        self.failIf(hasattr(plain, 'position'))
+        self.assertEqual(second.name, 'fragment')
+
+    def test_extra_data_per_fragment_delayed(self):
+        """
+        Same as above, hydrating containers of fragments.
+
+        """
+        fragments = [self.dehydrated_fragment(position=1), self.dehydrated_fragment(position=2)]
+        first = dehydration.hydrate([fragments[0]])[0]
+        self.assertEqual(first.name, 'fragment')
+        with self.assertNumQueries(0):
+            second = dehydration.hydrate([fragments[1]])[0]
+            self.assertEqual(second.name, 'fragment')
+        self.assertEqual(first.position, 1)
+        self.assertEqual(second.position, 2)
+
+    def test_invalidated_on_save(self):
+        """
+        Saving an object discards it from the identity map.
+
+        """
+        fragments = [self.dehydrated_fragment(), self.dehydrated_fragment()]
+        fragments[0].hydrate()
+        self.content_type.name = 'changed'
+        self.content_type.save()
+        with self.assertNumQueries(1):
+            obj = fragments[1].hydrate()
+        self.assertEqual(obj.name, 'changed')
+
+
+class JournalQueuedStorage(QueuedStorage):
+    pass
+
+
+class QueuedStorageTests(TestCase):
+    """
+    Test the ``QueuedStorage`` metadata cache and transfers.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local = FileSystemStorage(os.path.join(self.directory, 'local'))
+        self.remote = DjangoFileSystemStorage(os.path.join(self.directory, 'remote'))
+        self.storage = QueuedStorage(self.local, self.remote)
+        self.storage.journal = StorageJournal(os.path.join(self.directory, 'journal.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transfer(self, name):
+        entry = self.storage.journal.add(TRANSFER, 'tests', None, name, {})
+        queue = deque()
+        self.storage.transfer_many({}, [name], [entry], queue)
+        for _, local_settings, storage, name, entry_id in queue:
+            storage.delete(name)
+        return entry
+
+    def test_remote_metadata_cached(self):
+        self.remote.save('a.txt', ContentFile('remote'))
+        self.assertTrue(self.storage.exists('a.txt'))
+        self.assertEqual(self.storage.size('a.txt'), 6)
+        self.remote.delete('a.txt')
+        self.remote.save('a.txt', ContentFile('changed'))
+        self.assertEqual(self.storage.size('a.txt'), 6)
+        self.storage._invalidate_metadata('a.txt')
+        self.assertEqual(self.storage.size('a.txt'), 7)
+
+    def test_local_metadata_not_cached(self):
+        self.local.save('a.txt', ContentFile('local'))
+        self.assertTrue(self.storage.exists('a.txt'))
+        self.assertIsNone(self.storage._metadata.get(self.storage._metadata_key('a.txt')))
+        self.local.delete('a.txt')
+        self.assertFalse(self.storage.exists('a.txt'))
+
+    def test_missing_not_cached(self):
+        """
+        Files saved by other processes are seen right away, so their names
+        are not reused.
+
+        """
+        self.assertFalse(self.storage.exists('a.txt'))
+        self.remote.save('a.txt', ContentFile('remote'))
+        self.assertTrue(self.storage.exists('a.txt'))
+        self.assertNotEqual(self.storage.get_available_name('a.txt'), 'a.txt')
+
+        self.assertFalse(self.storage.exists('b.txt'))
+        self.local.save('b.txt', ContentFile('local'))
+        self.assertTrue(self.storage.exists('b.txt'))
+
+    def test_transfer(self):
+        self.local.save('a.txt', ContentFile('local'))
+        entry = self.transfer('a.txt')
+        self.assertFalse(self.local.exists('a.txt'))
+        self.assertEqual(self.remote.open('a.txt').read(), b'local')
+        self.assertFalse(self.storage.journal.is_pending(entry))
+
+    def test_crash_replay(self):
+        """
+        The transfers recorded by a process which died before doing them are
+        replayed, those of running processes are left alone.
+
+        """
+        self.local.save('crashed.txt', ContentFile('crashed'))
+        self.local.save('in_flight.txt', ContentFile('in flight'))
+        path = self.storage.journal.path
+        pid = os.fork()
+        if not pid:
+            # The child records a transfer and dies before doing it
+            try:
+                StorageJournal(path).add(TRANSFER, 'dfw.core.tests.JournalQueuedStorage', None, 'crashed.txt', {})
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        in_flight = self.storage.journal.add(TRANSFER, 'dfw.core.tests.JournalQueuedStorage', None, 'in_flight.txt', {})
+        self.storage.journal.connection.execute('UPDATE journal SET pid = ? WHERE id = ?', (os.getppid(), in_flight))
+        self.assertEqual([entry.pid for entry in self.storage.journal.pending()], [pid, os.getppid()])
+        self.assertEqual([entry.name for entry in self.storage.journal.pending(in_flight=False)], ['crashed.txt'])
+
+        JournalQueuedStorage.LOCAL_STORAGE = self.local
+        JournalQueuedStorage.REMOTE_STORAGE = self.remote
+        journal_module._journal[:] = [self.storage.journal]
+        stdout = StringIO()
+        try:
+            management.call_command('replay_storage_journal', older_than=0, stdout=stdout)
+        finally:
+            del journal_module._journal[:]
+            del JournalQueuedStorage.LOCAL_STORAGE, JournalQueuedStorage.REMOTE_STORAGE
+        self.assertIn("Replaying 1 operations of dfw.core.tests.JournalQueuedStorage", stdout.getvalue())
+        self.assertEqual(self.remote.open('crashed.txt').read(), b'crashed')
+        self.assertFalse(self.local.exists('crashed.txt'))
+        self.assertFalse(self.remote.exists('in_flight.txt'))
+        self.assertTrue(self.local.exists('in_flight.txt'))
+        self.assertEqual([entry.id for entry in self.storage.journal.pending()], [in_flight])
+
+    def test_transfer_never_replaces(self):
+        """
+        A transfer doesn't replace a different remote file with the same
+        name, the local copy and its journal entry are kept.
+
+        """
+        self.remote.save('a.txt', ContentFile('remote'))
+        self.local.save('a.txt', ContentFile('local file'))
+        entry = self.transfer('a.txt')
+        self.assertEqual(self.remote.open('a.txt').read(), b'remote')
+        self.assertTrue(self.local.exists('a.txt'))
+        self.assertTrue(self.storage.journal.is_pending(entry))
+        self.assertEqual(self.storage.open('a.txt').read(), b'local file')
+
+
+class ShardedFileSystemStorageTests(TestCase):
+    """
+    Test the ``ShardedFileSystemStorage`` layouts and the resharding of a
+    flat tree.
+
+    """
+    names = ['a.txt', 'users/kronuz/name.jpg', 'users/kronuz/photos/name.jpg', 'users/b/c/d.txt']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for storage in (ShardedFileSystemStorage(self.directory),
+                        ShardedFileSystemStorage(self.directory, sharding=SHARDING_EXPAND_PATH)):
+            for name in self.names:
+                path = storage.shard_name(name)
+                self.assertEqual(storage.unshard_name(path), name)
+        storage = ShardedFileSystemStorage(self.directory)
+        self.assertEqual(storage.shard_name('users/kronuz/name.jpg').split(os.path.sep)[:2], ['users', 'kronuz'])
+        self.assertIsNone(storage.unshard_name('users/kronuz/name.jpg'))
+
+    def test_listdir(self):
+        for sharding in ('hash', SHARDING_EXPAND_PATH):
+            storage = ShardedFileSystemStorage(os.path.join(self.directory, sharding), sharding=sharding)
+            for name in self.names:
+                storage.save(name, ContentFile(name))
+            self.assertEqual(storage.listdir(''), (['users'], ['a.txt']))
+            self.assertEqual(sorted(storage.listdir('users')[0]), ['b', 'kronuz'])
+            self.assertEqual(storage.listdir('users/kronuz'), (['photos'], ['name.jpg']))
+            self.assertEqual(storage.listdir('users/b/c'), ([], ['d.txt']))
+            for name in self.names:
+                self.assertEqual(storage.open(name).read(), name.encode('utf-8'))
+
+    def test_flat_fallback(self):
+        flat = DjangoFileSystemStorage(self.directory)
+        storage = ShardedFileSystemStorage(self.directory)
+        flat.save('users/kronuz/name.jpg', ContentFile('flat'))
+        self.assertTrue(storage.exists('users/kronuz/name.jpg'))
+        self.assertEqual(storage.open('users/kronuz/name.jpg').read(), b'flat')
+        self.assertEqual(storage.url('users/kronuz/name.jpg'), flat.url('users/kronuz/name.jpg'))
+        self.assertFalse(ShardedFileSystemStorage(self.directory, flat_fallback=False).exists('users/kronuz/name.jpg'))
+
+    def test_reshard_storage(self):
+        flat = DjangoFileSystemStorage(self.directory)
+        storage = ShardedFileSystemStorage(self.directory)
+        for name in self.names:
+            flat.save(name, ContentFile(name))
+        # A file already in the sharded path of another one is never replaced
+        flat.save(storage.shard_name('a.txt'), ContentFile('sharded'))
+        stdout, stderr = StringIO(), StringIO()
+        with override_settings(MEDIA_ROOT=self.directory):
+            management.call_command('reshard_storage', storage='dfw.core.storage.ShardedFileSystemStorage',
+                                    verbosity=0, stdout=stdout, stderr=stderr)
+        self.assertEqual(stdout.getvalue(), "Moved 3 files\nSkipped 1 files\n")
+        self.assertIn("Skipped a.txt", stderr.getvalue())
+        self.assertEqual(storage.open('a.txt').read(), b'sharded')
+        self.assertEqual(flat.open('a.txt').read(), b'a.txt')
+        for name in self.names[1:]:
+            self.assertFalse(flat.exists(name))
+            self.assertEqual(storage.open(name).read(), name.encode('utf-8'))
+        self.assertEqual(storage.listdir('users/kronuz'), (['photos'], ['name.jpg']))
+
+
+class CacheSeqTagTests(TestCase):
+    """
+    Test the ``cache_seq`` tags get the sequences of all the fragments in a
+    template with a single ``get_many``.
+
+    """
+    context = {'user': {'id': 1, 'name': 'kronuz'}, 'page': 2}
+
+    def setUp(self):
+        cache.clear()
+        cache_seq_incr('profile', 1)
+        self.calls = []
+
+        def get_many(keys, **kwargs):
+            self.calls.append(sorted(keys))
+            return type(cache).get_many(cache, keys, **kwargs)
+        cache.get_many = get_many
+        request_started.send(sender=self.__class__)
+
+    def tearDown(self):
+        request_finished.send(sender=self.__class__)
+        del cache.get_many
+
+    def expected(self):
+        return '|'.join([
+            cache_seq('profile', 1),
+            cache_seq('posts', 'kronuz', 2),
+            cache_seq('footer'),
+        ])
+
+    def test_django(self):
+        template = Template(
+            '{% load simple_tags %}'
+            '{% cache_seq "profile" user.id as a %}{{ a }}|'
+            '{% cache_seq "posts" user.name page as b %}{{ b }}|'
+            '{% cache_seq "footer" as c %}{{ c }}')
+        self.assertEqual(template.render(Context(self.context)), self.expected())
+        self.assertEqual(len(self.calls), 1)
+
+    def test_jinja2(self):
+        template = Environment(extensions=[CacheSeqExtension]).from_string(
+            '{% cache_seq "profile", user.id as a %}{{ a }}|'
+            '{% cache_seq "posts", user["name"], page as b %}{{ b }}|'
+            '{% cache_seq "footer" as c %}{{ c }}')
+        self.assertEqual(template.render(self.context), self.expected())
+        self.assertEqual(len(self.calls), 1)
+
+    def test_jinja2_unknown_shape(self):
+        """
+        Tags not shaped as expected work, fetching their sequences on their
+        own.
+
+        """
+        class AutoescapeCacheSeqExtension(CacheSeqExtension):
+            needs_autoescape = True
+
+        template = Environment(extensions=[AutoescapeCacheSeqExtension]).from_string(
+            '{% cache_seq "profile", user.id as a %}{{ a }}|'
+            '{% cache_seq "posts", user.name, page as b %}{{ b }}|'
+            '{% cache_seq "footer" as c %}{{ c }}')
+        self.assertEqual(template.render(self.context), self.expected())
+        self.assertEqual(len(self.calls), 3)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core import management
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from dfw.core.plugins.models.statable import STATUS_DRAFT, STATUS_SCRAP, STATUS_PUBLISHED, STATUS_UNPUBLISHED
+
+from .models import Entity
+
+
+class StatableCleanupTests(TestCase):
+    """
+    Test ``StatableManager.cleanup`` (on entities).
+
+    """
+    def setUp(self):
+        self.now = timezone.now()
+        day = timezone.timedelta(days=1)
+        rows = [
+            ('old scrap', STATUS_SCRAP, self.now - 3 * day, None, None),
+            ('new scrap', STATUS_SCRAP, self.now, None, None),
+            ('expiring', STATUS_PUBLISHED, self.now, None, self.now + day),
+            ('published', STATUS_PUBLISHED, self.now, None, None),
+            ('publishing', STATUS_UNPUBLISHED, self.now, self.now + day, self.now - day),
+            ('unpublished', STATUS_UNPUBLISHED, self.now, None, None),
+            ('draft', STATUS_DRAFT, self.now - 3 * day, self.now - day, self.now + day),
+        ]
+        owner = get_user_model().objects.create_user(email='owner@example.com', first_name='Owner')
+        self.entities = {}
+        for name, status, created_at, active_from, active_to in rows:
+            entity = Entity.objects.create(owner=owner)
+            Entity.objects.filter(pk=entity.pk).update(status=status, created_at=created_at, active_from=active_from, active_to=active_to)
+            self.entities[name] = entity.pk
+
+    def statuses(self):
+        pks = dict((pk, name) for name, pk in self.entities.items())
+        return dict((pks[pk], status) for pk, status in Entity.objects.filter(pk__in=pks).values_list('pk', 'status'))
+
+    def test_cleanup(self):
+        stats = Entity.objects.cleanup(now=self.now)
+        self.assertEqual((stats['deleted'], stats['unpublished'], stats['published'], stats['chunks']), (1, 1, 1, 1))
+        self.assertEqual(self.statuses(), {
+            'new scrap': STATUS_SCRAP,
+            'expiring': STATUS_UNPUBLISHED,
+            'published': STATUS_PUBLISHED,
+            'publishing': STATUS_PUBLISHED,
+            'unpublished': STATUS_UNPUBLISHED,
+            'draft': STATUS_DRAFT,
+        })
+        stats = Entity.objects.cleanup(now=self.now)
+        self.assertEqual((stats['deleted'], stats['unpublished'], stats['published'], stats['chunks']), (0, 0, 0, 0))
+
+    def test_cleanup_slow_chunks(self):
+        """
+        Slow chunks shrink down to a single row, and every row is still
+        processed once.
+
+        """
+        stats = Entity.objects.cleanup(now=self.now, chunk_size=2, max_lock_time=-1)
+        self.assertEqual((stats['deleted'], stats['unpublished'], stats['published'], stats['chunks']), (1, 1, 1, 2))
+        self.assertNotIn('old scrap', self.statuses())
+
+    def test_cleanup_statables(self):
+        stdout = StringIO()
+        management.call_command('cleanup_statables', stdout=stdout)
+        self.assertIn("Entity: 1 deleted, 1 unpublished, 1 published in 1 chunks", stdout.getvalue())
+        self.assertNotIn('old scrap', self.statuses())
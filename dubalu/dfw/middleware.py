@@ -11,19 +11,36 @@ Dubalu Framework
 from __future__ import absolute_import, unicode_literals
 
 import re
+import time
+import threading
 
 from django.conf import settings
+from django.core.signals import request_finished
 from django.http import HttpResponseServerError
 from django.utils.encoding import force_text
 from django.utils.importlib import import_module
 from django.utils.functional import memoize
 
+from async import TaskContext
+from lru import LRUCache
 from recursiveformat import recursive_format
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+DYNAMIC_SETTINGS_SNAPSHOTS = getattr(settings, 'DYNAMIC_SETTINGS_SNAPSHOTS', True)
+DYNAMIC_SETTINGS_HOSTS_CACHE_SIZE = getattr(settings, 'DYNAMIC_SETTINGS_HOSTS_CACHE_SIZE', 1000)
+
+PROFILER_SAMPLE_RATE = getattr(settings, 'PROFILER_SAMPLE_RATE', 100)
+PROFILER_LATENCY_THRESHOLD = getattr(settings, 'PROFILER_LATENCY_THRESHOLD', None)
+PROFILER_SAMPLE_INTERVAL = getattr(settings, 'PROFILER_SAMPLE_INTERVAL', 0.005)
+PROFILER_DIRECTORY = getattr(settings, 'PROFILER_DIRECTORY', '/tmp/profiler')
+PROFILER_FLUSH_INTERVAL = getattr(settings, 'PROFILER_FLUSH_INTERVAL', 60)
+
+QUERY_BUDGET_STRICT = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+
 _HTML_TYPES = ('text/html', 'application/xhtml+xml')
 
 
@@ -33,8 +50,14 @@ def replace_insensitive(string, target, replacement):
     Code borrowed from:
     http://forums.devshed.com/python-programming-11/case-insensitive-string-replace-490921.html
     """
-    no_case = string.lower()
-    index = no_case.rfind(target.lower())
+    index = string.rfind(target)
+    if index >= 0:
+        # Only the (usually short) tail can hold a later match in other case
+        tail_index = string[index + 1:].lower().rfind(target.lower())
+        if tail_index >= 0:
+            index += 1 + tail_index
+    else:
+        index = string.lower().rfind(target.lower())
     if index >= 0:
         return string[:index] + replacement + string[index + len(target):]
     else:  # no results so return the original string
@@ -65,14 +88,142 @@ get_project_settings._cache = {}
 get_project_settings = memoize(get_project_settings, get_project_settings._cache, 0)
 
 
+class ProjectSnapshot(object):
+    """
+    Settings of a project frozen when the process starts.
+
+    ``settings`` holds the fully formatted project settings (as returned by
+    `get_project_settings()`) together with PROJECT, PROJECT_NAME and
+    PROJECT_SUFFIX, so switching to the project takes a single call to
+    ``settings.clear()``. Snapshots are shared among all requests and threads
+    and must never be modified.
+
+    """
+
+    def __init__(self, regex, project_name, project_suffix, project_settings, default_dsn=None):
+        if project_suffix:
+            project = '%s.%s' % (project_name, project_suffix)
+        else:
+            project = project_name
+        self.project = project
+        self.project_name = project_name
+        self.project_suffix = project_suffix
+        self.regex = regex
+        self.settings = dict(project_settings, PROJECT=project, PROJECT_NAME=project_name, PROJECT_SUFFIX=project_suffix)
+        try:
+            self.dsn = self.settings['RAVEN_CONFIG']['dsn']
+        except KeyError:
+            self.dsn = default_dsn
+        self._urlconf = None
+
+    @property
+    def urlconf(self):
+        """
+        The project urlconf, built the first time it's needed (the project
+        settings must already be active by then).
+
+        """
+        if self._urlconf is None:
+            from .urls import get_urls
+            self._urlconf = get_urls(self.project_name, self.project_suffix)
+        return self._urlconf
+
+
+def get_project_snapshots():
+    default_dsn = getattr(settings, 'RAVEN_CONFIG', {}).get('dsn')
+    snapshots = {}
+    for project, (regex, (project_name, project_suffix, project_settings)) in get_project_settings().items():
+        snapshots[project] = ProjectSnapshot(regex, project_name, project_suffix, project_settings, default_dsn)
+    return snapshots
+get_project_snapshots._cache = {}
+get_project_snapshots = memoize(get_project_snapshots, get_project_snapshots._cache, 0)
+
+
+class ProjectSettingsContext(TaskContext):
+    """
+    Runs async tasks with the settings of the project active when they were
+    queued (the thread or process running them switches to the project
+    snapshot with ``settings.clear()``)::
+
+        @async(backend='process', context=ProjectSettingsContext())
+        def resize_image(name):
+            ...
+
+    """
+    def capture(self):
+        return getattr(settings, 'PROJECT', None)
+
+    def enter(self, project):
+        snapshot = get_project_snapshots().get(project)
+        if snapshot is not None:
+            settings.clear(snapshot.settings)
+
+    def exit(self, project):
+        settings.clear()
+
+
 class DynamicSettingsMiddleware(object):
     """
     This middleware is in chare of resetting and setting up dynamic settings,
     including PROJECT_NAME, PROJECT_SUFFIX and other settings in a per-request
     basis.
+
+    With DYNAMIC_SETTINGS_SNAPSHOTS (the default), the settings of every
+    project are frozen in a `ProjectSnapshot` when the middleware is loaded
+    and hosts are resolved to projects through a cache, so the per-request
+    cost doesn't depend on the number of projects.
     """
     if not settings.TEST:
+        def __init__(self, snapshots=DYNAMIC_SETTINGS_SNAPSHOTS):
+            self.snapshots = get_project_snapshots() if snapshots else None
+            self.hosts = LRUCache(DYNAMIC_SETTINGS_HOSTS_CACHE_SIZE)
+            self.default_dsn = getattr(settings, 'RAVEN_CONFIG', {}).get('dsn')
+            self.default_snapshot = ProjectSnapshot(None, None, None, {}, self.default_dsn)
+
+        def resolve_host(self, host):
+            """
+            Return the snapshot of the project serving the given host
+            (or None if there is none).
+
+            """
+            try:
+                return self.hosts[host]
+            except KeyError:
+                pass
+            for snapshot in self.snapshots.values():
+                if snapshot.regex.search(host):
+                    break
+            else:
+                snapshot = None
+            self.hosts[host] = snapshot
+            return snapshot
+
+        def set_dsn(self, dsn):
+            from raven.contrib.django.models import client
+            if getattr(client, '_dfw_dsn', None) != dsn:
+                client.set_dsn(dsn)
+                client._dfw_dsn = dsn
+
         def process_request(self, request):
+            if self.snapshots is None:
+                return self.process_request_unfrozen(request)
+            host = request.get_host()
+            try:
+                snapshot = self.snapshots[request.META['HTTP_X_PROJECT']]
+            except KeyError:
+                logger.warning("X-Project not set in the request headers, falling back to regexp resolution!")
+                snapshot = self.resolve_host(host)
+                if snapshot is None:
+                    if self.snapshots:
+                        return HttpResponseServerError("No project found for the given host: %s" % host)
+                    snapshot = self.default_snapshot
+
+            # Settings and urls override:
+            settings.clear(snapshot.settings)
+            self.set_dsn(snapshot.dsn)
+            request.urlconf = snapshot.urlconf
+
+        def process_request_unfrozen(self, request):
             projects = get_project_settings()
             host = request.get_host()
             try:
@@ -86,6 +237,7 @@ class DynamicSettingsMiddleware(object):
                     if projects:
                         return HttpResponseServerError("No project found for the given host: %s" % host)
                     project_suffix = project_name = None
+                    project_settings = {}
             if project_suffix:
                 project = '%s.%s' % (project_name, project_suffix)
             else:
@@ -102,9 +254,12 @@ class DynamicSettingsMiddleware(object):
             request.urlconf = urlpatterns
 
         def process_response(self, request, response):
-            from raven.contrib.django.models import client
             settings.clear()  # If not running tests, cleanup settings (requires patch #12737-thread_local_settings.diff):
-            client.set_dsn(settings.RAVEN_CONFIG['dsn'])
+            if self.snapshots is None:
+                from raven.contrib.django.models import client
+                client.set_dsn(settings.RAVEN_CONFIG['dsn'])
+            else:
+                self.set_dsn(self.default_dsn)
             return response
 
         # def process_exception(self, request, exception):
@@ -131,3 +286,97 @@ class ProfilerMiddleware(object):
                 if response.get('Content-Length', None):
                     response['Content-Length'] = len(response.content)
         return response
+
+
+class SamplingProfilerMiddleware(object):
+    """
+    Profiles one in PROFILER_SAMPLE_RATE requests (those taking at least
+    PROFILER_LATENCY_THRESHOLD seconds, if set) with the process
+    ``SamplingProfiler``, aggregating the stacks by URL name. See
+    ``manage.py dump_profiles``.
+
+    """
+    profiler = None
+
+    def __init__(self):
+        if SamplingProfilerMiddleware.profiler is None:
+            from .utils.profiler import SamplingProfiler
+            SamplingProfilerMiddleware.profiler = SamplingProfiler(
+                rate=PROFILER_SAMPLE_RATE,
+                threshold=PROFILER_LATENCY_THRESHOLD,
+                interval=PROFILER_SAMPLE_INTERVAL,
+                directory=PROFILER_DIRECTORY,
+                flush_interval=PROFILER_FLUSH_INTERVAL,
+            )
+
+    def process_request(self, request):
+        if self.profiler.sample():
+            request._sampling_profiler_start = time.time()
+            self.profiler.begin()
+
+    def process_response(self, request, response):
+        start = getattr(request, '_sampling_profiler_start', None)
+        if start is not None:
+            del request._sampling_profiler_start
+            resolver_match = getattr(request, 'resolver_match', None)
+            name = getattr(resolver_match, 'url_name', None) or getattr(resolver_match, 'view_name', None)
+            self.profiler.end(name or 'unresolved', time.time() - start)
+        return response
+
+
+class QueryCountMiddleware(object):
+    """
+    Development/CI middleware counting the queries of every request and
+    looking for N+1 patterns (see ``dfw.utils.queries``). The count goes in
+    the ``X-Query-Count`` header, N+1 reports are logged and views exceeding
+    the budget declared with ``@query_budget(n)`` raise
+    ``QueryBudgetExceeded`` if QUERY_BUDGET_STRICT (e.g. in tests) or log a
+    warning otherwise.
+
+    """
+    def process_request(self, request):
+        from .utils.queries import QueryTracker
+        query_trackers_teardown()
+        # The request already started, reset_queries() won't truncate them.
+        request._query_tracker = query_trackers.tracker = QueryTracker(hold_queries=False).__enter__()
+        request._query_budget = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = getattr(view_func, '_query_budget', None)
+
+    def process_response(self, request, response):
+        tracker = getattr(request, '_query_tracker', None)
+        if tracker is None:
+            return response
+        del request._query_tracker
+        query_trackers.tracker = None
+        tracker.__exit__(None, None, None)
+        report = tracker.report()
+        response['X-Query-Count'] = report.count
+        if report.n_plus_one:
+            logger.warning("N+1 queries in %s: %s", request.path, report)
+        budget = request._query_budget
+        if budget is not None and report.count > budget:
+            from .utils.queries import QueryBudgetExceeded
+            message = "%s ran %d queries, over its budget of %d: %s" % (request.path, report.count, budget, report)
+            if QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+query_trackers = threading.local()
+
+
+def query_trackers_teardown(**kwargs):
+    """
+    Exits the QueryCountMiddleware tracker of a finished request whose
+    ``process_response`` was skipped (e.g. if a response middleware before
+    it raised), so it doesn't leak with the debug cursor on.
+
+    """
+    tracker = getattr(query_trackers, 'tracker', None)
+    if tracker is not None:
+        query_trackers.tracker = None
+        tracker.__exit__(None, None, None)
+request_finished.connect(query_trackers_teardown)
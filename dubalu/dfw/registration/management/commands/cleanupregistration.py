@@ -17,6 +17,8 @@ contains the actual logic for determining which accounts are deleted.
 """
 from __future__ import absolute_import, unicode_literals
 
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 
 from ...models import RegistrationProfile
@@ -25,5 +27,22 @@ from ...models import RegistrationProfile
 class Command(NoArgsCommand):
     help = "Delete expired user registrations from the database"
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+            help='Number of users deleted per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only count the expired registrations.'),
+    )
+
+    def progress(self, deleted, total):
+        self.stdout.write("Deleted %d of %d expired users" % (deleted, total))
+
     def handle_noargs(self, **options):
-        RegistrationProfile.objects.delete_expired_users()
+        verbosity = int(options['verbosity'])
+        deleted = RegistrationProfile.objects.delete_expired_users(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            progress=self.progress if verbosity > 1 else None,
+        )
+        if verbosity:
+            self.stdout.write("%s %d expired users" % ("Would delete" if options['dry_run'] else "Deleted", deleted))
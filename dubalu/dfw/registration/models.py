@@ -19,6 +19,8 @@ import re
 from django.conf import settings
 from django.db import models
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth import get_user_model
 from django.contrib.sites import get_current_site
@@ -121,7 +123,7 @@ class RegistrationManager(models.Manager):
                                               ))
         return profile
 
-    def delete_expired_users(self):
+    def delete_expired_users(self, batch_size=1000, dry_run=False, progress=None):
         """
         Remove expired instances of ``RegistrationProfile`` and their
         associated ``User``s.
@@ -160,17 +162,53 @@ class RegistrationManager(models.Manager):
         does not have an associated ``RegistrationProfile`` will not
         be deleted.
 
+        The work is set based: expired profiles are selected in SQL, in
+        chunks of ``batch_size``, and their (still inactive) users and, by
+        cascade, the profiles are deleted a chunk at a time, each chunk in
+        its own transaction. With ``dry_run`` nothing is deleted.
+        ``progress``, if given, is called with the number of users deleted
+        so far and the total after every chunk. Returns the number of (to
+        be) deleted users.
+
         """
         UserModel = get_user_model()
-        for profile in self.all():
-            try:
-                if profile.activation_key_expired():
-                    user = profile.user
-                    if not user.is_active:
-                        user.delete()
-                        profile.delete()
-            except UserModel.DoesNotExist:
-                profile.delete()
+        try:
+            UserModel._meta.get_field('date_joined')
+            date_joined = 'date_joined'
+        except FieldDoesNotExist:
+            # The user model only has a ``date_joined`` property
+            date_joined = 'created_at'
+        cutoff = datetime_now() - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        expired = self.filter(user__is_active=False).filter(
+            Q(activation_key=self.model.ACTIVATED) | Q(**{'user__%s__lte' % date_joined: cutoff}))
+
+        total = expired.count()
+        if dry_run:
+            return total
+
+        deleted = 0
+        last_pk = None
+        while True:
+            chunk = expired.order_by('pk')
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk.values_list('pk', 'user_id')[:batch_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            with transaction.atomic():
+                # Users activated since the chunk was selected are kept
+                users = UserModel._default_manager.filter(
+                    pk__in=[user_id for pk, user_id in chunk], is_active=False)
+                user_ids = list(users.select_for_update().values_list('pk', flat=True))
+                if user_ids:
+                    # Profiles go away by cascade
+                    UserModel._default_manager.filter(pk__in=user_ids).delete()
+            deleted += len(user_ids)
+            if progress is not None:
+                progress(deleted, total)
+
+        return deleted
 
 
 class RegistrationProfile(models.Model):
@@ -255,6 +255,34 @@ class RegistrationModelTests(TestCase):
         username_field_name = getattr(User, 'USERNAME_FIELD', 'username')
         self.assertRaises(User.DoesNotExist, User.objects.get, **{username_field_name: self.bob_info[username_field_name]})
 
+    def test_expired_user_deletion_in_batches(self):
+        """
+        ``RegistrationProfile.objects.delete_expired_users()`` only counts
+        expired users on a dry run, and deletes them in batches reporting
+        its progress.
+
+        """
+        Site = get_site_model()
+        RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            **self.alice_info)
+        expired_user = RegistrationProfile.objects.create_inactive_user(
+            site=Site.objects.get_current(),
+            **self.bob_info)
+        expired_user.date_joined -= datetime.timedelta(
+            days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+        expired_user.save()
+
+        self.assertEqual(RegistrationProfile.objects.delete_expired_users(dry_run=True), 1)
+        self.assertEqual(RegistrationProfile.objects.count(), 2)
+
+        progress = []
+        deleted = RegistrationProfile.objects.delete_expired_users(
+            batch_size=1, progress=lambda deleted, total: progress.append((deleted, total)))
+        self.assertEqual(deleted, 1)
+        self.assertEqual(progress, [(1, 1)])
+        self.assertEqual(RegistrationProfile.objects.count(), 1)
+
     def test_management_command(self):
         """
         The ``cleanupregistration`` management command properly
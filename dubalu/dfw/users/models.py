@@ -15,6 +15,7 @@ import random
 import warnings
 
 from django.db import models
+from django.db.models import Q, signals
 from django.conf import settings
 from django.core import validators
 from django.core.mail import send_mail
@@ -117,6 +118,69 @@ class UserManager(BaseUserManager):
         return self._create_user(email or username, password, True, True,
                                  **extra_fields)
 
+    def taken_usernames(self, prefix, exclude_id=None):
+        """
+        Returns the (lowercased) usernames ``unique_username(prefix)`` could
+        collide with (prefix itself and prefix followed by a dash), with a
+        single query.
+        """
+        queryset = self.filter(Q(username__iexact=prefix) | Q(username__istartswith=prefix + '-'))
+        if exclude_id is not None:
+            queryset = queryset.exclude(id=exclude_id)
+        return set(username.lower() for username in queryset.values_list('username', flat=True))
+
+    def unique_username(self, username, exclude_id=None, taken=None):
+        """
+        Returns username, or username with a random numeric suffix if it's
+        reserved or already taken (all the usernames it could collide with
+        are fetched at once, unless given in taken, which is updated).
+        """
+        if taken is None:
+            taken = self.taken_usernames(username, exclude_id)
+        reserved = settings.RESERVED_USERNAMES
+        candidate = username
+        digits = 1
+        while candidate.lower() in taken or candidate.lower() in reserved:
+            for t in range(10):
+                candidate = '%s-%0*d' % (username, digits, random.randint(0, 10 ** digits - 1))
+                if candidate.lower() not in taken:
+                    break
+            digits += 1
+        taken.add(candidate.lower())
+        return candidate
+
+    def bulk_create_users(self, users, batch_size=None):
+        """
+        Creates many (unsaved) users with ``bulk_create()``, normalizing
+        their emails and setting unique usernames with one query per
+        username, instead of per user. The ``pre_save`` hooks run, but
+        ``post_save`` signals aren't sent (as with any ``bulk_create()``).
+        """
+        groups = {}
+        for user in users:
+            if user.email:
+                user.email = self.normalize_email(user.email)
+            if not user.username and settings.SLUGIFY_USER_NAME:
+                username = slugify(user.get_full_name())
+                if username:
+                    groups.setdefault(username.lower(), []).append((username, user))
+        fetched = []
+        for prefix, group in sorted(groups.items()):
+            # Usernames starting with an already fetched prefix and a dash
+            # share its set (it holds them all), so generated suffixes can't
+            # collide
+            for fetched_prefix, taken in fetched:
+                if prefix == fetched_prefix or prefix.startswith(fetched_prefix + '-'):
+                    break
+            else:
+                taken = self.taken_usernames(prefix)
+                fetched.append((prefix, taken))
+            for username, user in group:
+                user.username = self.unique_username(username, taken=taken)
+        for user in users:
+            signals.pre_save.send(sender=self.model, instance=user, raw=False, using=self.db, update_fields=None)
+        return self.bulk_create(users, batch_size=batch_size)
+
     def latest(self, num=5):
         '''
         Get the latest entities
@@ -218,36 +282,22 @@ class AbstractUser(AbstractBaseUser):
         """
         send_mail(subject, message, from_email, [self.email])
 
-    def post_save(self, created, save=False):
+    def pre_save(self):
         """
-        Then, if the user has been created, update the username, in accordance
-        to the project settings.
+        If the user is being created, normalize the email and set a unique
+        username, in accordance to the project settings.
         """
-        if created:
+        if self._state.adding:
             UserModel = auth.get_user_model()
 
             # Normalized email:
             if self.email:
                 self.email = UserModel.objects.normalize_email(self.email)
 
-            name = self.get_full_name()
-            username = self.username
-            if not username and settings.SLUGIFY_USER_NAME:
-                username = slugify(name)
-            if username and self.username != username:
-                for t in range(6):
-                    if username.lower() not in settings.RESERVED_USERNAMES:
-                        if not UserModel.objects.filter(username__iexact=username).exclude(id=self.id).exists():
-                            break
-                    if t == 0:
-                        username += '-'
-                    username += str(random.randint(0, 9))
-                    if t == 5:
-                        username = None
-            if self.username != username:
-                self.username = username
-                save = True
-        return save
+            if not self.username and settings.SLUGIFY_USER_NAME:
+                username = slugify(self.get_full_name())
+                if username:
+                    self.username = UserModel.objects.unique_username(username, exclude_id=self.id)
 
     def get_tags(self):
         user_type = ['UserType:' + self.type]
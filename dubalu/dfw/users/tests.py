@@ -1,3 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+
+class BulkCreateUsersTests(TestCase):
+    """
+    Test ``UserManager.bulk_create_users``.
+
+    """
+    def setUp(self):
+        self.settings_override = self.settings(SLUGIFY_USER_NAME=True, RESERVED_USERNAMES=('admin',))
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def test_unique_usernames(self):
+        """
+        Colliding names get unique usernames, fetching the taken ones with
+        one query per username.
+
+        """
+        User = get_user_model()
+        User.objects.create_user(email='john@example.com', first_name='John', last_name='Smith')
+        users = [User(email='john%d@example.com' % i, first_name='John', last_name='Smith') for i in range(5)]
+        users += [User(email='jane@example.com', first_name='Jane', last_name='Doe'), User(email='admin@example.com', first_name='Admin')]
+        with self.assertNumQueries(4):  # Three usernames and the INSERT
+            User.objects.bulk_create_users(users)
+
+        usernames = [user.username for user in User.objects.filter(email__in=[user.email for user in users])]
+        self.assertEqual(len(set(username.lower() for username in usernames)), 7)
+        self.assertIn('jane-doe', usernames)
+        self.assertNotIn('admin', usernames)
+        self.assertNotIn('john-smith', usernames)
+        self.assertTrue(all(username.startswith('john-smith-') for username in usernames if username.startswith('john')))
+
+    def test_taken_usernames(self):
+        """
+        Only the usernames a generated one could collide with are fetched,
+        and prefixes followed by a dash share the set of the shorter one.
+
+        """
+        User = get_user_model()
+        for username in ('John', 'john-7', 'johnny', 'john-smith-12', 'johnsmith'):
+            user = User.objects.create_user(email='%s@example.com' % username)
+            User.objects.filter(pk=user.pk).update(username=username)
+        self.assertEqual(User.objects.taken_usernames('john'), set(['john', 'john-7', 'john-smith-12']))
+        self.assertEqual(User.objects.taken_usernames('john-smith'), set(['john-smith-12']))
+
+        users = [User(email='john@example.net', first_name='John'), User(email='smith@example.net', first_name='John', last_name='Smith')]
+        with self.assertNumQueries(2):  # One username and the INSERT
+            User.objects.bulk_create_users(users)
+        self.assertTrue(users[0].username.startswith('john-'))
+        self.assertEqual(users[1].username, 'john-smith')
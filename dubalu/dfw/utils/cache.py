@@ -10,12 +10,30 @@ Dubalu Framework
 """
 from __future__ import absolute_import, unicode_literals
 
+import math
+import time
+import zlib
+import random
 import hashlib
+import threading
+from functools import wraps
 
+from django.conf import settings
+from django.utils import six
 from django.utils.encoding import force_bytes
 from django.utils.http import urlquote
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
+from django.core.signals import request_finished, request_started
+
+from async import Histogram
+
+FRAGMENT_CACHE_STALE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_STALE_TIMEOUT', 300)
+FRAGMENT_CACHE_LOCK_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_LOCK_TIMEOUT', 30)
+FRAGMENT_CACHE_LOCK_WAIT = getattr(settings, 'FRAGMENT_CACHE_LOCK_WAIT', 5)
+FRAGMENT_CACHE_LOCK_POLL = getattr(settings, 'FRAGMENT_CACHE_LOCK_POLL', 0.05)
+FRAGMENT_CACHE_BETA = getattr(settings, 'FRAGMENT_CACHE_BETA', 1.0)
+FRAGMENT_CACHE_COMPRESS_MIN_LENGTH = getattr(settings, 'FRAGMENT_CACHE_COMPRESS_MIN_LENGTH', 16 * 1024)
 
 
 def make_fragment_key(fragment_name, vary_on=None, fragment_key_template='dfw.cache.%s.%s'):
@@ -26,6 +44,85 @@ def make_fragment_key(fragment_name, vary_on=None, fragment_key_template='dfw.ca
     return fragment_key_template % (fragment_name, args.hexdigest())
 
 
+# Request scoped fragment sequences: ``seqs`` caches the resolved ones and
+# ``declared`` holds the cache keys to be resolved (all at once) by the next
+# lookup. Both only exist while serving a request.
+seq_collector = threading.local()
+
+
+def seq_collector_setup(**kwargs):
+    seq_collector.seqs = {}
+    seq_collector.declared = set()
+request_started.connect(seq_collector_setup)
+
+
+def seq_collector_teardown(**kwargs):
+    if hasattr(seq_collector, 'seqs'):
+        del seq_collector.seqs
+        del seq_collector.declared
+request_finished.connect(seq_collector_teardown)
+
+
+def _get_seqs(cache_keys):
+    """
+    Returns a dictionary with the sequence of the cache keys, getting all
+    the missing (and declared) ones with a single ``get_many``.
+
+    """
+    seqs = getattr(seq_collector, 'seqs', None)
+    if seqs is None:
+        all_seq = cache.get_many(cache_keys)
+        return dict((cache_key, all_seq.get(cache_key) or 0) for cache_key in cache_keys)
+    missing = seq_collector.declared.union(cache_keys).difference(seqs)
+    if missing:
+        all_seq = cache.get_many(list(missing))
+        for cache_key in missing:
+            seqs[cache_key] = all_seq.get(cache_key) or 0
+        seq_collector.declared.clear()
+    return seqs
+
+
+def cache_seq_declare(frags):
+    """
+    Declares the fragments (``(fragm_name, vary_on)`` tuples) the request
+    will need, so the first ``cache_seq()`` gets them all in one round trip.
+
+    """
+    if hasattr(seq_collector, 'declared'):
+        seq_collector.declared.update(make_template_fragment_key(fragm_name, vary_on) for fragm_name, vary_on in frags)
+
+
+def cache_seq_prefetch(frags):
+    """
+    Gets the sequence of the given (and all declared) fragments with a
+    single round trip; later ``cache_seq()`` calls in the request are then
+    served locally.
+
+    """
+    cache_seq_declare(frags)
+    _get_seqs([])
+
+
+def prefetch_cache_seq(frags):
+    """
+    View decorator declaring the fragments the view renders. ``frags`` is
+    a list of ``(fragm_name, vary_on)`` tuples or a callable receiving the
+    view arguments and returning it.
+
+        @prefetch_cache_seq(lambda request, pk: [('profile', (pk,)), ('wall', (pk,))])
+        def profile(request, pk):
+            ...
+
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            cache_seq_declare(frags(request, *args, **kwargs) if callable(frags) else frags)
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
 def cache_seq_incr(fragm_name, *vary_on):
     cache_key = make_template_fragment_key(fragm_name, vary_on)
     try:
@@ -33,16 +130,216 @@ def cache_seq_incr(fragm_name, *vary_on):
     except ValueError:
         seq = 1
         cache.set(cache_key, seq)
+    seqs = getattr(seq_collector, 'seqs', None)
+    if seqs is not None:
+        seqs[cache_key] = seq
     return seq
 
 
+def cache_seq_incr_many(frags):
+    """
+    Invalidates many fragments (``(fragm_name, vary_on)`` tuples) with a
+    ``get_many`` and a ``set_many``, instead of a round trip per fragment.
+
+    """
+    cache_keys = [make_template_fragment_key(fragm_name, vary_on) for fragm_name, vary_on in frags]
+    all_seq = cache.get_many(cache_keys)
+    # Sequences only need to change: a timestamp makes concurrent bulk
+    # increments (which aren't atomic) end up with different values.
+    now = int(time.time() * 1000000)
+    all_seq = dict((cache_key, max((all_seq.get(cache_key) or 0) + 1, now)) for cache_key in cache_keys)
+    cache.set_many(all_seq)
+    seqs = getattr(seq_collector, 'seqs', None)
+    if seqs is not None:
+        seqs.update(all_seq)
+    return [all_seq[cache_key] for cache_key in cache_keys]
+
+
 def cache_seq(fragm_name, *vary_on):
     cache_key = make_template_fragment_key(fragm_name, vary_on)
-    seq = cache.get(cache_key) or 0
+    seq = _get_seqs([cache_key])[cache_key]
     return '{0}:{1}'.format(cache_key, seq)
 
 
 def cache_seq_multi(frags):
     cache_keys = [make_template_fragment_key(fragm_name, vary_on) for fragm_name, vary_on in frags]
-    all_seq = cache.get_many(cache_keys)
-    return ['{0}:{1}'.format(cache_key, all_seq.get(cache_key) or 0) for cache_key in cache_keys]
+    all_seq = _get_seqs(cache_keys)
+    return ['{0}:{1}'.format(cache_key, all_seq[cache_key]) for cache_key in cache_keys]
+
+
+class FragmentStats(object):
+    """
+    Counts and timings of a cached fragment (in this process).
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.recomputes = 0
+        self.hit_time = Histogram()
+        self.compute_time = Histogram()
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'stale': self.stale,
+            'misses': self.misses,
+            'recomputes': self.recomputes,
+            'hit_time': self.hit_time.as_dict(),
+            'compute_time': self.compute_time.as_dict(),
+        }
+
+
+_fragment_stats = {}
+_fragment_stats_lock = threading.Lock()
+
+
+def _record(fragm_name, counter, histogram, elapsed):
+    with _fragment_stats_lock:
+        stats = _fragment_stats.get(fragm_name)
+        if stats is None:
+            stats = _fragment_stats[fragm_name] = FragmentStats()
+        setattr(stats, counter, getattr(stats, counter) + 1)
+        getattr(stats, histogram).add(elapsed)
+
+
+def fragment_stats():
+    """
+    Returns the hits, stale hits, misses and recomputes (of a current
+    generation but expired or early recomputed fragment) per fragment name.
+
+    """
+    with _fragment_stats_lock:
+        return dict((fragm_name, stats.as_dict()) for fragm_name, stats in _fragment_stats.items())
+
+
+def reset_fragment_stats():
+    with _fragment_stats_lock:
+        _fragment_stats.clear()
+
+
+def _pack(value, compress):
+    if compress is not None and isinstance(value, six.string_types) and len(value) >= compress:
+        if isinstance(value, six.text_type):
+            return 'text', zlib.compress(value.encode('utf-8'))
+        return 'bytes', zlib.compress(value)
+    return None, value
+
+
+def _unpack(compressed, value):
+    if compressed == 'text':
+        return zlib.decompress(value).decode('utf-8')
+    if compressed == 'bytes':
+        return zlib.decompress(value)
+    return value
+
+
+def get_fragment(fragm_name, vary_on, compute, timeout=300, stale_timeout=FRAGMENT_CACHE_STALE_TIMEOUT,
+                 depends=None, beta=FRAGMENT_CACHE_BETA, compress=FRAGMENT_CACHE_COMPRESS_MIN_LENGTH,
+                 lock_wait=FRAGMENT_CACHE_LOCK_WAIT):
+    """
+    Returns the cached value of a fragment, calling ``compute()`` to get it
+    when needed.
+
+    The fragment belongs to the generation of the ``cache_seq`` of the
+    ``depends`` fragments (``(fragm_name, vary_on)`` tuples, itself by
+    default), so ``cache_seq_incr()`` invalidates it. It's fresh for
+    ``timeout`` seconds (soft TTL) and kept ``stale_timeout`` seconds more
+    (hard TTL) to be served while a single process recomputes it; the rest
+    get the stale value instead of recomputing it all at once. Fragments of
+    a previous generation are never served: when there's no fragment of the
+    current generation (a miss or an invalidated one) a single process
+    computes it while the rest wait for it (polling up to ``lock_wait``
+    seconds, then computing it themselves).
+
+    A fresh fragment is also recomputed early with a probability growing as
+    its expiration approaches (scaled by ``beta`` and by how long it took to
+    compute, 0 disables it), so popular fragments seldom expire at all.
+
+    Strings of at least ``compress`` length are stored compressed (None
+    disables it).
+
+    """
+    start = time.time()
+    cache_key = make_fragment_key(fragm_name, vary_on)
+    if depends is None:
+        depends = [(fragm_name, vary_on)]
+    generation = hashlib.md5(force_bytes(' '.join(cache_seq_multi(depends)))).hexdigest()
+
+    entry = cache.get(cache_key)
+    if entry is not None and entry[0] != generation:
+        entry = None  # Invalidated
+    lock_key = cache_key + ':lock'
+    if entry is not None:
+        entry_generation, expires, delta, compressed, value = entry
+        if start - delta * beta * math.log(1.0 - random.random()) < expires:
+            value = _unpack(compressed, value)
+            _record(fragm_name, 'hits', 'hit_time', time.time() - start)
+            return value
+        if not cache.add(lock_key, True, FRAGMENT_CACHE_LOCK_TIMEOUT):
+            # Somebody else is recomputing it
+            value = _unpack(compressed, value)
+            _record(fragm_name, 'stale', 'hit_time', time.time() - start)
+            return value
+    else:
+        deadline = start + lock_wait
+        while True:
+            if cache.add(lock_key, True, FRAGMENT_CACHE_LOCK_TIMEOUT):
+                # It could have been computed since it was looked up
+                entry = cache.get(cache_key)
+                if entry is None or entry[0] != generation:
+                    entry = None
+                    break
+                cache.delete(lock_key)
+            elif time.time() >= deadline:
+                lock_key = None  # Waited enough, compute it anyway
+                break
+            else:
+                time.sleep(FRAGMENT_CACHE_LOCK_POLL)
+                entry = cache.get(cache_key)
+            if entry is not None and entry[0] == generation:
+                value = _unpack(entry[3], entry[4])
+                _record(fragm_name, 'hits', 'hit_time', time.time() - start)
+                return value
+            entry = None
+
+    try:
+        value = compute()
+        delta = time.time() - start
+        compressed, packed = _pack(value, compress)
+        cache.set(cache_key, (generation, start + delta + timeout, delta, compressed, packed), timeout + stale_timeout)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+    _record(fragm_name, 'misses' if entry is None else 'recomputes', 'compute_time', delta)
+    return value
+
+
+def cached_fragment(fragm_name=None, vary_on=None, **kwargs):
+    """
+    Decorator caching the result of a function with ``get_fragment()``.
+    ``vary_on`` is a callable receiving the function arguments (by default
+    the arguments themselves are used), the rest of the keyword arguments
+    are passed to ``get_fragment()``.
+
+        @cached_fragment('profile_card', vary_on=lambda user: (user.pk,), timeout=600)
+        def profile_card(user):
+            ...
+
+    """
+    def decorator(func):
+        name = fragm_name or '%s.%s' % (func.__module__, func.__name__)
+
+        @wraps(func)
+        def _wrapped(*args, **kw):
+            if vary_on is None:
+                fragm_vary_on = args + tuple(sorted(kw.items()))
+            else:
+                fragm_vary_on = vary_on(*args, **kw)
+            return get_fragment(name, fragm_vary_on, lambda: func(*args, **kw), **kwargs)
+        return _wrapped
+    return decorator
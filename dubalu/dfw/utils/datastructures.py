@@ -8,7 +8,8 @@ Dubalu Framework
 :license: See LICENSE for license details.
 
 """
-from bisect import bisect_left, bisect_right
+from bisect import bisect_left, insort
+from itertools import chain
 
 
 class Struct(dict):
@@ -45,6 +46,102 @@ class Struct(dict):
         return self.__class__(dict.copy(self))
 
 
+class SortedKeyList(object):
+    """
+    A list of unique keys kept sorted in blocks of up to ``2 * load`` keys,
+    so adding or removing a key costs a bisection of the blocks plus moving
+    (at most) a block, instead of re-sorting everything.
+
+    """
+    def __init__(self, keys=(), load=1000):
+        self.load = load
+        self._reset(sorted(keys))
+
+    def _reset(self, keys):
+        load = self.load
+        self._blocks = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+    def __contains__(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        return block[j] == key
+
+    def add(self, key):
+        maxes = self._maxes
+        if not maxes:
+            self._blocks.append([key])
+            maxes.append(key)
+        else:
+            i = bisect_left(maxes, key)
+            if i == len(maxes):
+                i -= 1
+                self._blocks[i].append(key)
+                maxes[i] = key
+            else:
+                insort(self._blocks[i], key)
+            block = self._blocks[i]
+            if len(block) > 2 * self.load:
+                load = self.load
+                self._blocks[i:i + 1] = [block[:load], block[load:]]
+                maxes[i:i + 1] = [block[load - 1], block[-1]]
+        self._len += 1
+
+    def remove(self, key):
+        maxes = self._maxes
+        i = bisect_left(maxes, key)
+        if i == len(maxes):
+            raise ValueError(key)
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if block[j] != key:
+            raise ValueError(key)
+        del block[j]
+        if block:
+            maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del maxes[i]
+        self._len -= 1
+
+    def update(self, keys):
+        """
+        Adds many (new) keys: one by one if they are just a few, otherwise
+        merging them with the sorted keys (a linear merge of two runs).
+        """
+        keys = list(keys)
+        if len(keys) * 8 < self._len:
+            for key in keys:
+                self.add(key)
+        else:
+            keys.sort()
+            self._reset(sorted(chain(self, keys)))
+
+    def irange(self, lo):
+        """
+        Returns an iterator of the keys greater than or equal to ``lo``.
+        """
+        maxes = self._maxes
+        i = bisect_left(maxes, lo)
+        if i < len(maxes):
+            block = self._blocks[i]
+            for key in block[bisect_left(block, lo):]:
+                yield key
+            for block in self._blocks[i + 1:]:
+                for key in block:
+                    yield key
+
+
 class SortedDictIndex(dict):
     """
     A dictionary with efficient access of key ranges
@@ -90,16 +187,33 @@ class SortedDictIndex(dict):
     ]
 
     Notice that :method range: returns an iterator object in all cases
+
+    The sorted keys are kept up to date (in a SortedKeyList) as the
+    dictionary changes, after they are first needed.
     """
     _sorted_keys = None
 
     @property
     def sorted_keys(self):
         if self._sorted_keys is None:
-            self._sorted_keys = self.keys()
-            self._sorted_keys.sort()
+            self._sorted_keys = SortedKeyList(self)
         return self._sorted_keys
 
+    def range_keys(self, lo_prefix, hi_prefix=None):
+        """
+        Returns an iterator of the keys inside the given range (inclusive
+        bounds, keys prefixed by hi_prefix included).
+
+        """
+        if hi_prefix is None:
+            hi_prefix = lo_prefix
+        for key in self.sorted_keys.irange(lo_prefix):
+            # keys prefixed by hi_prefix sort right after it (whatever
+            # their characters are)
+            if key > hi_prefix and not key.startswith(hi_prefix):
+                break
+            yield key
+
     def range(self, lo_prefix, hi_prefix=None, new_prefix=None):
         """
         Returns a list of key-value pairs having the given prefix. If new_prefix is given then
@@ -112,51 +226,143 @@ class SortedDictIndex(dict):
         By default no transformation of key is applied
 
         """
-        keys = self.sorted_keys
-        lo = bisect_left(keys, lo_prefix)
-        if hi_prefix is None:
-            hi_prefix = lo_prefix
-        # ~ symbol will work for strings with printable characters,
-        # a much better way could be changing the default comparison but it will be pretty slow
-        hi = bisect_right(keys, hi_prefix + "~")
+        return self._items(self.range_keys(lo_prefix, hi_prefix), lo_prefix, new_prefix)
 
+    def _items(self, keys, lo_prefix, new_prefix):
         if new_prefix is None:
-            for i in range(lo, hi):
-                key = keys[i]
+            for key in keys:
                 yield (key, self[key])
+        elif callable(new_prefix):
+            for key in keys:
+                yield (new_prefix(key), self[key])
         else:
-            if callable(new_prefix):
-                for i in range(lo, hi):
-                    key = keys[i]
-                    yield (new_prefix(key), self[key])
-            else:
-                s = len(lo_prefix)  # this will work for prefixes with fixed length
-                for i in range(lo, hi):
-                    _key = keys[i]
-                    key = new_prefix + _key[s:]
-                    yield (key, self[_key])
+            s = len(lo_prefix)  # this will work for prefixes with fixed length
+            for key in keys:
+                yield (new_prefix + key[s:], self[key])
 
-    def __setitem__(self, key, value):
+    def _key_added(self, key):
+        if self._sorted_keys is not None:
+            self._sorted_keys.add(key)
+
+    def _keys_added(self, keys):
+        if self._sorted_keys is not None:
+            self._sorted_keys.update(keys)
+
+    def _key_removed(self, key):
+        if self._sorted_keys is not None:
+            self._sorted_keys.remove(key)
+
+    def _keys_cleared(self):
         self._sorted_keys = None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._key_added(key)
         super(SortedDictIndex, self).__setitem__(key, value)
 
     def __delitem__(self, key):
-        self._sorted_keys = None
         super(SortedDictIndex, self).__delitem__(key)
+        self._key_removed(key)
 
     def update(self, *args, **kwargs):
-        self._sorted_keys = None
-        return super(SortedDictIndex, self).update(*args, **kwargs)
+        other = dict(*args, **kwargs)
+        self._keys_added([key for key in other if key not in self])
+        return super(SortedDictIndex, self).update(other)
 
-    def pop(self, *args):
-        self._sorted_keys = None
-        return super(SortedDictIndex, self).pop(*args)
+    def pop(self, key, *args):
+        if key in self:
+            self._key_removed(key)
+        return super(SortedDictIndex, self).pop(key, *args)
 
-    def setdefault(self, key, default):
+    def popitem(self):
+        key, value = super(SortedDictIndex, self).popitem()
+        self._key_removed(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
         if key not in self:
-            self._sorted_keys = None
+            self._key_added(key)
         return super(SortedDictIndex, self).setdefault(key, default)
 
     def clear(self):
-        self._sorted_keys = None
+        self._keys_cleared()
         super(SortedDictIndex, self).clear()
+
+
+class PrefixTrieIndex(SortedDictIndex):
+    """
+    A SortedDictIndex whose prefix queries (single argument :method range:)
+    walk a trie of the ``separator`` delimited key segments (e.g. the
+    ``form-0-field`` keys of prefixed forms), instead of sorting all keys:
+    building the trie doesn't sort anything and a query only visits the
+    matching keys, in segment order.
+    """
+    _trie = None
+
+    def __init__(self, *args, **kwargs):
+        self.separator = kwargs.pop('separator', '-')
+        super(PrefixTrieIndex, self).__init__(*args, **kwargs)
+
+    @property
+    def trie(self):
+        if self._trie is None:
+            self._trie = {}
+            for key in self:
+                self._trie_add(key)
+        return self._trie
+
+    def _trie_add(self, key):
+        node = self._trie
+        for segment in key.split(self.separator):
+            node = node.get(segment) or node.setdefault(segment, {})
+        node[None] = key
+
+    def _key_added(self, key):
+        super(PrefixTrieIndex, self)._key_added(key)
+        if self._trie is not None:
+            self._trie_add(key)
+
+    def _keys_added(self, keys):
+        super(PrefixTrieIndex, self)._keys_added(keys)
+        if self._trie is not None:
+            for key in keys:
+                self._trie_add(key)
+
+    def _key_removed(self, key):
+        super(PrefixTrieIndex, self)._key_removed(key)
+        self._trie = None
+
+    def _keys_cleared(self):
+        super(PrefixTrieIndex, self)._keys_cleared()
+        self._trie = None
+
+    def _walk(self, node):
+        if None in node:
+            yield node[None]
+        for segment in sorted(s for s in node if s is not None):
+            for key in self._walk(node[segment]):
+                yield key
+
+    def prefixed_keys(self, prefix):
+        """
+        Returns an iterator of the keys having the given prefix.
+        """
+        segments = prefix.split(self.separator)
+        node = self.trie
+        for segment in segments[:-1]:
+            node = node.get(segment)
+            if node is None:
+                return iter(())
+        partial = segments[-1]
+        return (
+            key
+            for segment in sorted(s for s in node if s is not None and s.startswith(partial))
+            for key in self._walk(node[segment])
+        )
+
+    def range(self, lo_prefix, hi_prefix=None, new_prefix=None):
+        if hi_prefix is None:
+            keys = self.prefixed_keys(lo_prefix)
+        else:
+            keys = self.range_keys(lo_prefix, hi_prefix)
+        return self._items(keys, lo_prefix, new_prefix)
@@ -12,7 +12,27 @@ from django.utils import six
 from django.forms.forms import BaseForm
 from django.forms.formsets import BaseFormSet
 
-from dfw.utils.datastructures import SortedDictIndex
+from dfw.utils.datastructures import PrefixTrieIndex
+
+
+def get_data_index(data):
+    """
+    Returns a prefix index of the keys of the form data. It's built once per
+    ``QueryDict`` and shared by all the prefixed forms bound to it (e.g. all
+    the forms of a formset), even if it's a mutable copy (as nestedforms'
+    formsets and forms use): it's built again only if keys were added or
+    removed since (i.e. if the number of keys changed).
+
+    """
+    cached = getattr(data, '_prefix_index', None)
+    if cached is not None and cached[0] == len(data):
+        return cached[1]
+    index = PrefixTrieIndex.fromkeys(data)
+    try:
+        data._prefix_index = (len(data), index)
+    except AttributeError:
+        pass  # e.g. a dict
+    return index
 
 
 class Unretrieved(six.text_type):
@@ -32,8 +52,8 @@ class FormFieldDict(dict):
         prefix = self.form.prefix or ''
         if prefix:
             prefix += '-'
-            conceptos_data = SortedDictIndex(data)
-            data = dict(conceptos_data.range(prefix, new_prefix=''))
+            data = get_data_index(data).prefixed_keys(prefix)
+            data = (field_name[len(prefix):] for field_name in data)
         for field_name in data:
             field_name, _, is_branch = field_name.partition('-')
             if not is_branch:
@@ -10,10 +10,12 @@ Dubalu Framework
 """
 from __future__ import absolute_import, unicode_literals
 
+import re
 import datetime
 import decimal
 import codecs
 import uuid
+import collections
 
 try:
     from uuidfield import UUID
@@ -69,7 +71,29 @@ def time_repr(o):
     return r
 
 
-def to_datetime(r):
+_DATETIME_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?(Z|[-+]\d\d:\d\d)?$')
+_DATE_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)$')
+_TIME_RE = re.compile(r'(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?$')
+# Whatever uuid.UUID() accepts: optional 'urn:' and 'uuid:' prefixes and
+# braces, and 32 hex digits with any hyphens.
+_UUID_RE = re.compile(r'(?:urn:)?(?:uuid:)?\{?-*(?:[0-9a-fA-F]-*){32}\}?$')
+
+_tzinfos = {}
+
+
+def _get_tzinfo(minutes):
+    try:
+        return _tzinfos[minutes]
+    except KeyError:
+        tzinfo = _tzinfos[minutes] = FixedOffset(minutes)
+        return tzinfo
+
+
+def _microseconds(fraction):
+    return int(fraction.ljust(6, '0')) if fraction else 0
+
+
+def _strptime_datetime(r):
     if len(r) >= 19:
         if r.endswith("Z"):
             minutes = 0
@@ -83,7 +107,7 @@ def to_datetime(r):
             minutes = None
             value = r
         if minutes is not None:
-            tzinfo = FixedOffset(minutes)
+            tzinfo = _get_tzinfo(minutes)
         else:
             tzinfo = None
         try:
@@ -99,24 +123,51 @@ def to_datetime(r):
     raise ValueError
 
 
-def to_date(r):
-    value = r
-    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
-
-
-def to_time(r):
-    value = r
+def _strptime_time(r):
     try:
-        return datetime.datetime.strptime(value, '%H:%M:%S.%f').time()
+        return datetime.datetime.strptime(r, '%H:%M:%S.%f').time()
     except ValueError:
         pass
     try:
-        return datetime.datetime.strptime(value, '%H:%M:%S').time()
+        return datetime.datetime.strptime(r, '%H:%M:%S').time()
     except ValueError:
         pass
     raise ValueError
 
 
+def to_datetime(r):
+    m = _DATETIME_RE.match(r)
+    if m is None:
+        # Not zero padded or otherwise unusual, let strptime have a go.
+        return _strptime_datetime(r)
+    year, month, day, hour, minute, second, fraction, tz = m.groups()
+    if tz is None:
+        tzinfo = None
+    elif tz == 'Z':
+        tzinfo = _get_tzinfo(0)
+    else:
+        minutes = int(tz[1:3]) * 60 + int(tz[4:6])
+        tzinfo = _get_tzinfo(-minutes if tz[0] == '-' else minutes)
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                             _microseconds(fraction), tzinfo)
+
+
+def to_date(r):
+    m = _DATE_RE.match(r)
+    if m is None:
+        return datetime.datetime.strptime(r, '%Y-%m-%d').date()
+    year, month, day = m.groups()
+    return datetime.date(int(year), int(month), int(day))
+
+
+def to_time(r):
+    m = _TIME_RE.match(r)
+    if m is None:
+        return _strptime_time(r)
+    hour, minute, second, fraction = m.groups()
+    return datetime.time(int(hour), int(minute), int(second), _microseconds(fraction))
+
+
 class BetterJSONEncoder(json.JSONEncoder):
     """
     JSONEncoder subclass that knows how to encode date/time and decimal types.
@@ -142,7 +193,49 @@ class BetterJSONEncoder(json.JSONEncoder):
         return encoder(obj)
 
 
+def guess_string(value):
+    """
+    Returns the value converted to the type it looks like (UUID, datetime,
+    date or time) or None if it doesn't look like any of them.
+
+    A cheap length and character test picks the single candidate type, so
+    plain text values are rejected without raising any exceptions.
+
+    """
+    length = len(value)
+    if length < 5 or length > 47:
+        return None
+    try:
+        if value[0].isdigit():
+            if value[4] == '-':
+                if 'T' in value:
+                    return to_datetime(value)
+                return to_date(value)
+            if ':' in value[1:3]:
+                return to_time(value)
+        if _UUID_RE.match(value) is not None:
+            return UUID(value)
+    except ValueError:
+        pass
+    return None
+
+
 def better_decoder(json_data):
+    for key in json_data:
+        value = json_data[key]
+        if isinstance(value, basestring):
+            value = guess_string(value)
+            if value is not None:
+                json_data[key] = value
+    return json_data
+
+
+def legacy_decoder(json_data):
+    """
+    The former ``better_decoder``, which tries every type in turn (kept for
+    benchmarking).
+
+    """
     for key in json_data:
         value = json_data[key]
         if isinstance(value, basestring):
@@ -152,23 +245,56 @@ def better_decoder(json_data):
             except ValueError:
                 pass
             try:
-                json_data[key] = to_datetime(value)
+                json_data[key] = _strptime_datetime(value)
                 continue
             except ValueError:
                 pass
             try:
-                json_data[key] = to_date(value)
+                json_data[key] = datetime.datetime.strptime(value, '%Y-%m-%d').date()
                 continue
             except ValueError:
                 pass
             try:
-                json_data[key] = to_time(value)
+                json_data[key] = _strptime_time(value)
                 continue
             except ValueError:
                 pass
     return json_data
 
 
+SCHEMA_PARSERS = {
+    uuid.UUID: UUID,
+    UUID: UUID,
+    datetime.datetime: to_datetime,
+    datetime.date: to_date,
+    datetime.time: to_time,
+}
+
+
+def schema_decoder(schema):
+    """
+    Returns an ``object_hook`` which converts the string values of the keys
+    in ``schema`` (a mapping of keys to types, or to callables taking the
+    string) and leaves everything else alone, skipping any guessing::
+
+        loads(data, schema={'id': UUID, 'created': datetime.datetime})
+
+    Values which cannot be converted raise ``ValueError``.
+
+    """
+    parsers = dict((key, SCHEMA_PARSERS.get(type_, type_)) for key, type_ in schema.items())
+
+    def decoder(json_data):
+        for key in json_data:
+            parser = parsers.get(key)
+            if parser is not None:
+                value = json_data[key]
+                if isinstance(value, basestring):
+                    json_data[key] = parser(value)
+        return json_data
+    return decoder
+
+
 def dumps(value, **kwargs):
     if 'ensure_ascii' not in kwargs:
         kwargs['ensure_ascii'] = False
@@ -179,11 +305,77 @@ def dumps(value, **kwargs):
     return json.dumps(value, **kwargs)
 
 
-def loads(value, **kwargs):
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+
+def _iterencode(encoder, value):
+    if isinstance(value, collections.Iterator):
+        yield '['
+        first = True
+        for item in value:
+            if first:
+                first = False
+            else:
+                yield encoder.item_separator
+            yield encoder.encode(item)
+        yield ']'
+    elif isinstance(value, dict) and any(isinstance(v, collections.Iterator) for v in value.values()):
+        yield '{'
+        first = True
+        for key, item in value.items():
+            if first:
+                first = False
+            else:
+                yield encoder.item_separator
+            yield encoder.encode(force_text(key))
+            yield encoder.key_separator
+            for chunk in _iterencode(encoder, item):
+                yield chunk
+        yield '}'
+    else:
+        yield encoder.encode(value)
+
+
+def iterdumps(value, chunk_size=STREAMING_CHUNK_SIZE, **kwargs):
+    """
+    Like ``dumps()``, but returns a generator of encoded chunks (of about
+    ``chunk_size`` characters) which can be used as the content of a
+    ``StreamingHttpResponse``.
+
+    Iterators (e.g. ``queryset.iterator()``, generators), either as the value
+    or as the values of a dictionary, are encoded as JSON arrays one item at
+    a time, so they are never held in memory::
+
+        iterdumps({'status': 'OK', 'data': queryset.values_list('pk', 'name').iterator()})
+
+    """
+    if 'ensure_ascii' not in kwargs:
+        kwargs['ensure_ascii'] = False
+    if 'encoding' not in kwargs:
+        kwargs['encoding'] = 'safe-utf-8'
+    cls = kwargs.pop('cls', BetterJSONEncoder)
+    encoder = cls(**kwargs)
+    buf = []
+    size = 0
+    for chunk in _iterencode(encoder, value):
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def loads(value, schema=None, **kwargs):
     if 'encoding' not in kwargs:
         kwargs['encoding'] = 'safe-utf-8'
     if 'object_hook' not in kwargs:
-        kwargs['object_hook'] = better_decoder
+        if schema is not None:
+            kwargs['object_hook'] = schema_decoder(schema)
+        else:
+            kwargs['object_hook'] = better_decoder
     return json.loads(value, **kwargs)
 
 
@@ -10,11 +10,16 @@ Dubalu Framework
 """
 from __future__ import unicode_literals, print_function
 
+import os
 import re
 import sys
 import time
+import errno
+import random
 import StringIO
+import tempfile
 import warnings
+import threading
 from functools import wraps
 
 try:
@@ -124,6 +129,149 @@ class Profiler(object):
         return wrapped
 
 
+class SamplingProfiler(object):
+    """
+    A statistical profiler for (some of the) requests of a process.
+
+    A single background thread wakes up every ``interval`` seconds while
+    there are requests being profiled and records the stack of their threads
+    (from ``sys._current_frames()``; no signals are used, so it works with
+    threaded servers). When a request ends its stacks are aggregated by name
+    (e.g. URL name) if it was slow enough, and every ``flush_interval``
+    seconds the aggregated stacks are written to ``directory`` as collapsed
+    stacks (``frame;frame;frame count`` lines), the input of flamegraph
+    tools. ``manage.py dump_profiles`` merges those of all the processes.
+
+    Only one in ``rate`` requests is profiled and, of those, only the ones
+    taking at least ``threshold`` seconds are kept.
+
+    """
+    def __init__(self, rate=1, threshold=None, interval=0.005, directory=None, flush_interval=60):
+        self.rate = rate
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._active = {}  # thread ident -> {stack: count}
+        self._stacks = {}  # name -> {stack: count}
+        self._labels = {}  # code -> frame label
+        self._thread = None
+        self._flushed = time.time()
+
+    def sample(self):
+        """
+        Returns if a new request should be profiled.
+        """
+        return self.rate <= 1 or random.random() * self.rate < 1
+
+    def begin(self):
+        """
+        Starts profiling the current thread.
+        """
+        with self._lock:
+            self._active[threading.current_thread().ident] = {}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='SamplingProfiler')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+
+    def end(self, name, elapsed=None):
+        """
+        Stops profiling the current thread, aggregating its stacks under
+        ``name`` if it took at least ``threshold`` seconds.
+        """
+        with self._lock:
+            samples = self._active.pop(threading.current_thread().ident, None)
+            if samples and (self.threshold is None or elapsed is None or elapsed >= self.threshold):
+                stacks = self._stacks.setdefault(name, {})
+                for stack, count in samples.items():
+                    stacks[stack] = stacks.get(stack, 0) + count
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = '%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno)
+        return label
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+            else:
+                time.sleep(self.interval)
+                frames = sys._current_frames()
+                with self._lock:
+                    for ident, samples in self._active.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            stack = self._collapse(frame)
+                            samples[stack] = samples.get(stack, 0) + 1
+                del frames
+            if self.directory and time.time() - self._flushed >= self.flush_interval:
+                self.flush()
+
+    def stacks(self):
+        """
+        Returns a copy of the aggregated stacks by name.
+        """
+        with self._lock:
+            return dict((name, dict(stacks)) for name, stacks in self._stacks.items())
+
+    def reset(self):
+        with self._lock:
+            self._stacks = {}
+
+    def flush(self):
+        """
+        Writes the aggregated stacks of this process to ``directory/<pid>/<name>.folded``.
+        """
+        self._flushed = time.time()
+        if not self.directory:
+            return
+        directory = os.path.join(self.directory, '%d' % os.getpid())
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        for name, stacks in self.stacks().items():
+            fd, path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                write_collapsed(f, stacks)
+            os.rename(path, os.path.join(directory, collapsed_filename(name)))
+
+
+def collapsed_filename(name):
+    return '%s.folded' % re.sub(r'[^\w.-]+', '_', name or 'unknown')
+
+
+def write_collapsed(file, stacks):
+    for stack, count in sorted(stacks.items()):
+        file.write(('%s %d\n' % (stack, count)).encode('utf-8'))
+
+
+def read_collapsed(file, stacks=None):
+    if stacks is None:
+        stacks = {}
+    for line in file:
+        stack, _, count = line.decode('utf-8').rstrip('\n').rpartition(' ')
+        if stack:
+            stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+
 class Timer(object):
     def __init__(self, fmt=None, file=sys.stdout, end='\n', color=True, **context):
         context['name'] = context.get('name', "Timer")
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+Development and CI instrumentation of the queries run by a block of code
+(e.g. a request): counting, duplicate SQL fingerprinting, N+1 detection
+(naming the relation to ``select_related``/``prefetch_related``) and query
+budgets. See ``dfw.middleware.QueryCountMiddleware``.
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import re
+import threading
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections, reset_queries, DEFAULT_DB_ALIAS
+from django.db.models import get_models
+from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor, SingleRelatedObjectDescriptor
+
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'N_PLUS_ONE_THRESHOLD', 3)
+
+_local = threading.local()
+
+_PARAMS_RE = re.compile(r"^QUERY = u?'(.*)' - PARAMS = .*$", re.DOTALL)  # Backends without last_executed_query (sqlite)
+_FINGERPRINT_RES = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+_LOOKUP_RE = re.compile(r'FROM [`"]?(\w+)[`"]? .*WHERE [`"]?\1[`"]?\.[`"]?(\w+)[`"]? (?:= \?|IN \(\.\.\.\))')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """
+    Returns the SQL with its literals replaced by placeholders, so the same
+    query with different parameters gets the same fingerprint.
+    """
+    sql = _PARAMS_RE.sub(r'\1', sql)
+    for regex, replacement in _FINGERPRINT_RES:
+        sql = regex.sub(replacement, sql)
+    return sql.strip()
+
+
+def _track_descriptor(descriptor_class, get_relation):
+    """
+    Wraps the ``__get__`` of a related object descriptor to attribute the
+    queries it runs (lazy loads) to its ``(model, field name)`` relation.
+    """
+    original = descriptor_class.__get__
+
+    def __get__(self, instance, instance_type=None):
+        trackers = getattr(_local, 'trackers', None)
+        if instance is None or not trackers or hasattr(instance, self.cache_name):
+            return original(self, instance, instance_type)
+        before = [len(tracker.connection.queries) for tracker in trackers]
+        try:
+            return original(self, instance, instance_type)
+        finally:
+            for tracker, count in zip(trackers, before):
+                if len(tracker.connection.queries) > count:
+                    tracker.relation_loaded(get_relation(self))
+    __get__._query_tracking = True
+
+    if not getattr(original, '_query_tracking', False):
+        descriptor_class.__get__ = __get__
+
+
+_install_lock = threading.Lock()
+_installed = []
+
+
+def _install():
+    with _install_lock:
+        if not _installed:
+            _track_descriptor(ReverseSingleRelatedObjectDescriptor, lambda d: (d.field.model, d.field.name))
+            _track_descriptor(SingleRelatedObjectDescriptor, lambda d: (d.related.parent_model, d.related.get_accessor_name()))
+            _installed.append(True)
+
+
+_reset_queries_lock = threading.Lock()
+_reset_queries_holds = []
+
+
+def _hold_queries():
+    """
+    Keeps ``request_started`` from resetting the connections' queries (e.g.
+    with the test client) until ``_release_queries()``, the same as
+    ``CaptureQueriesContext`` does but allowing nested trackers.
+    """
+    with _reset_queries_lock:
+        if not _reset_queries_holds:
+            request_started.disconnect(reset_queries)
+        _reset_queries_holds.append(True)
+
+
+def _release_queries():
+    with _reset_queries_lock:
+        _reset_queries_holds.pop()
+        if not _reset_queries_holds:
+            request_started.connect(reset_queries)
+
+
+def _reverse_relation(table, column):
+    """
+    Returns the ``(model, accessor)`` of the reverse relation whose lazy
+    loads query ``table`` by ``column`` (None if there's no such relation).
+    """
+    for model in get_models():
+        if model._meta.db_table == table:
+            for field in model._meta.fields:
+                if field.column == column and field.rel is not None:
+                    return field.rel.to, field.related.get_accessor_name()
+    return None
+
+
+class QueryReport(object):
+    """
+    What a QueryTracker saw: the queries, the repeated ones (by
+    fingerprint) and the relations lazily loaded ``threshold`` or more
+    times, with the fix for each.
+
+    """
+    def __init__(self, queries, relations, threshold=N_PLUS_ONE_THRESHOLD):
+        self.queries = queries
+        self.count = len(queries)
+        self.time = sum(float(query.get('time') or 0) for query in queries)
+
+        fingerprints = {}
+        for query in queries:
+            sql = fingerprint(query['sql'])
+            fingerprints.setdefault(sql, []).append(query['sql'])
+        self.duplicates = sorted(
+            ((len(samples), sql, samples[0]) for sql, samples in fingerprints.items() if len(samples) > 1),
+            reverse=True,
+        )
+
+        suggestions = {}
+        for (model, name), count in relations.items():
+            if count >= threshold:
+                suggestions[(model, name)] = (count, "select_related('%s')" % name)
+        for count, sql, sample in self.duplicates:
+            if count >= threshold:
+                match = _LOOKUP_RE.search(sql)
+                relation = match and _reverse_relation(*match.groups())
+                if relation and relation not in suggestions:
+                    suggestions[relation] = (count, "prefetch_related('%s')" % relation[1])
+        self.n_plus_one = sorted(
+            ((count, model, name, fix) for (model, name), (count, fix) in suggestions.items()),
+            key=lambda suggestion: suggestion[0],
+            reverse=True,
+        )
+
+    def __unicode__(self):
+        lines = ["%d queries (%.3fs)" % (self.count, self.time)]
+        for count, model, name, fix in self.n_plus_one:
+            lines.append("  N+1: %s.%s loaded %d times, use %s" % (model._meta.object_name, name, count, fix))
+        for count, sql, sample in self.duplicates:
+            lines.append("  %dx %s" % (count, sql[:200]))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.__unicode__().encode('utf-8')
+
+
+class QueryTracker(object):
+    """
+    Context manager recording the queries run (in the thread) through a
+    database connection, and which relations were lazily loaded.
+
+        with QueryTracker() as tracker:
+            render(...)
+        print(tracker.report())
+
+    Requests started within the block (e.g. by the test client) don't reset
+    the recorded queries, unless ``hold_queries`` is False (as when the
+    tracker is already within a request).
+
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS, threshold=N_PLUS_ONE_THRESHOLD, hold_queries=True):
+        self.connection = connections[using]
+        self.threshold = threshold
+        self.hold_queries = hold_queries
+        self.relations = {}
+        self.queries = None
+
+    def __enter__(self):
+        _install()
+        self._use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        if self.hold_queries:
+            _hold_queries()
+        self._start = len(self.connection.queries)
+        trackers = getattr(_local, 'trackers', None)
+        if trackers is None:
+            trackers = _local.trackers = []
+        trackers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.queries is not None:
+            return  # Already exited
+        _local.trackers.remove(self)
+        if self.hold_queries:
+            _release_queries()
+        self.connection.use_debug_cursor = self._use_debug_cursor
+        self.queries = self.connection.queries[self._start:]
+
+    def relation_loaded(self, relation):
+        self.relations[relation] = self.relations.get(relation, 0) + 1
+
+    @property
+    def count(self):
+        if self.queries is None:
+            return len(self.connection.queries) - self._start
+        return len(self.queries)
+
+    def report(self):
+        queries = self.queries
+        if queries is None:
+            queries = self.connection.queries[self._start:]
+        return QueryReport(queries, self.relations, self.threshold)
+
+
+def query_budget(max_queries):
+    """
+    Declares the maximum number of queries a view may run;
+    ``QueryCountMiddleware`` raises ``QueryBudgetExceeded`` (when
+    QUERY_BUDGET_STRICT, e.g. in tests) or logs a warning if it's exceeded.
+    """
+    def decorator(view_func):
+        view_func._query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class QueryBudgetTestMixin(object):
+    """
+    TestCase mixin with query budget and N+1 assertions, which fail with
+    the query report.
+
+        with self.assertMaxQueries(5):
+            self.client.get('/entities/')
+
+    """
+    def assertMaxQueries(self, max_queries, func=None, *args, **kwargs):
+        context = _QueryBudgetContext(self, max_queries, False)
+        if func is None:
+            return context
+        with context:
+            func(*args, **kwargs)
+
+    def assertNoNPlusOne(self, func=None, *args, **kwargs):
+        context = _QueryBudgetContext(self, None, True)
+        if func is None:
+            return context
+        with context:
+            func(*args, **kwargs)
+
+
+class _QueryBudgetContext(QueryTracker):
+    def __init__(self, test_case, max_queries, n_plus_one):
+        super(_QueryBudgetContext, self).__init__()
+        self.test_case = test_case
+        self.max_queries = max_queries
+        self.n_plus_one = n_plus_one
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_QueryBudgetContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        report = self.report()
+        if self.max_queries is not None and report.count > self.max_queries:
+            self.test_case.fail("%d queries exceed the budget of %d: %s" % (report.count, self.max_queries, report))
+        if self.n_plus_one and report.n_plus_one:
+            self.test_case.fail("N+1 queries: %s" % report)
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Dubalu Framework
+~~~~~~~~~~~~~~~~
+
+:author: Dubalu Framework Team. See AUTHORS.
+:copyright: Copyright (c) 2013-2014, deipi.com LLC. All Rights Reserved.
+:license: See LICENSE for license details.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import itertools
+import threading
+
+from django.conf.urls import patterns, url
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core import management
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db import connection, reset_queries
+from django.http import HttpResponse, QueryDict
+from django.test import TestCase, RequestFactory
+from django.utils.six import StringIO
+
+from . import cache as cache_module
+from . import queries as queries_module
+from .queries import QueryTracker, QueryBudgetTestMixin
+from .datastructures import SortedKeyList, SortedDictIndex, PrefixTrieIndex
+from .forms import get_data_index
+from .profiler import SamplingProfiler, collapsed_filename, read_collapsed, write_collapsed
+from .cache import (get_fragment, make_fragment_key, cache_seq_incr,
+                    fragment_stats, reset_fragment_stats)
+
+
+def count_view(request):
+    ContentType.objects.count()
+    ContentType.objects.count()
+    return HttpResponse()
+
+urlpatterns = patterns('',
+    url(r'^count/$', count_view),
+)
+
+
+class FixedRandom(object):
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class FragmentCacheTests(TestCase):
+    """
+    Test the stampede protection of ``get_fragment``.
+
+    """
+    def setUp(self):
+        cache.clear()
+        reset_fragment_stats()
+        self.counter = itertools.count()
+        self.old_random = cache_module.random
+
+    def tearDown(self):
+        cache_module.random = self.old_random
+
+    def compute(self):
+        return 'value %d' % next(self.counter)
+
+    def get(self, **kwargs):
+        return get_fragment('frag', (1,), self.compute, **kwargs)
+
+    def set_entry(self, **fields):
+        """
+        Changes the (generation, expires, delta, compressed, value) fields
+        of the cached fragment.
+
+        """
+        cache_key = make_fragment_key('frag', (1,))
+        entry = dict(zip(('generation', 'expires', 'delta', 'compressed', 'value'), cache.get(cache_key)))
+        entry.update(fields)
+        cache.set(cache_key, tuple(entry[f] for f in ('generation', 'expires', 'delta', 'compressed', 'value')))
+
+    def lock(self):
+        cache.add(make_fragment_key('frag', (1,)) + ':lock', True)
+
+    def is_locked(self):
+        return cache.get(make_fragment_key('frag', (1,)) + ':lock') is not None
+
+    def stats(self):
+        stats = fragment_stats()['frag']
+        return dict((k, stats[k]) for k in ('hits', 'stale', 'misses', 'recomputes'))
+
+    def test_hit(self):
+        self.assertEqual(self.get(beta=0), 'value 0')
+        self.assertEqual(self.get(beta=0), 'value 0')
+        self.assertEqual(self.stats(), {'hits': 1, 'stale': 0, 'misses': 1, 'recomputes': 0})
+
+    def test_early_recompute(self):
+        """
+        A fresh fragment is recomputed early when the (XFetch) draw falls
+        past its expiration, which is likelier the longer it takes.
+
+        """
+        self.get()
+        self.set_entry(delta=1000.0)
+        cache_module.random = FixedRandom(0.0)
+        self.assertEqual(self.get(), 'value 0')
+        cache_module.random = FixedRandom(0.5)
+        self.assertEqual(self.get(beta=0), 'value 0')
+        self.assertEqual(self.get(), 'value 1')
+        self.assertFalse(self.is_locked())
+        self.assertEqual(self.stats(), {'hits': 2, 'stale': 0, 'misses': 1, 'recomputes': 1})
+
+    def test_expired_recompute(self):
+        self.get(beta=0)
+        self.set_entry(expires=0)
+        self.assertEqual(self.get(beta=0), 'value 1')
+        self.assertFalse(self.is_locked())
+        self.assertEqual(self.stats(), {'hits': 0, 'stale': 0, 'misses': 1, 'recomputes': 1})
+
+    def test_lock_released_on_error(self):
+        self.get(beta=0)
+        self.set_entry(expires=0)
+
+        def compute():
+            raise ValueError
+        self.assertRaises(ValueError, get_fragment, 'frag', (1,), compute, beta=0)
+        self.assertFalse(self.is_locked())
+
+    def test_stale_while_locked(self):
+        """
+        An expired fragment being recomputed elsewhere is served stale.
+
+        """
+        self.get(beta=0)
+        self.set_entry(expires=0)
+        self.lock()
+        self.assertEqual(self.get(beta=0), 'value 0')
+        self.assertEqual(self.stats(), {'hits': 0, 'stale': 1, 'misses': 1, 'recomputes': 0})
+
+    def test_invalidated_never_stale(self):
+        """
+        A fragment of a previous generation is recomputed even if it's
+        being recomputed elsewhere.
+
+        """
+        self.get(beta=0)
+        cache_seq_incr('frag', 1)
+        self.lock()
+        self.assertEqual(self.get(beta=0, lock_wait=0), 'value 1')
+        self.assertEqual(self.get(beta=0), 'value 1')
+        self.assertEqual(self.stats(), {'hits': 1, 'stale': 0, 'misses': 2, 'recomputes': 0})
+
+    def get_concurrently(self, threads=5):
+        """
+        Gets the fragment from many threads at once, with a slow compute().
+
+        """
+        def compute():
+            time.sleep(0.2)
+            return self.compute()
+
+        def get():
+            results.append(get_fragment('frag', (1,), compute, beta=0))
+        results = []
+        threads = [threading.Thread(target=get) for i in range(threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_miss_computed_once(self):
+        self.assertEqual(self.get_concurrently(), ['value 0'] * 5)
+        self.assertEqual(self.stats(), {'hits': 4, 'stale': 0, 'misses': 1, 'recomputes': 0})
+
+    def test_invalidated_computed_once(self):
+        """
+        Right after a fragment is invalidated, a single thread computes it
+        while the rest wait for it.
+
+        """
+        self.get(beta=0)
+        cache_seq_incr('frag', 1)
+        self.assertEqual(self.get_concurrently(), ['value 1'] * 5)
+        self.assertEqual(self.stats(), {'hits': 4, 'stale': 0, 'misses': 2, 'recomputes': 0})
+        self.assertFalse(self.is_locked())
+
+    def test_compressed(self):
+        value = 'x' * 100
+        self.assertEqual(get_fragment('big', (), lambda: value, compress=10), value)
+        self.assertEqual(cache.get(make_fragment_key('big', ()))[3], 'text')
+        self.assertEqual(get_fragment('big', (), lambda: None, compress=10, beta=0), value)
+
+
+class SortedIndexTests(TestCase):
+    """
+    Compare ``SortedKeyList`` and the sorted dictionary indexes against a
+    plain dict and its sorted keys with random operations.
+
+    """
+    ALPHABET = ['a', 'b', '-', '~', '\x01', '\x7f', '\xe9', '\u4e2d']
+
+    def setUp(self):
+        self.random = random.Random(1)
+
+    def random_key(self):
+        return ''.join(self.random.choice(self.ALPHABET) for i in range(self.random.randint(1, 5)))
+
+    def expected_range(self, data, lo_prefix, hi_prefix=None):
+        hi_prefix = hi_prefix or lo_prefix
+        return sorted(item for item in data.items() if item[0] >= lo_prefix and (item[0] <= hi_prefix or item[0].startswith(hi_prefix)))
+
+    def check_index(self, cls):
+        index = cls((self.random_key(), 0) for i in range(50))
+        data = dict(index)
+        for step in range(3000):
+            op = self.random.random()
+            key = self.random_key()
+            if op < 0.3:
+                index[key] = data[key] = step
+            elif op < 0.45:
+                self.assertEqual(index.pop(key, None), data.pop(key, None))
+            elif op < 0.5:
+                items = dict((self.random_key(), step) for i in range(self.random.randint(0, 200)))
+                index.update(items)
+                data.update(items)
+            elif op < 0.52 and data:
+                key, value = index.popitem()
+                self.assertEqual(data.pop(key), value)
+            elif op < 0.55:
+                self.assertEqual(index.setdefault(key, 1), data.setdefault(key, 1))
+            elif op < 0.56:
+                index.clear()
+                data.clear()
+            elif op < 0.78:
+                self.assertEqual(sorted(index.range(key)), self.expected_range(data, key))
+            else:
+                hi_prefix = self.random_key()
+                self.assertEqual(sorted(index.range(key, hi_prefix)), self.expected_range(data, key, hi_prefix))
+            self.assertEqual(dict(index), data)
+        self.assertEqual(list(index.sorted_keys), sorted(data))
+
+    def test_sorted_dict_index(self):
+        self.check_index(SortedDictIndex)
+
+    def test_prefix_trie_index(self):
+        self.check_index(PrefixTrieIndex)
+
+    def test_sorted_key_list(self):
+        # A small load splits and merges the sublists all the time
+        keys = SortedKeyList(load=4)
+        expected = set()
+        for i in range(3000):
+            key = self.random.randint(0, 500)
+            if key in expected:
+                keys.remove(key)
+                expected.discard(key)
+            else:
+                keys.add(key)
+                expected.add(key)
+            self.assertEqual(key in keys, key in expected)
+            self.assertEqual(len(keys), len(expected))
+        self.assertEqual(list(keys), sorted(expected))
+        new_keys = [key for key in range(400, 600) if key not in expected]
+        keys.update(new_keys)
+        expected.update(new_keys)
+        self.assertEqual(list(keys), sorted(expected))
+        keys.update([-1, 700])
+        expected.update([-1, 700])
+        self.assertEqual(list(keys), sorted(expected))
+        self.assertEqual(list(keys.irange(250)), sorted(k for k in expected if k >= 250))
+
+
+class QueryTrackerTests(QueryBudgetTestMixin, TestCase):
+    """
+    Test the query tracking of ``dfw.utils.queries``.
+
+    """
+    urls = 'dfw.utils.tests'
+
+    def reset_queries_connected(self):
+        return any(receiver() is reset_queries for key, receiver in request_started.receivers)
+
+    def test_client_requests(self):
+        """
+        Requests made with the test client within the block don't reset the
+        recorded queries.
+
+        """
+        with QueryTracker() as tracker:
+            ContentType.objects.count()
+            with QueryTracker() as nested:
+                self.client.get('/count/')
+            self.assertFalse(self.reset_queries_connected())
+            ContentType.objects.count()
+        self.assertTrue(self.reset_queries_connected())
+        self.assertEqual(nested.count, 2)
+        self.assertEqual(tracker.count, 4)
+
+    def test_n_plus_one(self):
+        content_type = ContentType.objects.create(name='fragment', app_label='tests', model='fragment')
+        for i in range(3):
+            Permission.objects.create(name='perm %d' % i, content_type=content_type, codename='perm_%d' % i)
+        with QueryTracker() as tracker:
+            for permission in Permission.objects.filter(content_type=content_type):
+                permission.content_type
+        report = tracker.report()
+        self.assertEqual(report.count, 4)
+        self.assertEqual(report.n_plus_one, [(3, Permission, 'content_type', "select_related('content_type')")])
+        self.assertEqual(report.duplicates[0][0], 3)
+
+        with QueryTracker() as tracker:
+            for content_type in ContentType.objects.filter(pk=content_type.pk):
+                for i in range(3):
+                    list(content_type.permission_set.all())
+        self.assertEqual(tracker.report().n_plus_one, [(3, ContentType, 'permission_set', "prefetch_related('permission_set')")])
+
+        with self.assertNoNPlusOne():
+            for permission in Permission.objects.filter(content_type=content_type).select_related('content_type'):
+                permission.content_type
+
+    def test_budget(self):
+        self.assertMaxQueries(2, self.client.get, '/count/')
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(1):
+                self.client.get('/count/')
+
+    def test_middleware(self):
+        with self.settings(MIDDLEWARE_CLASSES=('dfw.middleware.QueryCountMiddleware',)):
+            response = self.client.get('/count/')
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertFalse(queries_module._local.trackers)
+
+    def test_middleware_skipped_response(self):
+        """
+        The middleware tracker is exited when the request finishes, even if
+        its ``process_response`` was skipped.
+
+        """
+        from ..middleware import QueryCountMiddleware
+        use_debug_cursor = connection.use_debug_cursor
+        request = RequestFactory().get('/count/')
+        QueryCountMiddleware().process_request(request)
+        self.assertTrue(connection.use_debug_cursor)
+        request_finished.send(sender=self.__class__)
+        self.assertFalse(queries_module._local.trackers)
+        self.assertEqual(connection.use_debug_cursor, use_debug_cursor)
+
+
+class DataIndexTests(TestCase):
+    def test_shared(self):
+        """
+        The index is shared by the forms bound to the same data, also to a
+        mutable copy of it (as nestedforms' formsets use).
+
+        """
+        data = QueryDict('rows-0-a=1&rows-0-b=2&rows-1-a=3').copy()
+        index = get_data_index(data)
+        self.assertIs(get_data_index(data), index)
+        self.assertEqual(sorted(index.prefixed_keys('rows-0-')), ['rows-0-a', 'rows-0-b'])
+        data['rows-1-b'] = 4
+        self.assertEqual(sorted(get_data_index(data).prefixed_keys('rows-1-')), ['rows-1-a', 'rows-1-b'])
+        self.assertIsNot(get_data_index({'rows-0-a': 1}), get_data_index({'rows-0-a': 1}))
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class SamplingProfilerTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def profile(self, profiler, name, seconds, elapsed=None):
+        profiler.begin()
+        busy(seconds)
+        profiler.end(name, seconds if elapsed is None else elapsed)
+
+    def test_threads(self):
+        """
+        Requests served by other threads are sampled, each one with its own
+        stacks.
+
+        """
+        profiler = SamplingProfiler(interval=0.001)
+        threads = [threading.Thread(target=self.profile, args=(profiler, name, 0.1)) for name in ('a', 'b', 'c')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stacks = profiler.stacks()
+        self.assertEqual(sorted(stacks), ['a', 'b', 'c'])
+        for name_stacks in stacks.values():
+            self.assertTrue(name_stacks)
+            for stack in name_stacks:
+                self.assertIn('profile (', stack)
+                self.assertNotIn('test_threads (', stack)
+        self.assertFalse(profiler._active)
+
+    def test_threshold(self):
+        profiler = SamplingProfiler(threshold=1, interval=0.001)
+        self.profile(profiler, 'fast', 0.05)
+        self.profile(profiler, 'slow', 0.05, elapsed=2)
+        self.assertEqual(list(profiler.stacks()), ['slow'])
+
+    def test_flush(self):
+        profiler = SamplingProfiler(interval=0.001, directory=self.directory)
+        self.profile(profiler, 'invoice/detail', 0.05)
+        profiler.flush()
+        path = os.path.join(self.directory, '%d' % os.getpid(), collapsed_filename('invoice/detail'))
+        with open(path) as f:
+            self.assertEqual(read_collapsed(f), profiler.stacks()['invoice/detail'])
+
+    def test_dump_profiles(self):
+        """
+        ``manage.py dump_profiles`` merges the profiles flushed by every
+        process.
+
+        """
+        for pid, stacks in (('100', {'a;b': 1, 'a;c': 2}), ('200', {'a;b': 3})):
+            os.makedirs(os.path.join(self.directory, pid))
+            with open(os.path.join(self.directory, pid, collapsed_filename('view')), 'w') as f:
+                write_collapsed(f, stacks)
+        output = os.path.join(self.directory, 'output')
+        management.call_command('dump_profiles', directory=self.directory, output=output, stderr=StringIO())
+        with open(os.path.join(output, collapsed_filename('view'))) as f:
+            self.assertEqual(read_collapsed(f), {'a;b': 4, 'a;c': 2})
+
+        stdout = StringIO()
+        management.call_command('dump_profiles', directory=self.directory, url_name='view', clear=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'a;b 4\na;c 2\n')
+        self.assertEqual(os.listdir(self.directory), ['output'])
+
+    def test_middleware(self):
+        from ..middleware import SamplingProfilerMiddleware
+        middleware = SamplingProfilerMiddleware()
+        profiler = middleware.profiler = SamplingProfiler(interval=0.001)
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        busy(0.05)
+        request.resolver_match = type(str('ResolverMatch'), (object,), {'url_name': 'home'})()
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(list(profiler.stacks()), ['home'])
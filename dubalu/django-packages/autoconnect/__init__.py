@@ -0,0 +1,3 @@
+from __future__ import absolute_import
+
+from .decorators import autoconnect, batched, bulk_update
@@ -1,31 +1,50 @@
 ################################################################################
 # Snippet 2124 - "Autoconnect" model decorator, easy pre_save and post_save signal connection
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
 
+from django.db import connections, router, transaction
 from django.db.models import signals
 from django.core.exceptions import ImproperlyConfigured
 
+BULK_UPDATE_BATCH_SIZE = 100
+
+_batch = threading.local()
+
 
 def autoconnect(model):
     """
     Class decorator that automatically connects pre_save / post_save signals on
     a model class to its pre_save() / post_save() methods.
 
+    Inside a ``batched()`` block, post_save() methods are deferred to the end
+    of the block (see ``batched()``).
+
     """
     if model._meta.abstract:
         raise ImproperlyConfigured('The model %s is abstract, so it '
               'cannot be autoconnected.' % model.__name__)
 
     def connect(attr):
+        # The hooks are resolved once, as plain functions, in MRO order
         funcs = []
         for base in reversed(model.__mro__):
-            func = getattr(base, attr, None)
+            func = base.__dict__.get(attr)
             if func and func not in funcs:
                 funcs.append(func)
 
         if funcs:
             def save_signal(sender, **kwargs):
                 self = kwargs['instance']
+                state = getattr(_batch, 'state', None)
+                if state is not None:
+                    key = (model, self.pk)
+                    entry = state.get(key)
+                    created = kwargs['created'] or entry is not None and entry[2]
+                    state[key] = (funcs, self, created)
+                    return
                 save = False
                 for func in funcs:
                     if func(self, created=kwargs['created'], save=save):
@@ -50,3 +69,89 @@ def autoconnect(model):
         connect(attr)
 
     return model
+
+
+@contextmanager
+def batched():
+    """
+    Context manager deferring the post_save() methods of the autoconnected
+    objects saved inside it: they run once per object (however many times it
+    was saved) when the block exits, and the objects they ask to save again
+    are written with a single UPDATE statement per model (and batch), with
+    only the changed fields, instead of a ``save()`` each (which would send
+    all the signals again). If the block raises, the deferred methods are
+    dropped. Nested blocks join the outermost one.
+
+        with autoconnect.batched():
+            for row in rows:
+                Entity.objects.create(**row)
+
+    """
+    if getattr(_batch, 'state', None) is not None:
+        yield
+        return
+    _batch.state = state = OrderedDict()
+    try:
+        yield
+    finally:
+        del _batch.state
+    _run_batch(state)
+
+
+def _run_batch(state):
+    resaves = OrderedDict()
+    for (model, pk), (funcs, self, created) in state.items():
+        fields = model._meta.fields
+        snapshot = [getattr(self, field.attname) for field in fields]
+        save = False
+        for func in funcs:
+            if func(self, created=created, save=save):
+                save = True
+        if save:
+            # As save() would: pre_save() methods and the fields' own
+            # pre_save() (e.g. auto_now dates) are part of the update
+            signals.pre_save.send(sender=model, instance=self, raw=False, using=router.db_for_write(model, instance=self), update_fields=None)
+            for field in fields:
+                setattr(self, field.attname, field.pre_save(self, False))
+            changed = [field for field, value in zip(fields, snapshot) if getattr(self, field.attname) != value]
+            if changed:
+                resaves.setdefault(model, []).append((self, changed))
+    for model, items in resaves.items():
+        changed = []
+        for self, fields in items:
+            changed.extend(field for field in fields if field not in changed)
+        objs = [self for self, fields in items]
+        for i in range(0, len(objs), BULK_UPDATE_BATCH_SIZE):
+            bulk_update(model, objs[i:i + BULK_UPDATE_BATCH_SIZE], changed)
+
+
+def bulk_update(model, objs, fields):
+    """
+    Writes the given fields of many objects with one UPDATE statement per
+    table (``UPDATE ... SET field = CASE pk WHEN ... END WHERE pk IN (...)``).
+
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    tables = OrderedDict()
+    for field in fields:
+        tables.setdefault(field.model, []).append(field)
+    with transaction.atomic(using=using):
+        cursor = connection.cursor()
+        for table_model, table_fields in tables.items():
+            pk = table_model._meta.pk
+            pks = [pk.get_db_prep_value(getattr(obj, pk.attname), connection) for obj in objs]
+            assignments, params = [], []
+            for field in table_fields:
+                cases = []
+                for obj, pk_value in zip(objs, pks):
+                    cases.append('WHEN %s THEN %s')
+                    params.extend([pk_value, field.get_db_prep_save(getattr(obj, field.attname), connection)])
+                assignments.append('%s = CASE %s %s ELSE %s END' % (qn(field.column), qn(pk.column), ' '.join(cases), qn(field.column)))
+            cursor.execute('UPDATE %s SET %s WHERE %s IN (%s)' % (
+                qn(table_model._meta.db_table),
+                ', '.join(assignments),
+                qn(pk.column),
+                ', '.join(['%s'] * len(pks)),
+            ), params + pks)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import models
+from django.template.defaultfilters import slugify
+
+from django_extensions.db.fields import ModificationDateTimeField
+
+from autoconnect.decorators import autoconnect
+
+
+@autoconnect
+class Article(models.Model):
+    title = models.CharField(max_length=100)
+    slug = models.SlugField(blank=True)
+    saves = models.IntegerField(default=0)
+    post_saves = models.IntegerField(default=0)
+    updated_at = ModificationDateTimeField()
+
+    def pre_save(self):
+        self.saves += 1
+
+    def post_save(self, created, save):
+        self.post_saves += 1
+        if not self.slug:
+            self.slug = slugify(self.title)
+            return True
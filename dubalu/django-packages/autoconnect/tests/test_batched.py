@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from autoconnect.decorators import batched
+
+from .models import Article
+
+
+class BatchedTestCase(TestCase):
+    def test_post_save_deferred(self):
+        with batched():
+            article = Article.objects.create(title='Hello World')
+            article.title = 'Hello Again'
+            article.save()
+            self.assertEqual(article.post_saves, 0)
+        self.assertEqual(article.post_saves, 1)
+        self.assertEqual(article.slug, 'hello-again')
+
+    def test_resave(self):
+        """
+        Objects saved again by their post_save() are updated running their
+        pre_save() and their fields' pre_save(), as save() would.
+
+        """
+        updated_at = datetime.datetime(2000, 1, 1)
+        with batched():
+            articles = [Article.objects.create(title='Article %d' % i) for i in range(3)]
+            Article.objects.update(updated_at=updated_at)
+            for article in articles:
+                article.updated_at = updated_at
+        for article in Article.objects.all():
+            self.assertEqual(article.slug, 'article-%d' % (article.pk - articles[0].pk))
+            self.assertEqual(article.saves, 2)
+            self.assertGreater(article.updated_at, updated_at)
+
+    def test_resave_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            with batched():
+                for i in range(3):
+                    Article.objects.create(title='Article %d' % i)
+        self.assertEqual(len([query for query in queries if 'UPDATE' in query['sql']]), 1)
+
+    def test_dropped_on_error(self):
+        try:
+            with batched():
+                Article.objects.create(title='Hello World')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Article.objects.get().slug, '')
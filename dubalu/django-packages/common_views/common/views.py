@@ -2,7 +2,7 @@
 from __future__ import absolute_import, unicode_literals
 
 from dfw.utils import json
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.translation import ugettext
 from django.contrib import messages
 
@@ -19,6 +19,16 @@ class AjaxableResponseMixin(object):
         response_kwargs['content_type'] = 'application/json'
         return HttpResponse(data, **response_kwargs)
 
+    def render_to_streaming_json_response(self, context, **response_kwargs):
+        """
+        Like render_to_json_response, but the JSON is encoded as the response
+        is sent, so iterators in the context (e.g. ``queryset.iterator()``)
+        are never held in memory.
+        """
+        data = json.iterdumps(context)
+        response_kwargs['content_type'] = 'application/json'
+        return StreamingHttpResponse(data, **response_kwargs)
+
     def get_form_valid_ajax_dictionary(self, form):
         return {
             'pk': self.object.pk,
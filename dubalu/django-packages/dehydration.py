@@ -47,10 +47,24 @@ Example::
     1471
 """
 import types
+import threading
 
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.signals import request_started, request_finished
 from django.db import models
+from django.db.models.base import ModelState
 from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, post_delete
 from django.utils.functional import LazyObject
+from django.utils.module_loading import import_by_path
+
+# Dotted path to the IdentityMap class used to share the objects hydrated
+# during a request (None to disable).
+DEHYDRATION_IDENTITY_MAP = getattr(settings, 'DEHYDRATION_IDENTITY_MAP', 'dehydration.RequestIdentityMap')
+# Second-level cache for hydrated rows, disabled unless a timeout is given.
+DEHYDRATION_CACHE = getattr(settings, 'DEHYDRATION_CACHE', 'default')
+DEHYDRATION_CACHE_TIMEOUT = getattr(settings, 'DEHYDRATION_CACHE_TIMEOUT', 0)
 
 ########################################
 
@@ -62,10 +76,9 @@ def transmogrify(cls, obj):
     """
     Upcast a class to a different type without asking questions.
     """
-    # Run constructor, reassign values
-    new = cls()
-    for k, v in obj.__dict__.items():
-        new.__dict__[k] = v
+    # Skip the constructor, all the values (including _state) are copied
+    new = cls.__new__(cls)
+    new.__dict__.update(obj.__dict__)
     new.pk = obj.pk
     return new
 
@@ -99,12 +112,24 @@ class HydratedAttribute(DeferredAttribute):
         return setattr(instance, self.field_name, value)
 
 
+_hydrated_classes = {}
+
+
 def hydrated_class_factory(model, attrs):
     """
     Returns a class object that is a copy of "model" with the specified "attrs"
     being replaced with BulkDeferredAttribute objects. The "pk_value" ties the
     deferred attributes to a particular instance of the model.
     """
+    key = (model, frozenset(attrs))
+    try:
+        return _hydrated_classes[key]
+    except KeyError:
+        cls = _hydrated_classes[key] = _hydrated_class_factory(model, attrs)
+        return cls
+
+
+def _hydrated_class_factory(model, attrs):
     class Meta:
         proxy = True
         app_label = model._meta.app_label
@@ -127,6 +152,154 @@ def hydrated_class_factory(model, attrs):
 hydrated_class_factory.__safe_for_unpickling__ = True
 
 
+########################################
+
+class IdentityMap(object):
+    """
+    Maps (model class, pk) to the model instances hydrated while the map is
+    started (per thread), so the same object is shared instead of being
+    fetched again.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self, **kwargs):
+        self._local.objects = {}
+
+    def stop(self, **kwargs):
+        self._local.__dict__.pop('objects', None)
+
+    def get_many(self, modelclass, pks):
+        objects = getattr(self._local, 'objects', None)
+        if not objects:
+            return {}
+        return dict((pk, objects[(modelclass, pk)]) for pk in pks if (modelclass, pk) in objects)
+
+    def add_many(self, modelclass, objs):
+        objects = getattr(self._local, 'objects', None)
+        if objects is not None:
+            for obj in objs:
+                objects[(modelclass, obj.pk)] = obj
+
+    def discard(self, modelclass, pk):
+        objects = getattr(self._local, 'objects', None)
+        if objects is not None:
+            objects.pop((modelclass, pk), None)
+
+
+class RequestIdentityMap(IdentityMap):
+    """
+    An IdentityMap started and stopped with every request.
+    """
+    def __init__(self):
+        super(RequestIdentityMap, self).__init__()
+        request_started.connect(self.start, weak=False)
+        request_finished.connect(self.stop, weak=False)
+
+
+_identity_map = []
+
+
+def get_identity_map():
+    if not _identity_map:
+        _identity_map.append(import_by_path(DEHYDRATION_IDENTITY_MAP)() if DEHYDRATION_IDENTITY_MAP else None)
+    return _identity_map[0]
+
+
+def set_identity_map(identity_map):
+    _identity_map[:] = [identity_map]
+
+
+def _cache_key(modelclass, pk):
+    return 'dehydration:%s.%s:%s' % (modelclass._meta.app_label, modelclass._meta.concrete_model._meta.object_name, pk)
+
+
+_related_models = {}
+
+
+def _get_related_models(modelclass):
+    """
+    Returns the concrete models sharing rows with modelclass (its parents
+    and children in multi-table inheritance).
+    """
+    try:
+        return _related_models[modelclass]
+    except KeyError:
+        concrete_model = modelclass._meta.concrete_model
+        related = set(concrete_model._meta.get_parent_list())
+        related.update(m for m in models.get_models(only_installed=False) if issubclass(m, concrete_model) and not m._meta.proxy)
+        related.add(concrete_model)
+        _related_models[modelclass] = related
+        return related
+
+
+def get_hydrated(modelclass, pks):
+    """
+    Returns a dictionary with the already hydrated objects for the given pks
+    found in the identity map or in the second-level cache.
+    """
+    identity_map = get_identity_map()
+    found = identity_map.get_many(modelclass, pks) if identity_map is not None else {}
+    if DEHYDRATION_CACHE_TIMEOUT:
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            keys = dict((_cache_key(modelclass, pk), pk) for pk in missing)
+            cached = {}
+            for key, obj in get_cache(DEHYDRATION_CACHE).get_many(keys.keys()).items():
+                if type(obj) is not modelclass:
+                    obj = transmogrify(modelclass, obj)
+                cached[keys[key]] = obj
+            if cached and identity_map is not None:
+                identity_map.add_many(modelclass, cached.values())
+            found.update(cached)
+    return found
+
+
+def add_hydrated(modelclass, objs):
+    """
+    Adds objects fetched from the database to the identity map and to the
+    second-level cache.
+    """
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.add_many(modelclass, objs)
+    if DEHYDRATION_CACHE_TIMEOUT and objs:
+        get_cache(DEHYDRATION_CACHE).set_many(dict((_cache_key(modelclass, obj.pk), obj) for obj in objs), DEHYDRATION_CACHE_TIMEOUT)
+
+
+def invalidate_hydrated(sender, instance, **kwargs):
+    related_models = _get_related_models(sender)
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.discard(sender, instance.pk)
+        for modelclass in related_models:
+            identity_map.discard(modelclass, instance.pk)
+    if DEHYDRATION_CACHE_TIMEOUT:
+        get_cache(DEHYDRATION_CACHE).delete_many([_cache_key(m, instance.pk) for m in related_models])
+
+if DEHYDRATION_CACHE_TIMEOUT or DEHYDRATION_IDENTITY_MAP:
+    post_save.connect(invalidate_hydrated)
+    post_delete.connect(invalidate_hydrated)
+
+
+_model_fields = {}
+
+
+def _get_model_fields(modelclass):
+    """
+    Returns the (descriptor names, field names, non-pk attnames) of a model.
+    """
+    try:
+        return _model_fields[modelclass]
+    except KeyError:
+        # Data should not and cannot return objects that are callable or descriptors:
+        descriptors = frozenset(k for k, v in modelclass.__dict__.items() if callable(v) or hasattr(v, '__get__'))
+        fields = descriptors.union(f.name for f in modelclass._meta.fields)
+        attrs = [f.attname for f in modelclass._meta.fields if f.attname != modelclass._meta.pk.attname]
+        _model_fields[modelclass] = descriptors, fields, attrs
+        return _model_fields[modelclass]
+
+
 ########################################
 
 def _walk(obj, fnct, raise_exc=True, delayed=None, load_querysets=None, maxlevels=10, level=0, context=None):
@@ -223,14 +396,11 @@ class DehydratedModel(Dehydrated):
         self.data = self.filter_data(__dict__)
 
     def filter_data(self, data):
-        modelclass = self.model_class()
-        # Data should not and cannot return objects that are callable or descriptors:
-        fields = set(k for k, v in modelclass.__dict__.items() if callable(v) or hasattr(v, '__get__'))
+        descriptors, fields, attrs = _get_model_fields(self.model_class())
         if self.pk:
-            fields.update(f.name for f in modelclass._meta.fields)
             return dict((k, v) for k, v in data.items() if k not in fields and not k.startswith('_') and not k.endswith('_id'))
         else:
-            return dict((k, v) for k, v in data.items() if k not in fields and not k.startswith('_'))
+            return dict((k, v) for k, v in data.items() if k not in descriptors and not k.startswith('_'))
 
     def __str__(self):
         if hasattr(self, '__unicode__'):
@@ -267,11 +437,20 @@ class DehydratedModel(Dehydrated):
                 pks = [pk for pk, objs in objects.items() if any(hasattr(obj, '_delayed_hydration') for obj in objs)]
                 if pks:
                     if load_querysets and modelclass in load_querysets:
+                        # Custom querysets bypass the identity map and cache
                         qs = load_querysets[modelclass]
+                        found = {}
                     else:
                         qs = modelclass._default_manager
-                    for _obj in qs.filter(pk__in=pks):
-                        obj, dobjs = objects[_obj.pk]
+                        found = get_hydrated(modelclass, pks)
+                    missing = [pk for pk in pks if pk not in found]
+                    if missing:
+                        loaded = list(qs.filter(pk__in=missing))
+                        if qs is modelclass._default_manager:
+                            add_hydrated(modelclass, loaded)
+                        found.update((_obj.pk, _obj) for _obj in loaded)
+                    for pk, _obj in found.items():
+                        obj, dobjs = objects[pk]
                         for dobj in dobjs:
                             dobj._hydrated_obj = _obj
                 del delayed[modelclass]
@@ -283,6 +462,7 @@ class DehydratedModel(Dehydrated):
             obj = self._hydrated_obj
         else:
             modelclass = self.model_class()
+            data = self.filter_data(self.data) if hasattr(self, 'data') else None
             if self.pk:
                 if delayed is not None:
                     delayed.setdefault(modelclass, {})
@@ -290,12 +470,10 @@ class DehydratedModel(Dehydrated):
                         obj, dobjs = delayed[modelclass][self.pk]
                         dobjs.append(self)
                     else:
-                        attrs = []
-                        for field in modelclass._meta.fields:
-                            if field.attname != modelclass._meta.pk.attname:
-                                attrs.append(field.attname)
+                        descriptors, fields, attrs = _get_model_fields(modelclass)
                         dehydrated_modelclass = hydrated_class_factory(modelclass, attrs)
-                        obj = dehydrated_modelclass()
+                        obj = dehydrated_modelclass.__new__(dehydrated_modelclass)
+                        obj.__dict__['_state'] = ModelState()
                         obj.__dict__[modelclass._meta.pk.attname] = self.pk
                         for parent in modelclass._meta.parents.values():
                             obj.__dict__[parent.rel.field_name] = self.pk
@@ -318,13 +496,20 @@ class DehydratedModel(Dehydrated):
                                 raise modelclass.DoesNotExist(msg)
                         obj.__dict__['_delayed_hydration'] = types.MethodType(_delayed_hydration, self, modelclass)
                 else:
-                    obj = modelclass._default_manager.get(pk=self.pk)
+                    obj = get_hydrated(modelclass, [self.pk]).get(self.pk)
+                    if obj is None:
+                        obj = modelclass._default_manager.get(pk=self.pk)
+                        add_hydrated(modelclass, [obj])
+                    if data:
+                        # The object is shared through the identity map, the
+                        # extra data goes in a copy of it.
+                        obj = transmogrify(obj.__class__, obj)
                     self._hydrated_obj = obj
             else:
                 obj = modelclass()
                 self._hydrated_obj = obj
-            if hasattr(self, 'data'):
-                obj.__dict__.update(self.filter_data(self.data))
+            if data:
+                obj.__dict__.update(data)
         return obj
 
 
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import uuid
+import base64
+import binascii
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from . import UUID
+from . import utils
+from .models import UUIDNodes
+from .utils import (ANONYMOUS_USER_CODE, ANONYMOUS_USER_UUID, encode_uuid,
+                    decode_uuid, encode_many, decode_many, warmup_nodes)
+
+
+def baseline_encode(num, node_id):
+    """
+    The original string based encoder, for a known ``node_id``.
+
+    """
+    node_bin = '{:b}'.format(node_id) + '00'
+    node_size = len(node_bin) // 8
+    node_len = (node_size + 1) * 8
+    node_data = int(node_bin, 2) | node_size
+    time = num.time - utils._UUID_TIME_INITIAL
+    clock = num.clock_seq & utils._UUID_CLOCK_MASK
+    full = (((time << 14) | clock) << node_len) | node_data
+    bytes_ = binascii.unhexlify(b'{:032x}'.format(full)).lstrip(b'\x00')
+    return base64.urlsafe_b64encode(bytes_).rstrip(b'=').decode('ascii')
+
+
+class EncodeDecodeTestCase(TestCase):
+    def setUp(self):
+        utils.reset_nodes()
+        self.nums = []
+        for i, node in enumerate((0x1, 0xabcdef012345, 0xffffffffffff)):
+            for clock_seq in (0, 1, 0x3fff):
+                self.nums.append(UUID(bytes=uuid.uuid1(node=node, clock_seq=clock_seq).bytes))
+            # Node ids of every encoded size.
+            UUIDNodes.objects.create(id=(1, 0x3f, 0x3fff)[i], node=node)
+        UUIDNodes.objects.create(id=0x3fffff, node=0x123456789abc)
+        self.nums.append(UUID(bytes=uuid.uuid1(node=0x123456789abc).bytes))
+
+    def tearDown(self):
+        utils.reset_nodes()
+
+    def test_baseline_parity(self):
+        codes = [encode_uuid(num) for num in self.nums]
+        expected = [baseline_encode(num, UUIDNodes.objects.get(node=num.node).id) for num in self.nums]
+        self.assertEqual(codes, expected)
+        self.assertEqual([decode_uuid(code) for code in expected], self.nums)
+
+    def test_round_trip_many(self):
+        nums = self.nums + [ANONYMOUS_USER_UUID]
+        with self.assertNumQueries(1):
+            codes = encode_many(nums)
+        self.assertEqual(codes[-1], ANONYMOUS_USER_CODE)
+        self.assertEqual(codes[:-1], [baseline_encode(num, UUIDNodes.objects.get(node=num.node).id) for num in self.nums])
+
+        utils.reset_nodes()
+        with self.assertNumQueries(1):
+            self.assertEqual(decode_many(codes), nums)
+        with self.assertNumQueries(0):
+            self.assertEqual(decode_many(codes), nums)
+            self.assertEqual(encode_many(nums), codes)
+
+    def test_warmup_nodes(self):
+        warmup_nodes()
+        with self.assertNumQueries(0):
+            codes = [encode_uuid(num) for num in self.nums]
+            self.assertEqual([decode_uuid(code) for code in codes], self.nums)
+
+    def test_warmup_nodes_database_error(self):
+        def values_list(*args, **kwargs):
+            raise DatabaseError("could not connect to server")
+        UUIDNodes.objects.values_list = values_list
+        try:
+            warmup_nodes()
+        finally:
+            del UUIDNodes.objects.values_list
+        self.assertEqual(decode_uuid(encode_uuid(self.nums[0])), self.nums[0])
+
+    def test_deleted_node(self):
+        warmup_nodes()
+        node = UUIDNodes.objects.get(node=0x123456789abc)
+        node.delete()
+        self.assertNotIn(node.id, utils._nodes)
+        self.assertNotIn(node.node, utils._node_ids)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, encode_many, [None])
+        self.assertRaises(ValueError, decode_many, [None])
+        self.assertRaises(ValueError, encode_many, [uuid.uuid4()])
@@ -7,13 +7,16 @@ import binascii
 import hashlib
 
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import DatabaseError, IntegrityError
+from django.db.models import signals
 
 import primes
 
 from . import UUID
 from .models import UUIDNodes
 
+import logging
+logger = logging.getLogger(__name__)
 
 ANONYMOUS_USER_CODE = 'ANONYMOUS'
 ANONYMOUS_USER_UUID = UUID(settings.ANONYMOUS_USER_ID)
@@ -39,14 +42,71 @@ def get_obj_for_hash(node, generator):
     raise RuntimeError("Cannot find an available bucket for the node")
 
 
+# Nodes never change once registered, so they are kept in process-wide maps
+# (loaded in bulk by warmup_nodes() when the application starts) in front of
+# the UUIDNodes manager cache. Deleted nodes are dropped from them, and
+# reset_nodes() empties them (e.g. in tests).
+WARMUP_NODES = getattr(settings, 'UUIDFIELD_WARMUP_NODES', True)
+
+_nodes = {}  # node_id -> node
+_node_ids = {}  # node -> node_id
+
+
+def _register_node(node_id, node):
+    _nodes[node_id] = node
+    _node_ids[node] = node_id
+
+
+def reset_nodes():
+    """
+    Empty the process-wide node maps.
+
+    """
+    _nodes.clear()
+    _node_ids.clear()
+
+
+def _node_deleted(sender, instance, **kwargs):
+    _nodes.pop(instance.id, None)
+    _node_ids.pop(instance.node, None)
+signals.post_delete.connect(_node_deleted, sender=UUIDNodes)
+
+
+def warmup_nodes():
+    """
+    Load all the registered nodes in the process-wide node maps.
+
+    Meant to be called once at application startup (see wsgi.py), it does
+    nothing if ``UUIDFIELD_WARMUP_NODES`` is disabled. If the database
+    can't be reached the error is logged and the nodes are loaded as needed.
+
+    """
+    if WARMUP_NODES:
+        try:
+            for node_id, node in UUIDNodes.objects.values_list('id', 'node'):
+                _register_node(node_id, node)
+        except DatabaseError as e:
+            logger.warning("Cannot warm up the UUID nodes: %s", e)
+
+
 def get_node(node_id):
     try:
-        return UUIDNodes.objects.get_for_id(node_id).node
+        return _nodes[node_id]
+    except KeyError:
+        pass
+    try:
+        node = UUIDNodes.objects.get_for_id(node_id).node
     except UUIDNodes.DoesNotExist:
         return None
+    _register_node(node_id, node)
+    return node
 
 
 def get_node_id(node):
+    try:
+        return _node_ids[node]
+    except KeyError:
+        pass
     try:
         uuid_node = UUIDNodes.objects.get_for_label(node)
     except UUIDNodes.DoesNotExist:
@@ -58,9 +118,35 @@ def get_node_id(node):
             if uuid_node.node == node:
                 return uuid_node
         uuid_node = get_obj_for_hash(node, generator)
+    _register_node(uuid_node.id, uuid_node.node)
     return uuid_node.id
 
 
+def _encode(num, node_id):
+    node_size = (max(node_id.bit_length(), 1) + 2) // 8
+    if node_size > 3:
+        raise ValueError("Not enough space for nodes")
+    node_len = (node_size + 1) * 8
+    node_data = (node_id << 2) | node_size
+    time = num.time - _UUID_TIME_INITIAL
+    if time < 0:
+        raise ValueError("Timestamp in UUID is too old to be encoded properly (%s)" % num)
+    clock = num.clock_seq & _UUID_CLOCK_MASK
+    full = (((time << 14) | clock) << node_len) | node_data
+    hex_ = b'%x' % full
+    if len(hex_) & 1:
+        hex_ = b'0' + hex_
+    return base64.urlsafe_b64encode(binascii.unhexlify(hex_)).rstrip(b'=').decode('ascii')
+
+
+def _to_uuid(num):
+    if not isinstance(num, uuid.UUID):
+        num = UUID(num)
+    elif num.version != 1:
+        raise ValueError("Cannot encode UUID which is not Version 1 (%s)" % num)
+    return num
+
+
 def encode_uuid(num):
     """
     Encode and compress a UUID (uuid1) into a smallest representation
@@ -77,51 +163,48 @@ def encode_uuid(num):
         raise ValueError("Cannot encode None")
     if num == ANONYMOUS_USER_UUID:
         return ANONYMOUS_USER_CODE
-    if not isinstance(num, uuid.UUID):
-        num = UUID(num)
-    elif num.version != 1:
-        raise ValueError("Cannot encode UUID which is not Version 1 (%s)" % num)
-    node_id = get_node_id(num.node)
-    node_bin = '{:b}'.format(node_id) + '00'
-    node_size = len(node_bin) / 8
-    node_len = (node_size + 1) * 8
-    if node_size > 3:
-        raise ValueError("Not enough space for nodes")
-    node_data = int(node_bin, 2) | node_size
-    time = num.time - _UUID_TIME_INITIAL
-    if time < 0:
-        raise ValueError("Timestamp in UUID is too old to be encoded properly (%s)" % num)
-    clock = num.clock_seq & _UUID_CLOCK_MASK
-    full = (time << 14) | clock
-    full <<= node_len
-    full |= node_data
-    bytes_ = binascii.unhexlify(b'{:032x}'.format(full)).lstrip(b'\x00')
-    code = base64.urlsafe_b64encode(bytes_)
-    code = code.rstrip('=')
-    return code
+    num = _to_uuid(num)
+    return _encode(num, get_node_id(num.node))
 
 
-def decode_uuid(code):
+def encode_many(nums):
     """
-    Decode an encoded UUID compressed code to a full UUID.
+    Encode a list of UUIDs (see `encode_uuid()`), looking up all the
+    nodes not yet known in a single query.
 
     """
-    if code is None:
-        raise ValueError("Cannot decode None")
-    if code == ANONYMOUS_USER_CODE:
-        return ANONYMOUS_USER_UUID
-    code += '=' * (4 - len(code) % 4)
-    bytes_ = base64.urlsafe_b64decode(code)
+    nums = [num if num is None or num == ANONYMOUS_USER_UUID else _to_uuid(num) for num in nums]
+    missing = set(num.node for num in nums if num is not None and num != ANONYMOUS_USER_UUID) - set(_node_ids)
+    if missing:
+        for node_id, node in UUIDNodes.objects.filter(node__in=missing).values_list('id', 'node'):
+            _register_node(node_id, node)
+    codes = []
+    for num in nums:
+        if num is None:
+            raise ValueError("Cannot encode None")
+        if num == ANONYMOUS_USER_UUID:
+            codes.append(ANONYMOUS_USER_CODE)
+        else:
+            codes.append(_encode(num, get_node_id(num.node)))
+    return codes
+
+
+def _decode(code):
+    code = code.encode('ascii')
+    bytes_ = base64.urlsafe_b64decode(code + b'=' * (-len(code) % 4))
     full = int(binascii.hexlify(bytes_), 16)
     node_len = ((full & 3) + 1) * 8
     node_id = (full & ((1 << node_len) - 1)) >> 2
     full >>= node_len
     time = (full >> 14) + _UUID_TIME_INITIAL
     clock = full & _UUID_CLOCK_MASK
-    node = get_node(node_id)
+    return node_id, time, clock
+
+
+def _to_uuid1(time, clock, node):
     if node is None:
         raise ValueError("Invalid entity code (registered node not found)")
-    uuid_ = UUID(fields=(
+    return UUID(fields=(
         time & 0xffffffff,
         (time >> 32) & 0xffff,
         (time >> 48) | 0x1000,  # version 1
@@ -129,7 +212,40 @@ def decode_uuid(code):
         clock & 0xff,
         node & _UUID_NODE_MASK,
     ))
-    return uuid_
+
+
+def decode_uuid(code):
+    """
+    Decode an encoded UUID compressed code to a full UUID.
+
+    """
+    if code is None:
+        raise ValueError("Cannot decode None")
+    if code == ANONYMOUS_USER_CODE:
+        return ANONYMOUS_USER_UUID
+    node_id, time, clock = _decode(code)
+    return _to_uuid1(time, clock, get_node(node_id))
+
+
+def decode_many(codes):
+    """
+    Decode a list of encoded UUID codes (see `decode_uuid()`), looking up
+    all the node ids not yet known in a single query.
+
+    """
+    decoded = []
+    for code in codes:
+        if code is None:
+            raise ValueError("Cannot decode None")
+        decoded.append(None if code == ANONYMOUS_USER_CODE else _decode(code))
+    missing = set(d[0] for d in decoded if d is not None) - set(_nodes)
+    if missing:
+        for node_id, node in UUIDNodes.objects.filter(id__in=missing).values_list('id', 'node'):
+            _register_node(node_id, node)
+    return [
+        ANONYMOUS_USER_UUID if d is None else _to_uuid1(d[1], d[2], _nodes.get(d[0]))
+        for d in decoded
+    ]
 
 
 if __name__ == '__main__':
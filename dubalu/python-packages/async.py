@@ -14,30 +14,335 @@ from __future__ import absolute_import, print_function
 import sys
 import time
 import atexit
+import bisect
+import itertools
 import threading
-from Queue import Queue
+from Queue import PriorityQueue, Empty
 from functools import wraps
 
 import logging
 logger = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_RETRY_DELAY = 1
+
+# Lower values run first; tasks of the same priority run in FIFO order.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 50
+PRIORITY_LOW = 100
+
+# What to do with new tasks when the queue is full:
+OVERFLOW_BLOCK = 'block'  # wait for a free slot
+OVERFLOW_DROP = 'drop'  # discard the task (and log it)
+OVERFLOW_INLINE = 'inline'  # run the task in the calling thread
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
 
 _worker = None
 
+# Set in the processes of ProcessBackend pools, where decorated functions
+# run directly instead of being queued again.
+_in_process = False
+
+
+class Histogram(object):
+    """
+    Counts values into fixed buckets.
+
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': list(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+class TaskContext(object):
+    """
+    Carries state from the thread queueing a task to wherever the task runs
+    (e.g. thread local settings). ``capture()`` is called when the task is
+    queued and its (picklable) result is passed to ``enter()`` and ``exit()``
+    around every run of the task.
+
+    """
+    def capture(self):
+        return None
+
+    def enter(self, state):
+        pass
+
+    def exit(self, state):
+        pass
+
+
+def _call(func, args, kwargs, context, state):
+    if context is None:
+        return func(*args, **kwargs)
+    context.enter(state)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        context.exit(state)
+
+
+class ThreadBackend(object):
+    """
+    Runs tasks in the worker threads.
+
+    """
+    def run(self, task):
+        return _call(task.func, task.args, task.kwargs, task.context, task.state)
+
+    def close(self):
+        pass
+
+
+def _process_initializer():
+    global _in_process
+    _in_process = True
+
+
+def _process_call(reference, args, kwargs, context, state):
+    kind, func = reference
+    if kind == 'method':
+        func = getattr(args[0], func)
+        args = args[1:]
+    elif kind == 'function':
+        module, name = func
+        __import__(module)
+        func = getattr(sys.modules[module], name)
+    return _call(func, args, kwargs, context, state)
+
+
+def _process_reference(func, args):
+    """
+    Decorated functions can't be pickled (their name refers to the wrapper),
+    so those are sent by name, in the module or in the first argument.
+    """
+    name = func.__name__
+    module = sys.modules.get(func.__module__)
+    if getattr(getattr(module, name, None), '_async_func', None) is func:
+        return 'function', (func.__module__, name)
+    if args:
+        bound = getattr(args[0], name, None)
+        if getattr(getattr(bound, '__func__', None), '_async_func', None) is func:
+            return 'method', name
+    return 'callable', func
+
+
+class ProcessBackend(object):
+    """
+    Runs tasks in a pool of processes, for CPU bound jobs. The worker
+    thread waits for the result, so the queue, retries and stats are the
+    same as for threads. Functions (or the methods of the first argument),
+    arguments and context states must be picklable.
+
+    """
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.processes, _process_initializer)
+            return self._pool
+
+    def run(self, task):
+        reference = _process_reference(task.func, task.args)
+        return self.get_pool().apply(_process_call, (reference, task.args, task.kwargs, task.context, task.state))
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class AsyncioBackend(object):
+    """
+    Runs coroutine functions to completion in an event loop of the worker
+    thread (one loop per thread), so they can use asyncio (or trollius)
+    concurrency internally.
+
+    """
+    def __init__(self):
+        try:
+            import asyncio
+        except ImportError:
+            import trollius as asyncio
+        self.asyncio = asyncio
+        self._local = threading.local()
+        self._loops = []
+
+    def get_loop(self):
+        loop = getattr(self._local, 'loop', None)
+        if loop is None:
+            loop = self._local.loop = self.asyncio.new_event_loop()
+            self._loops.append(loop)
+        return loop
+
+    def _run_until_complete(self, func, *args, **kwargs):
+        result = func(*args, **kwargs)
+        if self.asyncio.iscoroutine(result) or isinstance(result, self.asyncio.Future):
+            result = self.get_loop().run_until_complete(result)
+        return result
+
+    def run(self, task):
+        return _call(self._run_until_complete, (task.func,) + tuple(task.args), task.kwargs, task.context, task.state)
+
+    def close(self):
+        loops, self._loops = self._loops, []
+        for loop in loops:
+            if not loop.is_running():
+                loop.close()
+
+
+BACKENDS = {
+    'thread': ThreadBackend,
+    'process': ProcessBackend,
+    'asyncio': AsyncioBackend,
+}
+
+
+class Task(object):
+    __slots__ = ('func', 'args', 'kwargs', 'name', 'log_exceptions', 'priority', 'retries', 'retry_delay', 'backend', 'context', 'state', 'attempt', 'queued_at')
+
+    def __init__(self, func, args, kwargs, name, log_exceptions, priority=PRIORITY_NORMAL, retries=0, retry_delay=DEFAULT_RETRY_DELAY, backend='thread', context=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name or func.__name__
+        self.log_exceptions = log_exceptions
+        self.priority = priority
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.backend = backend
+        self.context = context
+        self.state = context.capture() if context is not None else None
+        self.attempt = 0
+        self.queued_at = None
+
+    def __repr__(self):
+        return '<Task %s (priority %s, attempt %s)>' % (self.name, self.priority, self.attempt)
+
 
 class AsyncWorker(object):
+    """
+    A pool of threads running queued tasks.
+
+    ``num_threads`` is the maximum number of threads; threads are started as
+    the queue grows and those idle for ``idle_timeout`` seconds stop (down
+    to ``min_threads``). At most ``max_queue_size`` tasks (0 for unbounded)
+    wait in the queue, what happens to tasks queued beyond that is given by
+    ``overflow``. Failed tasks are retried with exponential backoff when
+    queued with ``retries``.
+
+    Tasks are run by the named execution backend they were queued for,
+    ``backends`` maps names to backend classes or instances (BACKENDS by
+    default).
+
+    """
     _terminator = object()
 
-    def __init__(self, shutdown_timeout=DEFAULT_TIMEOUT, num_threads=10):
-        self._queue = Queue(-1)
+    def __init__(self, shutdown_timeout=DEFAULT_TIMEOUT, num_threads=10, min_threads=1,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE, overflow=OVERFLOW_BLOCK, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 backends=None):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_INLINE):
+            raise ValueError("Invalid overflow policy: %r" % overflow)
+        self.backends = dict(BACKENDS if backends is None else backends)
+        self._backends_lock = threading.Lock()
+        self._queue = PriorityQueue()
+        self._slots = threading.BoundedSemaphore(max_queue_size) if max_queue_size else None
+        self._seq = itertools.count()
         self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
         self._threads = None
+        self._thread_ids = itertools.count(1)
+        self._idle = 0
+        self._timers = set()
+        self._stopping = False
+        self._stopped = False
         self.num_threads = num_threads
+        self.min_threads = min(min_threads, num_threads)
+        self.max_queue_size = max_queue_size
+        self.overflow = overflow
+        self.idle_timeout = idle_timeout
         self.options = {
             'shutdown_timeout': shutdown_timeout,
         }
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self.reset_stats()
         self.start()
+        atexit.register(self.main_thread_terminated)
+
+    def stats(self):
+        """
+        Return a dictionary with the worker counters and latency histograms
+        (time waiting in the queue and running, in seconds).
+
+        """
+        with self._stats_lock:
+            return {
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'inline': self.inline,
+                'pending': self._queue.qsize(),
+                'threads': len(self._threads or ()),
+                'wait_time': self.wait_time.as_dict(),
+                'run_time': self.run_time.as_dict(),
+            }
+
+    def reset_stats(self):
+        """Reset the counters and histograms (but not running)."""
+        with self._stats_lock:
+            self.queued = self.completed = self.failed = self.retried = self.dropped = self.inline = 0
+            self.running = getattr(self, 'running', 0)
+            self.wait_time.reset()
+            self.run_time.reset()
+
+    def get_backend(self, name):
+        backend = self.backends[name]
+        if isinstance(backend, type):
+            with self._backends_lock:
+                backend = self.backends[name]
+                if isinstance(backend, type):
+                    backend = self.backends[name] = backend()
+        return backend
+
+    def _close_backends(self):
+        for backend in list(self.backends.values()):
+            if not isinstance(backend, type):
+                try:
+                    backend.close()
+                except Exception as e:
+                    logger.error('Async backend failed to close: %s', e, exc_info=True)
 
     def main_thread_terminated(self):
         self._lock.acquire()
@@ -46,9 +351,12 @@ class AsyncWorker(object):
                 # thread not started or already stopped - nothing to do
                 return
 
-            # wake the processing thread up
-            for _ in range(self.num_threads):
-                self._queue.put_nowait(self._terminator)
+            self._stopping = True
+            self._flush_timers()
+
+            # wake the processing threads up (after all the pending tasks)
+            for _ in range(len(self._threads)):
+                self._queue.put_nowait((sys.maxsize, next(self._seq), self._terminator))
 
             timeout = self.options['shutdown_timeout']
 
@@ -78,6 +386,8 @@ class AsyncWorker(object):
                 print(file=sys.stderr)
 
             self._threads = None
+            self._stopped = True
+            self._close_backends()
 
         finally:
             self._lock.release()
@@ -105,80 +415,219 @@ class AsyncWorker(object):
         finally:
             queue.all_tasks_done.release()
 
+    def _start_thread(self):
+        # Must be called with self._lock held
+        thread = threading.Thread(
+            name="AsyncThread%s" % next(self._thread_ids),
+            target=self._target,
+        )
+        thread.setDaemon(True)
+        self._threads.add(thread)
+        thread.start()
+
     def start(self):
         """
-        Starts the task thread.
+        Starts the task threads.
         """
         self._lock.acquire()
         try:
             if not self._threads:
-                self._threads = Queue(self.num_threads)
-                for idx in range(self.num_threads):
-                    thread = threading.Thread(
-                        name="AsyncThread%s" % (idx + 1),
-                        target=self._target,
-                        args=(self._threads,),
-                    )
-                    thread.setDaemon(True)
-                    thread.start()
-                    self._threads.put(thread)
+                self._threads = set()
+                self._stopping = self._stopped = False
+                for _ in range(self.min_threads):
+                    self._start_thread()
         finally:
             self._lock.release()
-            atexit.register(self.main_thread_terminated)
 
     def stop(self, timeout=None):
         """
-        Stops the task thread. Synchronous!
+        Stops the task threads, after the pending tasks are done. Synchronous!
         """
         self._lock.acquire()
         try:
-            if self._threads:
-                for _ in range(self.num_threads):
-                    self._queue.put_nowait(self._terminator)
-                self._timed_queue_join(self._threads, timeout=timeout)
-                self._threads = None
+            if not self._threads:
+                return
+            self._stopping = True
+            self._flush_timers()
+            threads = list(self._threads)
+            for _ in threads:
+                self._queue.put_nowait((sys.maxsize, next(self._seq), self._terminator))
+        finally:
+            self._lock.release()
+        # Threads take the lock when finishing, so wait for them without it
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
+        self._lock.acquire()
+        try:
+            self._threads = None
+            self._stopped = True
         finally:
             self._lock.release()
+        self._close_backends()
+
+    def _flush_timers(self):
+        # Tasks waiting to be retried are queued right away so they are not lost
+        with self._stats_lock:
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+            self._put(timer.args[1], OVERFLOW_INLINE)
+
+    def _maybe_start_thread(self):
+        if self._idle < self._queue.qsize() and not self._stopping:
+            with self._lock:
+                if self._threads is not None and len(self._threads) < self.num_threads and not self._stopping:
+                    self._start_thread()
+
+    def queue(self, func, args, kwargs, name, log_exceptions, priority=PRIORITY_NORMAL, retries=0, retry_delay=DEFAULT_RETRY_DELAY,
+              backend='thread', context=None):
+        """
+        Queue a task, returns False if it was dropped.
+        """
+        if backend not in self.backends:
+            raise ValueError("Invalid async backend: %r" % backend)
+        return self._put(Task(func, args, kwargs, name, log_exceptions, priority, retries, retry_delay, backend, context))
+
+    def _put(self, task, overflow=None):
+        if self._stopped:
+            # Nobody is left to run it
+            return self._run_inline(task)
+        if self._slots is not None:
+            overflow = overflow or self.overflow
+            if overflow == OVERFLOW_BLOCK and threading.current_thread() in (self._threads or ()):
+                # Workers waiting for themselves would deadlock
+                overflow = OVERFLOW_INLINE
+            if overflow == OVERFLOW_BLOCK:
+                self._slots.acquire()
+            elif not self._slots.acquire(False):
+                if overflow == OVERFLOW_INLINE:
+                    return self._run_inline(task)
+                with self._stats_lock:
+                    self.dropped += 1
+                logger.warning('Async queue full, task dropped - %s()', task.name)
+                return False
+        task.queued_at = time.time()
+        with self._stats_lock:
+            self.queued += 1
+        self._queue.put((task.priority, next(self._seq), task))
+        self._maybe_start_thread()
+        return True
 
-    def queue(self, func, args, kwargs, name, log_exceptions):
-        self._queue.put_nowait((func, args, kwargs, name, log_exceptions))
+    def _run_inline(self, task):
+        with self._stats_lock:
+            self.inline += 1
+        task.queued_at = time.time()
+        self._run(task)
+        return True
 
-    def _target(self, threads):
+    def _retry(self, timer, task):
+        with self._stats_lock:
+            if timer not in self._timers:
+                return  # flushed
+            self._timers.discard(timer)
+        self._put(task)
+
+    def _run(self, task):
+        started = time.time()
+        with self._stats_lock:
+            self.running += 1
+            self.wait_time.add(started - task.queued_at)
+        try:
+            try:
+                self.get_backend(task.backend).run(task)
+            except Exception as e:
+                if task.attempt < task.retries and not self._stopping:
+                    delay = task.retry_delay * 2 ** task.attempt
+                    task.attempt += 1
+                    logger.warning('Async job failed, retrying in %ss (%s/%s) - %s(): %s', delay, task.attempt, task.retries, task.name, e)
+                    timer = threading.Timer(delay, self._retry)
+                    timer.args = (timer, task)
+                    timer.daemon = True
+                    with self._stats_lock:
+                        self.retried += 1
+                        self._timers.add(timer)
+                    timer.start()
+                else:
+                    with self._stats_lock:
+                        self.failed += 1
+                    if task.log_exceptions:
+                        logger.error('Async job failed - %s(): %s', task.name, e, exc_info=True)
+            else:
+                with self._stats_lock:
+                    self.completed += 1
+        finally:
+            with self._stats_lock:
+                self.running -= 1
+                self.run_time.add(time.time() - started)
+
+    def _target(self):
+        current = threading.current_thread()
         try:
             while True:
-                record = self._queue.get()
+                with self._stats_lock:
+                    self._idle += 1
+                try:
+                    priority, seq, task = self._queue.get(timeout=self.idle_timeout)
+                except Empty:
+                    with self._lock:
+                        if not self._stopping and self._threads is not None and len(self._threads) > self.min_threads:
+                            self._threads.discard(current)
+                            break
+                    continue
+                finally:
+                    with self._stats_lock:
+                        self._idle -= 1
                 try:
-                    if record is self._terminator:
+                    if task is self._terminator:
                         break
-                    func, args, kwargs, name, log_exceptions = record
-                    if not name:
-                        name = func.__name__
-                    try:
-                        try:
-                            func(*args, **kwargs)
-                        except Exception:
-                            if log_exceptions:
-                                raise
-                    except Exception as e:
-                        logger.error('Async job failed - %s(): %s', name, e, exc_info=True)
+                    if self._slots is not None:
+                        self._slots.release()
+                    self._run(task)
                 finally:
                     self._queue.task_done()
-                time.sleep(0)
         except Exception as e:
             logger.error('AsyncThread worker died unexpectedly: %s', e, exc_info=True)
             raise
         finally:
-            threads.task_done()
+            with self._lock:
+                if self._threads is not None:
+                    self._threads.discard(current)
+
+
+def get_worker():
+    """
+    Return the worker used by the ``async`` decorator.
+    """
+    global _worker
+    if _worker is None:
+        _worker = AsyncWorker()
+    return _worker
+
+
+def set_worker(worker):
+    """
+    Set the worker used by the ``async`` decorator (e.g. a configured
+    ``AsyncWorker(num_threads=20, overflow=OVERFLOW_INLINE)``).
+    """
+    global _worker
+    _worker = worker
 
 
-def async(func=None, name=None, log_exceptions=True):
+def async(func=None, name=None, log_exceptions=True, priority=PRIORITY_NORMAL, retries=0, retry_delay=DEFAULT_RETRY_DELAY,
+          backend='thread', context=None):
+    """
+    Makes calls to the decorated function (or method) queue it in the shared
+    worker, to be run by the given ``backend`` ('thread', 'process' or
+    'asyncio'). ``context`` is a TaskContext carrying the caller state.
+    """
     def _async(func):
         @wraps(func)
         def wrapped(*args, **kwargs):
-            global _worker
-            if _worker is None:
-                _worker = AsyncWorker()
-            _worker.queue(func, args, kwargs, name, log_exceptions)
+            if _in_process:
+                return func(*args, **kwargs)
+            get_worker().queue(func, args, kwargs, name, log_exceptions, priority, retries, retry_delay, backend, context)
+        wrapped._async_func = func
         return wrapped
     if callable(func):
         return _async(func)
@@ -1,4 +1,4 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
-from .cache import LRUCache  # NOQA
+from .cache import LRUCache, StripedLRUCache  # NOQA
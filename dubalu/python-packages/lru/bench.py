@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# python -m lru.bench
+"""
+Compare the linked-hash LRUCache against the former deque based one.
+
+"""
+from __future__ import absolute_import, print_function
+
+import random
+import time
+from collections import deque
+from threading import RLock
+
+from .cache import LRUCache, StripedLRUCache
+
+
+class DequeLRUCache(object):
+    """
+    The former deque based implementation (only the hot paths).
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._wlock = RLock()
+        self._mapping = {}
+        self._queues = {}
+
+    def __getitem__(self, key):
+        with self._wlock:
+            value = self._mapping[key]
+            queue = self._queues.setdefault(type(value), deque())
+            if not len(queue) or queue[-1] != key:
+                try:
+                    queue.remove(key)
+                except ValueError:
+                    pass
+                queue.append(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._wlock:
+            queue = self._queues.setdefault(type(value), deque())
+            if key in self._mapping:
+                queue.remove(key)
+            elif len(queue) == self.capacity:
+                del self._mapping[queue.popleft()]
+            self._mapping[key] = value
+            queue.append(key)
+
+
+def run(cache, keys, operations):
+    start = time.time()
+    for i in range(operations):
+        key = keys[i]
+        try:
+            cache[key]
+        except KeyError:
+            cache[key] = key
+    return time.time() - start
+
+
+def main(sizes=(1000, 10000, 100000), operations=20000):
+    print('%10s %14s %14s %14s' % ('entries', 'deque', 'linked-hash', 'striped'))
+    for size in sizes:
+        # Working set a bit larger than the capacity so there are evictions.
+        keys = [random.randint(0, size + size // 10) for _ in range(operations)]
+        results = []
+        for cls in (DequeLRUCache, LRUCache, StripedLRUCache):
+            cache = cls(size)
+            for i in range(size):
+                cache[i] = i
+            results.append(run(cache, keys, operations))
+        print('%10d %12.2fus %12.2fus %12.2fus' % ((size,) + tuple(r * 1e6 / operations for r in results)))
+
+
+if __name__ == '__main__':
+    main()
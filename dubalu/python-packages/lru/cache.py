@@ -10,38 +10,67 @@ LRU cache utility class.
 Changes:
 
 This is different from Jinja's LRUCache in that it caches by type, so cached
-values of different types are cached in different queues of the same capacity.
+values of different types are cached in different queues of the same capacity
+(or of the capacity given for that type in ``capacities``).
+
+Each queue is a linked hash (an ``OrderedDict``), so getting, setting and
+evicting an item are all O(1) operations regardless of the cache size.
 
 """
 from __future__ import absolute_import
 
-from collections import deque
+from collections import OrderedDict
 from threading import RLock
 
+if hasattr(OrderedDict, 'move_to_end'):
+    def _move_to_end(queue, key):
+        queue.move_to_end(key)
+else:
+    def _move_to_end(queue, key):
+        del queue[key]
+        queue[key] = None
+
 
 class LRUCache(object):
     """
     A type-based LRU Cache implementation.
 
-    This is fast for small capacities (something below 1000) but doesn't scale.
+    ``capacity`` is the number of items kept for each type of value,
+    ``capacities`` optionally maps a type to its own capacity.
+
+    Hits, misses and evictions are counted and can be queried by `stats()`.
 
     """
 
-    def __init__(self, capacity):
+    def __init__(self, capacity, capacities=None):
         self.capacity = capacity
+        self.capacities = dict(capacities or {})
         self._wlock = RLock()
         self._mapping = {}
         self._queues = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def __getstate__(self):
         return {
             'capacity': self.capacity,
+            'capacities': self.capacities,
             '_mapping': self._mapping,
             '_queues': self._queues,
         }
 
     def __setstate__(self, d):
         self.__dict__.update(d)
+        self.__dict__.setdefault('capacities', {})
+        # Pickles from before the linked-hash queues hold deques of keys,
+        # least recently used first.
+        self._queues = dict(
+            (k, v if isinstance(v, OrderedDict) else OrderedDict.fromkeys(v))
+            for k, v in self._queues.items()
+        )
+        self._wlock = RLock()
+        self.hits = self.misses = self.evictions = 0
 
     def __getnewargs__(self):
         return (self.capacity,)
@@ -51,11 +80,38 @@ class LRUCache(object):
         Return a shallow copy of the instance.
 
         """
-        rv = self.__class__(self.capacity,)
-        rv._mapping.update(self._mapping)
-        rv._queues = dict((k, deque(v)) for k, v in self._queues)
+        rv = self.__class__(self.capacity, self.capacities)
+        with self._wlock:
+            rv._mapping.update(self._mapping)
+            rv._queues = dict((k, OrderedDict(v)) for k, v in self._queues.items())
         return rv
 
+    def get_capacity(self, type_):
+        """
+        Return the capacity of the queue for values of the given type.
+
+        """
+        return self.capacities.get(type_, self.capacity)
+
+    def stats(self):
+        """
+        Return a dictionary with the cache counters.
+
+        """
+        with self._wlock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._mapping),
+                'queues': dict((k, len(v)) for k, v in self._queues.items()),
+            }
+
+    def reset_stats(self):
+        """Reset the hit, miss and eviction counters."""
+        with self._wlock:
+            self.hits = self.misses = self.evictions = 0
+
     def get(self, key, default=None):
         """
         Return an item from the cache dict or ``default``
@@ -106,14 +162,14 @@ class LRUCache(object):
         Raise a `KeyError` if it does not exist.
         """
         with self._wlock:
-            value = self._mapping[key]
-            queue = self._queues.setdefault(type(value), deque())
-            if not len(queue) or queue[-1] != key:
-                try:
-                    queue.remove(key)
-                except ValueError:
-                    pass
-                queue.append(key)
+            try:
+                value = self._mapping[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            queue = self._queues[type(value)]
+            _move_to_end(queue, key)
             return value
 
     def __setitem__(self, key, value):
@@ -127,11 +183,18 @@ class LRUCache(object):
                 del self[key]
             except KeyError:
                 pass
-            queue = self._queues.setdefault(type(value), deque())
-            if len(queue) == self.capacity:
-                del self._mapping[queue.popleft()]
-            self._mapping[key] = value
-            queue.append(key)
+            type_ = type(value)
+            try:
+                queue = self._queues[type_]
+            except KeyError:
+                queue = self._queues[type_] = OrderedDict()
+            capacity = self.get_capacity(type_)
+            while queue and len(queue) >= capacity:
+                del self._mapping[queue.popitem(last=False)[0]]
+                self.evictions += 1
+            if capacity > 0:
+                self._mapping[key] = value
+                queue[key] = None
 
     def __delitem__(self, key):
         """
@@ -140,17 +203,12 @@ class LRUCache(object):
 
         """
         with self._wlock:
-            try:
-                value = self._mapping[key]
-            except KeyError:
-                return
-            queue = self._queues.setdefault(type(value), deque())
-            try:
-                queue.remove(key)
-                if not len(queue):
-                    del self._queues[type(value)]
-            except ValueError:
-                pass
+            value = self._mapping.pop(key)
+            type_ = type(value)
+            queue = self._queues[type_]
+            del queue[key]
+            if not queue:
+                del self._queues[type_]
 
     def items(self):
         """
@@ -208,14 +266,138 @@ class LRUCache(object):
         coming first.
 
         """
-        return reversed(self)
+        return reversed(self.keys())
+
+    __copy__ = copy
+
+
+def _split_capacity(capacity, stripes):
+    if capacity <= 0:
+        return capacity
+    return max(1, -(-capacity // stripes))
+
+
+class StripedLRUCache(object):
+    """
+    A type-based LRU Cache split in ``stripes`` independent segments.
+
+    Keys are distributed among the segments by their hash and every segment
+    has its own lock, so concurrent threads rarely contend for the same lock.
+    The capacity is divided among the segments, which means the eviction
+    order is only LRU within each segment.
+
+    """
+
+    def __init__(self, capacity, capacities=None, stripes=8):
+        self.capacity = capacity
+        self.capacities = dict(capacities or {})
+        self.stripes = stripes
+        self._segments = tuple(
+            LRUCache(
+                _split_capacity(capacity, stripes),
+                dict((k, _split_capacity(v, stripes)) for k, v in self.capacities.items()),
+            ) for _ in range(stripes)
+        )
+
+    def __getnewargs__(self):
+        return (self.capacity,)
+
+    def _segment(self, key):
+        return self._segments[hash(key) % self.stripes]
+
+    def copy(self):
+        """
+        Return a shallow copy of the instance.
+
+        """
+        rv = self.__class__(self.capacity, self.capacities, self.stripes)
+        rv._segments = tuple(s.copy() for s in self._segments)
+        return rv
+
+    def stats(self):
+        """
+        Return a dictionary with the aggregated counters of all segments.
+
+        """
+        result = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'queues': {}}
+        for segment in self._segments:
+            stats = segment.stats()
+            for k in ('hits', 'misses', 'evictions', 'size'):
+                result[k] += stats[k]
+            for k, v in stats['queues'].items():
+                result['queues'][k] = result['queues'].get(k, 0) + v
+        return result
+
+    def reset_stats(self):
+        """Reset the hit, miss and eviction counters."""
+        for segment in self._segments:
+            segment.reset_stats()
+
+    def get(self, key, default=None):
+        return self._segment(key).get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self._segment(key).setdefault(key, default)
+
+    def clear(self):
+        """Clear the cache."""
+        for segment in self._segments:
+            segment.clear()
+
+    def __contains__(self, key):
+        return key in self._segment(key)
+
+    def __len__(self):
+        return sum(len(s) for s in self._segments)
+
+    def __repr__(self):
+        return '<%s %r>' % (
+            self.__class__.__name__,
+            dict(self.items())
+        )
+
+    def __getitem__(self, key):
+        return self._segment(key)[key]
+
+    def __setitem__(self, key, value):
+        self._segment(key)[key] = value
+
+    def __delitem__(self, key):
+        del self._segment(key)[key]
+
+    def items(self):
+        return [item for s in self._segments for item in s.items()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def values(self):
+        return [x[1] for x in self.items()]
+
+    def itervalue(self):
+        return iter(self.values())
+
+    def keys(self):
+        return [key for s in self._segments for key in s.keys()]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    __iter__ = iterkeys
+
+    def __reversed__(self):
+        return reversed(self.keys())
 
     __copy__ = copy
 
 
 # register the LRU cache as mutable mapping if possible
 try:
-    from collections import MutableMapping
+    try:
+        from collections.abc import MutableMapping
+    except ImportError:
+        from collections import MutableMapping
     MutableMapping.register(LRUCache)
+    MutableMapping.register(StripedLRUCache)
 except ImportError:
     pass
@@ -2,9 +2,10 @@
 # python -m unittest -v lru.tests
 
 import pickle
+from collections import deque
 import unittest
 
-from .cache import LRUCache
+from .cache import LRUCache, StripedLRUCache
 
 
 class LRUCacheTestCase(unittest.TestCase):
@@ -33,3 +34,63 @@ class LRUCacheTestCase(unittest.TestCase):
             self.assertEqual(copy.capacity, cache.capacity)
             self.assertEqual(copy._mapping, cache._mapping)
             self.assertEqual(copy._queues, cache._queues)
+
+    def test_unpickle_deque_queues(self):
+        # State pickled before the queues were linked hashes.
+        cache = LRUCache.__new__(LRUCache)
+        cache.__setstate__({
+            'capacity': 2,
+            '_mapping': {'foo': 42, 'bar': 23},
+            '_queues': {int: deque(['bar', 'foo'])},
+        })
+        self.assertEqual(list(cache._queues[int]), ['bar', 'foo'])
+        cache['bar']
+        cache['baz'] = 1
+        self.assertNotIn('foo', cache)
+        self.assertIn('bar', cache)
+        self.assertIn('baz', cache)
+
+    def test_delete(self):
+        d = LRUCache(3)
+        d['a'] = 1
+        d['b'] = 2
+        del d['a']
+        self.assertNotIn('a', d)
+        self.assertEqual(len(d), 1)
+        self.assertRaises(KeyError, d.__delitem__, 'a')
+        d['c'] = 3
+        d['d'] = 4
+        self.assertEqual(d.keys(), ['b', 'c', 'd'])
+
+    def test_capacities(self):
+        d = LRUCache(2, {str: 1})
+        d['a'] = 1
+        d['b'] = 'b'
+        d['c'] = 'c'
+        d['d'] = 2
+        d['e'] = 3
+        self.assertEqual(sorted(d.keys()), ['c', 'd', 'e'])
+
+    def test_stats(self):
+        d = LRUCache(2)
+        d['a'] = 1
+        d['b'] = 2
+        d['a']
+        d.get('x')
+        d['c'] = 3
+        stats = d.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['size'], 2)
+        self.assertNotIn('b', d)
+
+    def test_striped(self):
+        d = StripedLRUCache(100, stripes=4)
+        for i in range(10):
+            d[i] = i
+        self.assertEqual(len(d), 10)
+        self.assertEqual(d[3], 3)
+        del d[3]
+        self.assertNotIn(3, d)
+        self.assertEqual(d.stats()['hits'], 1)
@@ -128,6 +128,7 @@ from .shortnumberinfo import (ShortNumberCost,
                               is_emergency_number,
                               is_carrier_specific)
 from .phonenumbermatcher import PhoneNumberMatch, PhoneNumberMatcher, Leniency
+from .bulk import parse_many, is_valid_many, format_many
 
 
 # Version number is taken from the upstream libphonenumber version
@@ -193,6 +194,7 @@ __all__ = ['PhoneNumber', 'CountryCodeSource', 'FrozenPhoneNumber',
            'is_carrier_specific',
            # end of items from shortnumberinfo.py
            'PhoneNumberMatch', 'PhoneNumberMatcher', 'Leniency',
+           'parse_many', 'is_valid_many', 'format_many',
            ]
 
 if __name__ == '__main__':  # pragma no cover
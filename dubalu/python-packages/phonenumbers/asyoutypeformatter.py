@@ -28,7 +28,7 @@ import re
 
 from .util import u, unicod, U_EMPTY_STRING, U_SPACE
 from .unicode_util import digit as unicode_digit
-from .re_util import fullmatch
+from .re_util import fullmatch, cached_compile
 from .phonemetadata import PhoneMetadata
 from .phonenumberutil import _VALID_PUNCTUATION, REGION_CODE_FOR_NON_GEO_ENTITY
 from .phonenumberutil import _PLUS_SIGN, _PLUS_CHARS_PATTERN
@@ -159,7 +159,7 @@ class AsYouTypeFormatter(object):
             format = self._possible_formats[ii]
             ii += 1
             if len(format.leading_digits_pattern) > index_of_leading_digits_pattern:
-                leading_digits_pattern = re.compile(format.leading_digits_pattern[index_of_leading_digits_pattern])
+                leading_digits_pattern = cached_compile(format.leading_digits_pattern[index_of_leading_digits_pattern])
                 m = leading_digits_pattern.match(leading_digits)
                 if not m:
                     # remove the element we've just examined, now at (ii-1)
@@ -392,7 +392,7 @@ class AsYouTypeFormatter(object):
         instead of any other formatting template whose leadingDigitsPattern also matches the input.
         """
         for number_format in self._possible_formats:
-            num_re = re.compile(number_format.pattern)
+            num_re = number_format.pattern_re
             if fullmatch(num_re, self._national_number):
                 if number_format.national_prefix_formatting_rule is None:
                     self._should_add_space_after_national_prefix = False
@@ -487,7 +487,7 @@ class AsYouTypeFormatter(object):
             self._prefix_before_national_number += unicod("1") + _SEPARATOR_BEFORE_NATIONAL_NUMBER
             self._is_complete_number = True
         elif self._current_metadata.national_prefix_for_parsing is not None:
-            npp_re = re.compile(self._current_metadata.national_prefix_for_parsing)
+            npp_re = cached_compile(self._current_metadata.national_prefix_for_parsing)
             m = npp_re.match(self._national_number)
             # Since some national prefix patterns are entirely optional, check
             # that a national prefix could actually be extracted.
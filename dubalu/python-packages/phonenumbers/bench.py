@@ -0,0 +1,86 @@
+"""Micro-benchmark: parse, validate and format mixed-region phone numbers
+
+    python -m phonenumbers.bench [count [processes]]
+
+The numbers are built from the fixed line and mobile example numbers of
+every supported region, written in national format.  They are handled one by
+one in a loop and then through the bulk API (bulk.py), in-process and with
+a pool of worker processes.
+"""
+import multiprocessing
+import sys
+import time
+
+from .util import prnt
+from .phonenumberutil import SUPPORTED_REGIONS, PhoneNumberType, PhoneNumberFormat
+from .phonenumberutil import example_number_for_type, format_number, is_valid_number, parse
+from .bulk import parse_many, is_valid_many, format_many
+
+
+def sample_numbers(count):
+    """Return count (number, region) tuples, cycling over all the regions."""
+    samples = []
+    for region in sorted(SUPPORTED_REGIONS):
+        for num_type in (PhoneNumberType.FIXED_LINE, PhoneNumberType.MOBILE):
+            numobj = example_number_for_type(region, num_type)
+            if numobj is not None:
+                samples.append((format_number(numobj, PhoneNumberFormat.NATIONAL), region))
+    return [samples[i % len(samples)] for i in range(count)]
+
+
+def _loop(numbers):
+    numobjs = [parse(number, region) for number, region in numbers]
+    valid = [is_valid_number(numobj) for numobj in numobjs]
+    formatted = [format_number(numobj, PhoneNumberFormat.INTERNATIONAL) for numobj in numobjs]
+    return valid, formatted
+
+
+def _bulk(numbers, pool=None):
+    # Parse region by region (as an import of a per-country file would do).
+    numobjs = []
+    for region in sorted(set(region for number, region in numbers)):
+        numobjs.extend(parse_many((number for number, r in numbers if r == region), region, pool=pool))
+    valid = list(is_valid_many(numobjs, pool=pool))
+    formatted = list(format_many(numobjs, PhoneNumberFormat.INTERNATIONAL, pool=pool))
+    return valid, formatted
+
+
+def main(count=100000, processes=None):
+    numbers = sample_numbers(count)
+
+    start = time.time()
+    numobjs = [parse(number, region) for number, region in numbers]
+    parse_time = time.time() - start
+
+    start = time.time()
+    valid = sum(1 for numobj in numobjs if is_valid_number(numobj))
+    validate_time = time.time() - start
+
+    start = time.time()
+    for numobj in numobjs:
+        format_number(numobj, PhoneNumberFormat.INTERNATIONAL)
+    format_time = time.time() - start
+
+    prnt("%d numbers (%d valid)" % (count, valid))
+    for name, elapsed in (('parse', parse_time), ('validate', validate_time), ('format', format_time)):
+        prnt("%10s %8.2fs %10d/s" % (name, elapsed, count / elapsed))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        prnt("parse + validate + format:")
+        for name, func, args in (('loop', _loop, ()),
+                                 ('bulk', _bulk, ()),
+                                 ('bulk x%d' % processes, _bulk, (pool,))):
+            start = time.time()
+            func(numbers, *args)
+            elapsed = time.time() - start
+            prnt("%10s %8.2fs %10d/s" % (name, elapsed, count / elapsed))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+if __name__ == '__main__':  # pragma no cover
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,150 @@
+"""Bulk phone number parsing, validation and formatting
+
+These functions take an iterable and return a generator yielding one result
+per input item, in the same order, so arbitrarily big inputs (e.g. the rows
+of a CSV file) can be streamed through them:
+
+>>> import phonenumbers
+>>> from phonenumbers.bulk import parse_many, is_valid_many, format_many
+>>> numobjs = list(parse_many(["020 8366 1177", "+1 650 253 0000", "nope"], "GB"))
+>>> numobjs[2] is None
+True
+>>> list(is_valid_many(numobjs[:2]))
+[True, True]
+>>> [str(n) for n in format_many(numobjs[:2], phonenumbers.PhoneNumberFormat.E164)]
+['+442083661177', '+16502530000']
+
+They are thin wrappers of the public functions (parse(), is_valid_number()
+and format_number()).  The input is processed in chunks of chunk_size items;
+within a chunk the numbers are grouped by country calling code, so the
+region of the countries with a single one is resolved once per chunk.
+Passing a multiprocessing pool spreads the chunks over its worker
+processes, which is what makes a difference for big inputs.
+"""
+from .phonenumberutil import COUNTRY_CODE_TO_REGION_CODE, NumberParseException
+from .phonenumberutil import parse, is_valid_number, is_valid_number_for_region, format_number
+
+__all__ = ['parse_many', 'is_valid_many', 'format_many']
+
+_DEFAULT_CHUNK_SIZE = 10000
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _by_country_code(numobjs):
+    """Return a dictionary mapping country codes to the indexes of the
+    (not None) numbers with that country code."""
+    groups = {}
+    for index, numobj in enumerate(numobjs):
+        if numobj is not None:
+            groups.setdefault(numobj.country_code, []).append(index)
+    return groups
+
+
+def _parse_chunk(args):
+    numbers, region, keep_raw_input, ignore_errors = args
+    result = []
+    for number in numbers:
+        try:
+            result.append(parse(number, region, keep_raw_input))
+        except NumberParseException:
+            if not ignore_errors:
+                raise
+            result.append(None)
+    return result
+
+
+def _is_valid_chunk(args):
+    numobjs, = args
+    result = [False] * len(numobjs)
+    for country_code, indexes in _by_country_code(numobjs).items():
+        regions = COUNTRY_CODE_TO_REGION_CODE.get(country_code, None)
+        if not regions:
+            continue
+        if len(regions) == 1:
+            region_code = regions[0]
+            for index in indexes:
+                result[index] = is_valid_number_for_region(numobjs[index], region_code)
+        else:
+            # The region depends on the number
+            for index in indexes:
+                result[index] = is_valid_number(numobjs[index])
+    return result
+
+
+def _format_chunk(args):
+    numobjs, num_format = args
+    return [None if numobj is None else format_number(numobj, num_format) for numobj in numobjs]
+
+
+def _map_chunks(func, chunks, pool):
+    if pool is None:
+        for chunk in chunks:
+            for item in func(chunk):
+                yield item
+    else:
+        for result in pool.imap(func, chunks):
+            for item in result:
+                yield item
+
+
+def parse_many(numbers, region=None, keep_raw_input=False, ignore_errors=True,
+               chunk_size=_DEFAULT_CHUNK_SIZE, pool=None):
+    """Parse strings into PhoneNumber objects.
+
+    Arguments:
+    numbers -- An iterable of numbers to parse (see parse()).
+    region -- The region that we are expecting the numbers to be from.
+    keep_raw_input -- Whether to populate the raw_input field of the results.
+    ignore_errors -- If True (the default) numbers which can't be parsed
+              yield None, otherwise NumberParseException is raised.
+    chunk_size -- How many numbers are handled at a time.
+    pool -- A multiprocessing.Pool to spread the chunks over (None to work
+              in-process).
+
+    Returns a generator of PhoneNumber objects (or None)."""
+    chunks = ((chunk, region, keep_raw_input, ignore_errors) for chunk in _chunks(numbers, chunk_size))
+    return _map_chunks(_parse_chunk, chunks, pool)
+
+
+def is_valid_many(numobjs, chunk_size=_DEFAULT_CHUNK_SIZE, pool=None):
+    """Test whether phone numbers match a valid pattern (see is_valid_number()).
+
+    Arguments:
+    numobjs -- An iterable of PhoneNumber objects; None items yield False.
+    chunk_size -- How many numbers are handled at a time.
+    pool -- A multiprocessing.Pool to spread the chunks over (None to work
+              in-process).
+
+    Returns a generator of booleans."""
+    chunks = ((chunk,) for chunk in _chunks(numobjs, chunk_size))
+    return _map_chunks(_is_valid_chunk, chunks, pool)
+
+
+def format_many(numobjs, num_format, chunk_size=_DEFAULT_CHUNK_SIZE, pool=None):
+    """Format phone numbers in the given format (see format_number()).
+
+    Arguments:
+    numobjs -- An iterable of PhoneNumber objects; None items yield None.
+    num_format -- The format the phone numbers should be formatted into.
+    chunk_size -- How many numbers are handled at a time.
+    pool -- A multiprocessing.Pool to spread the chunks over (None to work
+              in-process).
+
+    Returns a generator of formatted numbers (or None)."""
+    chunks = ((chunk, num_format) for chunk in _chunks(numobjs, chunk_size))
+    return _map_chunks(_format_chunk, chunks, pool)
+
+
+if __name__ == '__main__':  # pragma no cover
+    import doctest
+    doctest.testmod()
@@ -30,8 +30,14 @@ from .phonenumberutil import PhoneNumberType, number_type
 from .phonenumberutil import region_code_for_number
 from .phonenumberutil import is_mobile_number_portable_region
 from .prefix import _prefix_description_for_number
+from .prefixdb import get_prefix_db
 try:
-    from .carrierdata import CARRIER_DATA, CARRIER_LONGEST_PREFIX
+    _prefix_db = get_prefix_db()
+    if _prefix_db is not None:
+        CARRIER_DATA = _prefix_db['carrier']
+        CARRIER_LONGEST_PREFIX = CARRIER_DATA.longest_prefix
+    else:
+        from .carrierdata import CARRIER_DATA, CARRIER_LONGEST_PREFIX
 except ImportError:  # pragma no cover
     # Before the generated code exists, the carrierdata/ directory is empty.
     # The generation process imports this module, creating a circular
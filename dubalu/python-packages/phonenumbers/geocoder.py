@@ -49,9 +49,16 @@ from .phonenumberutil import region_code_for_number, PhoneNumberType, PhoneNumbe
 from .phonenumberutil import country_mobile_token, national_significant_number, number_type
 from .phonenumberutil import region_code_for_country_code, parse, NumberParseException
 from .prefix import _prefix_description_for_number
+from .prefixdb import get_prefix_db
 try:
-    from .geodata import GEOCODE_DATA, GEOCODE_LONGEST_PREFIX
-    from .geodata.locale import LOCALE_DATA
+    _prefix_db = get_prefix_db()
+    if _prefix_db is not None:
+        GEOCODE_DATA = _prefix_db['geocode']
+        GEOCODE_LONGEST_PREFIX = GEOCODE_DATA.longest_prefix
+        LOCALE_DATA = _prefix_db['locale']
+    else:
+        from .geodata import GEOCODE_DATA, GEOCODE_LONGEST_PREFIX
+        from .geodata.locale import LOCALE_DATA
 except ImportError:  # pragma no cover
     # Before the generated code exists, the geodata/ directory is empty.
     # The generation process imports this module, creating a circular
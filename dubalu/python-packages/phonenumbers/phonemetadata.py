@@ -17,11 +17,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from .util import UnicodeMixin, ImmutableMixin, mutating_method
-from .util import u, unicod, rpr, force_unicode
+from .util import u, unicod, rpr, force_unicode, U_EMPTY_STRING
+from .re_util import cached_compile
 
 REGION_CODE_FOR_NON_GEO_ENTITY = u("001")
 
 
+def _compiled_pattern(obj, name, pattern):
+    """Return the pattern compiled, keeping it in the object under the given
+    name (compiled patterns are not part of the metadata itself, so they are
+    stored directly in the instance dictionary, skipping the immutability
+    check; they are recompiled if the pattern changes, e.g. by merge_from)."""
+    compiled = obj.__dict__.get(name)
+    if compiled is None or compiled.pattern != pattern:
+        compiled = obj.__dict__[name] = cached_compile(pattern)
+    return compiled
+
+
 class NumberFormat(UnicodeMixin, ImmutableMixin):
     """Representation of way that a phone number can be formatted for output"""
     @mutating_method
@@ -101,6 +113,18 @@ class NumberFormat(UnicodeMixin, ImmutableMixin):
         # are used for a certain country.
         self.domestic_carrier_code_formatting_rule = force_unicode(domestic_carrier_code_formatting_rule)  # None or Unicode string
 
+    @property
+    def pattern_re(self):
+        """The compiled pattern."""
+        return _compiled_pattern(self, '_pattern_re', self.pattern)
+
+    @property
+    def leading_digits_re(self):
+        """The compiled last (most detailed) leading_digits_pattern, or None."""
+        if not self.leading_digits_pattern:
+            return None
+        return _compiled_pattern(self, '_leading_digits_re', self.leading_digits_pattern[-1])
+
     def merge_from(self, other):
         """Merge information from another NumberFormat object into this one."""
         if other.pattern is not None:
@@ -167,6 +191,16 @@ class PhoneNumberDesc(UnicodeMixin, ImmutableMixin):
         # should not contain any formatting information.
         self.example_number = force_unicode(example_number)  # None or Unicode string
 
+    @property
+    def national_number_re(self):
+        """The compiled national_number_pattern."""
+        return _compiled_pattern(self, '_national_number_re', self.national_number_pattern or U_EMPTY_STRING)
+
+    @property
+    def possible_number_re(self):
+        """The compiled possible_number_pattern."""
+        return _compiled_pattern(self, '_possible_number_re', self.possible_number_pattern or U_EMPTY_STRING)
+
     def merge_from(self, other):
         """Merge information from another PhoneNumberDesc object into this one."""
         if other.national_number_pattern is not None:
@@ -512,6 +546,13 @@ class PhoneMetadata(UnicodeMixin, ImmutableMixin):
             else:
                 kls_map[id] = self
 
+    @property
+    def leading_digits_re(self):
+        """The compiled leading_digits pattern, or None."""
+        if self.leading_digits is None:
+            return None
+        return _compiled_pattern(self, '_leading_digits_re', self.leading_digits)
+
     def __eq__(self, other):
         if not isinstance(other, PhoneMetadata):
             return False
@@ -30,7 +30,7 @@ author: David Drysdale (Python version)
 import sys
 import re
 
-from .re_util import fullmatch   # Extra regexp function; see README
+from .re_util import fullmatch, cached_compile   # Extra regexp functions; see README
 from .util import UnicodeMixin, u, unicod, prnt, to_long
 from .util import U_EMPTY_STRING, U_SPACE, U_DASH, U_TILDE, U_ZERO, U_SEMICOLON
 from .unicode_util import digit as unicode_digit
@@ -1442,11 +1442,9 @@ def choose_formatting_pattern_for_number(available_formats, national_number):
         size = len(num_format.leading_digits_pattern)
         # We always use the last leading_digits_pattern, as it is the most detailed.
         if size > 0:
-            ld_pattern = re.compile(num_format.leading_digits_pattern[-1])
-            ld_match = ld_pattern.match(national_number)
+            ld_match = num_format.leading_digits_re.match(national_number)
         if size == 0 or ld_match:
-            format_pattern = re.compile(num_format.pattern)
-            if fullmatch(format_pattern, national_number):
+            if fullmatch(num_format.pattern_re, national_number):
                 return num_format
     return None
 
@@ -1456,7 +1454,7 @@ def format_nsn_using_pattern(national_number, formatting_pattern, number_format,
     # Note that carrier_code is optional - if None or an empty string, no
     # carrier code replacement will take place.
     number_format_rule = formatting_pattern.format
-    m_re = re.compile(formatting_pattern.pattern)
+    m_re = formatting_pattern.pattern_re
     formatted_national_number = U_EMPTY_STRING
 
     if (number_format == PhoneNumberFormat.NATIONAL and
@@ -1663,17 +1661,15 @@ def _number_type_helper(national_number, metadata):
 def _is_number_possible_for_desc(national_number, number_desc):
     if number_desc is None:
         return False
-    possible_re = re.compile(number_desc.possible_number_pattern or U_EMPTY_STRING)
-    return fullmatch(possible_re, national_number)
+    return fullmatch(number_desc.possible_number_re, national_number)
 
 
 def _is_number_matching_desc(national_number, number_desc):
     """Determine if the number matches the given PhoneNumberDesc"""
     if number_desc is None:
         return False
-    national_re = re.compile(number_desc.national_number_pattern or U_EMPTY_STRING)
     return (_is_number_possible_for_desc(national_number, number_desc) and
-            fullmatch(national_re, national_number))
+            fullmatch(number_desc.national_number_re, national_number))
 
 
 def is_valid_number(numobj):
@@ -1770,8 +1766,7 @@ def _region_code_for_number_from_list(numobj, regions):
         if metadata is None:
             continue
         if metadata.leading_digits is not None:
-            leading_digit_re = re.compile(metadata.leading_digits)
-            match = leading_digit_re.match(national_number)
+            match = metadata.leading_digits_re.match(national_number)
             if match:
                 return region_code
         elif _number_type_helper(national_number, metadata) != PhoneNumberType.UNKNOWN:
@@ -1954,8 +1949,7 @@ def _is_shorter_than_possible_normal_number(metadata, number):
     """Helper method to check whether a number is too short to be a regular
     length phone number in a region.
     """
-    possible_number_pattern = re.compile(metadata.general_desc.possible_number_pattern or U_EMPTY_STRING)
-    return (_test_number_length_against_pattern(possible_number_pattern, number) ==
+    return (_test_number_length_against_pattern(metadata.general_desc.possible_number_re, number) ==
             ValidationResult.TOO_SHORT)
 
 
@@ -2011,8 +2005,7 @@ def is_possible_number_with_reason(numobj):
             return ValidationResult.TOO_LONG
         else:
             return ValidationResult.IS_POSSIBLE
-    possible_re = re.compile(general_desc.possible_number_pattern or U_EMPTY_STRING)
-    return _test_number_length_against_pattern(possible_re, national_number)
+    return _test_number_length_against_pattern(general_desc.possible_number_re, national_number)
 
 
 def is_possible_number_string(number, region_dialing_from):
@@ -2179,10 +2172,10 @@ def _maybe_extract_country_code(number, metadata, keep_raw_input, numobj):
         if normalized_number.startswith(default_country_code_str):
             potential_national_number = full_number[len(default_country_code_str):]
             general_desc = metadata.general_desc
-            valid_pattern = re.compile(general_desc.national_number_pattern or U_EMPTY_STRING)
+            valid_pattern = general_desc.national_number_re
             _, potential_national_number, _ = _maybe_strip_national_prefix_carrier_code(potential_national_number,
                                                                                         metadata)
-            possible_pattern = re.compile(general_desc.possible_number_pattern or U_EMPTY_STRING)
+            possible_pattern = general_desc.possible_number_re
 
             # If the number was not valid before but is valid now, or if it
             # was too long before, we consider the number with the country
@@ -2255,7 +2248,7 @@ def _maybe_strip_i18n_prefix_and_normalize(number, possible_idd_prefix):
                 _normalize(number))
 
     # Attempt to parse the first digits as an international prefix.
-    idd_pattern = re.compile(possible_idd_prefix)
+    idd_pattern = cached_compile(possible_idd_prefix)
     number = _normalize(number)
     stripped, number = _parse_prefix_as_idd(idd_pattern, number)
     if stripped:
@@ -2287,10 +2280,10 @@ def _maybe_strip_national_prefix_carrier_code(number, metadata):
         return (U_EMPTY_STRING, number, False)
 
     # Attempt to parse the first digits as a national prefix.
-    prefix_pattern = re.compile(possible_national_prefix)
+    prefix_pattern = cached_compile(possible_national_prefix)
     prefix_match = prefix_pattern.match(number)
     if prefix_match:
-        national_number_pattern = re.compile(metadata.general_desc.national_number_pattern or U_EMPTY_STRING)
+        national_number_pattern = metadata.general_desc.national_number_re
         # Check if the original number is viable.
         is_viable_original_number = fullmatch(national_number_pattern, number)
         # prefix_match.groups() == () implies nothing was captured by the
@@ -77,6 +77,17 @@ def _prefix_description_for_number(data, longest_prefix, numobj, lang, script=No
         # Can only hit this arm if there's an internal error in the rest of
         # the library
         raise Exception("Expect E164 number to start with +")
+    lookup_longest_prefix = getattr(data, 'lookup_longest_prefix', None)
+    if lookup_longest_prefix is not None:
+        # A compiled prefix table (see prefixdb.py) finds it in a single search.
+        langdict = lookup_longest_prefix(e164_num[1:])
+        if langdict is None:
+            return U_EMPTY_STRING
+        name = _find_lang(langdict, lang, script, region)
+        if name is not None:
+            return name
+        else:
+            return U_EMPTY_STRING
     for prefix_len in range(longest_prefix, 0, -1):
         prefix = e164_num[1:(1 + prefix_len)]
         if prefix in data:
@@ -0,0 +1,287 @@
+"""Compiled, memory-mapped prefix database
+
+The generated geocoding, carrier and timezone data (geodata/, carrierdata/
+and tzdata/) is made of huge Python dictionary literals which every process
+has to import and keep in memory.  This module compiles all of it into a
+single binary file which is mmap'ed on first use, so importing is almost free
+and the pages are shared by all the (pre-forked) processes using it.
+
+To build the database (run it again whenever the generated data changes):
+
+    python -m phonenumbers.prefixdb [path]
+
+The file is looked up in the PHONENUMBERS_PREFIXDB environment variable or
+next to this module (prefixdata.bin).  If it does not exist, the geocoder,
+carrier and timezone modules keep using the Python dictionaries.
+
+File layout (all integers are little endian):
+
+    header:     magic "PNPD", version, number of tables, values offset (uint32)
+    directory:  one entry per table: name (16s), offset, count, key width,
+                longest prefix (uint32)
+    tables:     count records sorted by key: key (NUL padded to key width),
+                parent (int32), value offset, value length (uint32)
+    values:     UTF-8 encoded, de-duplicated values
+
+The parent of a record is the index of the longest key in the table which is
+a proper prefix of its own key (or -1), which allows the longest prefix of a
+number to be found with a single binary search.
+"""
+import mmap
+import os
+import struct
+import sys
+
+from .util import prnt
+
+__all__ = ['PrefixDatabase', 'PrefixTable', 'build_prefix_db', 'get_prefix_db']
+
+_MAGIC = b'PNPD'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIII')
+_DIRECTORY_ENTRY = struct.Struct('<16sIIII')
+
+_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prefixdata.bin')
+
+# Value serialization: a type marker followed by the separated items.
+_DICT, _TUPLE, _STRING = b'd', b't', b's'
+_ITEM_SEP, _KEY_SEP = b'\x1e', b'\x1f'
+_U_ITEM_SEP, _U_KEY_SEP = _ITEM_SEP.decode('ascii'), _KEY_SEP.decode('ascii')
+
+if sys.version_info >= (3, 0):  # pragma no cover
+    _byte = lambda b, i: b[i:i + 1]
+else:  # pragma no cover
+    _byte = lambda b, i: b[i]
+
+
+def _encode_value(value):
+    if isinstance(value, dict):
+        return _DICT + _ITEM_SEP.join(k.encode('utf-8') + _KEY_SEP + v.encode('utf-8')
+                                      for k, v in sorted(value.items()))
+    if isinstance(value, tuple):
+        return _TUPLE + _ITEM_SEP.join(v.encode('utf-8') for v in value)
+    return _STRING + value.encode('utf-8')
+
+
+def _decode_value(data):
+    kind, data = _byte(data, 0), data[1:].decode('utf-8')
+    if kind == _DICT:
+        if not data:
+            return {}
+        return dict(item.split(_U_KEY_SEP, 1) for item in data.split(_U_ITEM_SEP))
+    if kind == _TUPLE:
+        if not data:
+            return ()
+        return tuple(data.split(_U_ITEM_SEP))
+    return data
+
+
+class PrefixTable(object):
+    """A read-only mapping of prefixes to values stored in a PrefixDatabase.
+
+    Supports the "in" and [] operators for exact lookups (so it can be used
+    in place of the generated dictionaries) and lookup_longest_prefix() to
+    find the value for the longest prefix of a number."""
+
+    def __init__(self, buf, name, offset, count, key_width, longest_prefix, values_offset):
+        self._buf = buf
+        self.name = name
+        self._offset = offset
+        self._count = count
+        self._key_width = key_width
+        self.longest_prefix = longest_prefix
+        self._values_offset = values_offset
+        self._record = struct.Struct('<%dsiII' % key_width)
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        return '<%s %s (%d prefixes)>' % (self.__class__.__name__, self.name, self._count)
+
+    def _key(self, index):
+        start = self._offset + index * self._record.size
+        return self._buf[start:start + self._key_width]
+
+    def _value(self, index):
+        key, parent, value_offset, value_length = self._record.unpack_from(self._buf, self._offset + index * self._record.size)
+        start = self._values_offset + value_offset
+        return _decode_value(self._buf[start:start + value_length])
+
+    def _bisect(self, key):
+        """Return the index of the last record whose key is <= key (or -1)."""
+        key = key.encode('ascii')[:self._key_width].ljust(self._key_width, b'\0')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._key(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1, key
+
+    def _index(self, key):
+        if len(key) > self._key_width:
+            return -1
+        try:
+            index, key = self._bisect(key)
+        except UnicodeError:
+            return -1
+        if index >= 0 and self._key(index) == key:
+            return index
+        return -1
+
+    def __contains__(self, key):
+        return self._index(key) >= 0
+
+    def __getitem__(self, key):
+        index = self._index(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._value(index)
+
+    def get(self, key, default=None):
+        index = self._index(key)
+        if index < 0:
+            return default
+        return self._value(index)
+
+    def keys(self):
+        return [self._key(i).rstrip(b'\0').decode('ascii') for i in range(self._count)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(self._key(i).rstrip(b'\0').decode('ascii'), self._value(i)) for i in range(self._count)]
+
+    def lookup_longest_prefix(self, number):
+        """Return the value for the longest key which is a prefix of number,
+        or None if there is no such key.
+
+        Arguments:
+        number -- A string of digits (e.g. the E164 number without the "+")."""
+        try:
+            index, _ = self._bisect(number)
+            number = number.encode('ascii')
+        except UnicodeError:
+            return None
+        # All the keys which are prefixes of number are also prefixes of the
+        # closest key below it, so only its chain of parents needs checking.
+        record = self._record
+        while index >= 0:
+            key, parent, value_offset, value_length = record.unpack_from(self._buf, self._offset + index * record.size)
+            if number.startswith(key.rstrip(b'\0')):
+                start = self._values_offset + value_offset
+                return _decode_value(self._buf[start:start + value_length])
+            index = parent
+        return None
+
+
+class PrefixDatabase(object):
+    """A compiled prefix database file, memory-mapped read-only.
+
+    Tables are available by name (e.g. db['geocode'])."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, values_offset = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("%s is not a prefix database (version %d)" % (path, _VERSION))
+        self.path = path
+        self.tables = {}
+        entries = [_DIRECTORY_ENTRY.unpack_from(self._buf, _HEADER.size + i * _DIRECTORY_ENTRY.size) for i in range(count)]
+        for name, offset, length, key_width, longest_prefix in entries:
+            name = name.rstrip(b'\0').decode('ascii')
+            self.tables[name] = PrefixTable(self._buf, name, offset, length, key_width, longest_prefix, values_offset)
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def close(self):
+        self._buf.close()
+
+
+def build_prefix_db(path, tables):
+    """Compile prefix dictionaries into a database file.
+
+    Arguments:
+    path -- The file to write.
+    tables -- A dictionary mapping table names to (data, longest_prefix)
+                  tuples, where data maps string prefixes to dictionaries,
+                  tuples or strings."""
+    values = []
+    value_offsets = {}
+    values_size = 0
+    compiled = []
+    for name in sorted(tables):
+        data, longest_prefix = tables[name]
+        keys = sorted(data)
+        key_width = max(len(k) for k in keys) if keys else 1
+        indexes = dict((k, i) for i, k in enumerate(keys))
+        record = struct.Struct('<%dsiII' % key_width)
+        records = []
+        for key in keys:
+            parent = -1
+            for prefix_len in range(len(key) - 1, 0, -1):
+                parent = indexes.get(key[:prefix_len], -1)
+                if parent >= 0:
+                    break
+            value = _encode_value(data[key])
+            if value not in value_offsets:
+                value_offsets[value] = values_size
+                values.append(value)
+                values_size += len(value)
+            records.append(record.pack(key.encode('ascii'), parent, value_offsets[value], len(value)))
+        compiled.append((name, key_width, longest_prefix, records))
+
+    offset = _HEADER.size + len(compiled) * _DIRECTORY_ENTRY.size
+    values_offset = offset + sum(len(r) for c in compiled for r in c[3])
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(compiled), values_offset))
+        for name, key_width, longest_prefix, records in compiled:
+            f.write(_DIRECTORY_ENTRY.pack(name.encode('ascii'), offset, len(records), key_width, longest_prefix))
+            offset += sum(len(r) for r in records)
+        for name, key_width, longest_prefix, records in compiled:
+            f.write(b''.join(records))
+        f.write(b''.join(values))
+    os.rename(tmp, path)
+
+
+def _generated_tables():
+    from .geodata import GEOCODE_DATA, GEOCODE_LONGEST_PREFIX
+    from .geodata.locale import LOCALE_DATA
+    from .carrierdata import CARRIER_DATA, CARRIER_LONGEST_PREFIX
+    from .tzdata import TIMEZONE_DATA, TIMEZONE_LONGEST_PREFIX
+    return {
+        'geocode': (GEOCODE_DATA, GEOCODE_LONGEST_PREFIX),
+        'locale': (LOCALE_DATA, 0),
+        'carrier': (CARRIER_DATA, CARRIER_LONGEST_PREFIX),
+        'timezone': (TIMEZONE_DATA, TIMEZONE_LONGEST_PREFIX),
+    }
+
+
+_prefix_db = []
+
+
+def get_prefix_db():
+    """Return the shared PrefixDatabase, or None if it has not been built."""
+    if not _prefix_db:
+        path = os.environ.get('PHONENUMBERS_PREFIXDB', _DEFAULT_PATH)
+        try:
+            db = PrefixDatabase(path)
+        except (IOError, OSError, ValueError):
+            db = None
+        _prefix_db.append(db)
+    return _prefix_db[0]
+
+
+if __name__ == '__main__':  # pragma no cover
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('PHONENUMBERS_PREFIXDB', _DEFAULT_PATH)
+    build_prefix_db(path, _generated_tables())
+    prnt("Prefix database written to %s" % path)
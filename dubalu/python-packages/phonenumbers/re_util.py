@@ -23,6 +23,25 @@ with Java regular expression code.
 """
 import re
 
+# The metadata holds thousands of patterns, way more than the ~100 that the re
+# module caches, so compiled patterns are kept in a bigger cache of our own.
+_MAX_CACHE_SIZE = 5000
+_compiled_cache = {}
+_grouped_cache = {}
+
+
+def cached_compile(pattern, flags=0):
+    """Compile the pattern like re.compile() does, but caching the result in a
+    process-wide cache big enough to hold all the metadata patterns."""
+    key = (type(pattern), pattern, flags)
+    try:
+        return _compiled_cache[key]
+    except KeyError:
+        if len(_compiled_cache) >= _MAX_CACHE_SIZE:
+            _compiled_cache.clear()
+        compiled = _compiled_cache[key] = re.compile(pattern, flags)
+        return compiled
+
 
 def fullmatch(pattern, string, flags=0):
     """Try to apply the pattern at the start of the string, returning a match
@@ -30,7 +49,13 @@ def fullmatch(pattern, string, flags=0):
     # Build a version of the pattern with a non-capturing group around it.
     # This is needed to get m.end() to correctly report the size of the
     # matched expression (as per the final doctest above).
-    grouped_pattern = re.compile("^(?:%s)$" % pattern.pattern, pattern.flags)
+    key = (type(pattern.pattern), pattern.pattern, pattern.flags)
+    try:
+        grouped_pattern = _grouped_cache[key]
+    except KeyError:
+        if len(_grouped_cache) >= _MAX_CACHE_SIZE:
+            _grouped_cache.clear()
+        grouped_pattern = _grouped_cache[key] = re.compile("^(?:%s)$" % pattern.pattern, pattern.flags)
     m = grouped_pattern.match(string)
     if m and m.end() < len(string):
         # Incomplete match (which should never happen because of the $ at the
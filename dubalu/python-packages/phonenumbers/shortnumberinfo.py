@@ -18,7 +18,6 @@ Note most commercial short numbers are not handled here, but by phonenumberutil.
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import re
 
 from .re_util import fullmatch
 from .util import U_EMPTY_STRING
@@ -334,7 +333,7 @@ def _matches_emergency_number_helper(number, region_code, allow_prefix_match):
     metadata = PhoneMetadata.short_metadata_for_region(region_code.upper(), None)
     if metadata is None or metadata.emergency is None:
         return False
-    emergency_number_pattern = re.compile(metadata.emergency.national_number_pattern)
+    emergency_number_pattern = metadata.emergency.national_number_re
     normalized_number = normalize_digits_only(number)
 
     if not allow_prefix_match or region_code in _REGIONS_WHERE_EMERGENCY_NUMBERS_MUST_BE_EXACT:
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# python -m unittest -v phonenumbers.tests
+
+import os
+import shutil
+import itertools
+import multiprocessing
+import tempfile
+import unittest
+
+from .bench import sample_numbers
+from .bulk import parse_many, is_valid_many, format_many
+from .phonenumberutil import NumberParseException, PhoneNumberFormat, format_number, is_valid_number, parse
+from .prefixdb import PrefixDatabase, build_prefix_db, _generated_tables
+
+
+def _dict_longest_prefix(data, longest_prefix, number):
+    for prefix_len in range(longest_prefix, 0, -1):
+        prefix = number[:prefix_len]
+        if prefix in data:
+            return data[prefix]
+    return None
+
+
+class PrefixDatabaseTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tables = _generated_tables()
+        cls.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(cls.tmpdir, 'prefixdata.bin')
+        build_prefix_db(path, cls.tables)
+        cls.db = PrefixDatabase(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        shutil.rmtree(cls.tmpdir)
+
+    def test_exact(self):
+        for name, (data, longest_prefix) in self.tables.items():
+            table = self.db[name]
+            self.assertEqual(len(table), len(data))
+            self.assertEqual(table.longest_prefix, longest_prefix)
+            for prefix, value in data.items():
+                self.assertEqual(table[prefix], value, (name, prefix))
+            self.assertNotIn('', table)
+            self.assertNotIn('x', table)
+
+    def test_longest_prefix(self):
+        for name in ('geocode', 'carrier', 'timezone'):
+            data, longest_prefix = self.tables[name]
+            table = self.db[name]
+            for prefix in data:
+                for number in (prefix, prefix + '0', prefix + '9', prefix[:-1] + '0', prefix[:-1] + '9'):
+                    self.assertEqual(table.lookup_longest_prefix(number),
+                                     _dict_longest_prefix(data, longest_prefix, number),
+                                     (name, number))
+            self.assertIsNone(table.lookup_longest_prefix(''))
+
+
+class BulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.numbers = sample_numbers(1000) + [("+1 650 253 0000 ext. 12", "US"), ("1234", "GB"), ("nope", "GB")]
+
+    def test_parity(self):
+        numobjs = []
+        for number, region in self.numbers:
+            try:
+                numobjs.append(parse(number, region))
+            except NumberParseException:
+                numobjs.append(None)
+        self.assertEqual(list(is_valid_many(numobjs, chunk_size=100)),
+                         [n is not None and is_valid_number(n) for n in numobjs])
+        for num_format in (PhoneNumberFormat.E164, PhoneNumberFormat.NATIONAL, PhoneNumberFormat.INTERNATIONAL):
+            self.assertEqual(list(format_many(numobjs, num_format, chunk_size=100)),
+                             [format_number(n, num_format) if n is not None else None for n in numobjs])
+
+    def test_parse_order(self):
+        numbers = [n for n, r in sample_numbers(1000) if r == "GB"] + ["nope"]
+        expected = [parse(n, "GB") for n in numbers[:-1]] + [None]
+        self.assertEqual(list(parse_many(numbers, "GB", chunk_size=3)), expected)
+        self.assertRaises(NumberParseException, list, parse_many(numbers, "GB", ignore_errors=False))
+
+    def test_pool(self):
+        numobjs = [parse(n, r) for n, r in self.numbers[:200]]
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(list(format_many(numobjs, PhoneNumberFormat.E164, chunk_size=50, pool=pool)),
+                             [format_number(n, PhoneNumberFormat.E164) for n in numobjs])
+            self.assertEqual(list(is_valid_many(numobjs, chunk_size=50, pool=pool)),
+                             [is_valid_number(n) for n in numobjs])
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def test_streaming(self):
+        numbers = itertools.chain(["020 8366 1177"], itertools.repeat("nope"))
+        self.assertEqual(next(parse_many(numbers, "GB", chunk_size=1)), parse("020 8366 1177", "GB"))
@@ -37,8 +37,14 @@
 from .util import prnt, u, U_PLUS
 from .phonenumberutil import PhoneNumberType, number_type
 from .phonenumberutil import PhoneNumberFormat, format_number
+from .prefixdb import get_prefix_db
 try:
-    from .tzdata import TIMEZONE_DATA, TIMEZONE_LONGEST_PREFIX
+    _prefix_db = get_prefix_db()
+    if _prefix_db is not None:
+        TIMEZONE_DATA = _prefix_db['timezone']
+        TIMEZONE_LONGEST_PREFIX = TIMEZONE_DATA.longest_prefix
+    else:
+        from .tzdata import TIMEZONE_DATA, TIMEZONE_LONGEST_PREFIX
 except ImportError:  # pragma no cover
     # Before the generated code exists, the carrierdata/ directory is empty.
     # The generation process imports this module, creating a circular
@@ -78,6 +84,12 @@ def time_zones_for_geographical_number(numobj):
         # Can only hit this arm if there's an internal error in the rest of
         # the library
         raise Exception("Expect E164 number to start with +")
+    if hasattr(TIMEZONE_DATA, 'lookup_longest_prefix'):
+        # A compiled prefix table (see prefixdb.py) finds it in a single search.
+        time_zones = TIMEZONE_DATA.lookup_longest_prefix(e164_num[1:])
+        if time_zones is None:
+            return _UNKNOWN_TIME_ZONE_LIST
+        return time_zones
     for prefix_len in range(TIMEZONE_LONGEST_PREFIX, 0, -1):
         prefix = e164_num[1:(1 + prefix_len)]
         if prefix in TIMEZONE_DATA:
@@ -12,3 +12,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dubalusim.settings")
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# Load the registered UUID nodes before the first request. The connections
+# are closed afterwards, so forked workers (uwsgi, gunicorn --preload) don't
+# inherit (and share) them.
+from django.db import connections
+from uuidfield.utils import warmup_nodes
+warmup_nodes()
+for connection in connections.all():
+    connection.close()